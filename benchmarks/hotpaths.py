@@ -0,0 +1,336 @@
+"""Micro-benchmarks for the parsing and encoding hot paths.
+
+Times EzidSearch.parseSearchResults and the EZIDClient ANVL methods, and
+records the peak memory allocated by one call as seen by tracemalloc, against
+synthetic corpora: search result pages of a few sizes, generated by the
+local stand-in EZID, and ANVL view responses carrying DataCite and CrossRef
+XML documents.
+
+Each run can be saved as a baseline, tagged with the git commit, and
+compared against an earlier baseline; cases that slowed down by more than
+the threshold are flagged and the exit status is non-zero::
+
+    python benchmarks/hotpaths.py --save
+    # ... change code ...
+    python benchmarks/hotpaths.py --compare latest
+"""
+
+import datetime
+import glob
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import timeit
+import tracemalloc
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ezid_query.anvl
+import ezid_query.apicli
+import ezid_query.ezidq
+import ezid_query.fakeezid
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+DEFAULT_THRESHOLD = 0.1
+"""Fractional slowdown flagged as a regression
+"""
+
+# Page chrome surrounding the results on the real search page, so that the
+# parser has a realistic amount of unrelated markup to skip over
+PAGE_CHROME = (
+    '<nav class="header__nav">'
+    + "".join(
+        f'<a class="header__nav-item" href="/p{i}">Item {i}</a>' for i in range(40)
+    )
+    + "</nav>"
+    + '<div class="search__form">'
+    + "".join(
+        f'<label for="f{i}">Field {i}</label><input id="f{i}" name="f{i}" type="text">'
+        for i in range(30)
+    )
+    + "</div>"
+)
+
+DATACITE_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<resource xmlns="http://datacite.org/schema/kernel-4">
+  <identifier identifierType="DOI">10.5072/FK2TEST</identifier>
+  <creators>
+{creators}  </creators>
+  <titles><title>A test record: 100% synthetic</title></titles>
+  <publisher>test-publisher</publisher>
+  <publicationYear>2021</publicationYear>
+  <resourceType resourceTypeGeneral="Dataset">Dataset</resourceType>
+</resource>
+"""
+
+CROSSREF_XML = """<?xml version="1.0"?>
+<book xmlns="http://www.crossref.org/schema/4.3.4" book_type="monograph">
+  <book_metadata>
+    <contributors>
+{contributors}    </contributors>
+    <titles><title>Remembrance of Things Past</title></titles>
+    <doi_data><doi>10.15697/TEST</doi><resource>http://example.net/</resource></doi_data>
+  </book_metadata>
+</book>
+"""
+
+
+def searchPage(hits):
+    ezid = ezid_query.fakeezid.FakeEZID(search_total=max(hits, 1) * 10)
+    page = ezid.searchPage({"ps": hits})
+    return page.replace(
+        '<div class="customize-table">', PAGE_CHROME + '<div class="customize-table">'
+    )
+
+
+def metadata(n_people, crossref=False):
+    md = {
+        "_owner": "apitest",
+        "_ownergroup": "apitest",
+        "_profile": "datacite",
+        "_status": "public",
+        "_export": "yes",
+        "_target": "http://example.net/",
+        "datacite.title": "test-title",
+        "datacite.publisher": "test-publisher",
+        "datacite.publicationyear": "2021",
+        "datacite.resourcetype": "Dataset",
+    }
+    people = "".join(
+        f"    <creator><creatorName>Creator {i}, Test</creatorName></creator>\n"
+        for i in range(n_people)
+    )
+    md["datacite"] = DATACITE_XML.format(creators=people)
+    if crossref:
+        people = "".join(
+            f'      <person_name contributor_role="author" sequence="additional">'
+            f"<given_name>Given{i}</given_name><surname>Surname{i}</surname>"
+            f"</person_name>\n"
+            for i in range(n_people)
+        )
+        md["crossref"] = CROSSREF_XML.format(contributors=people)
+    return md
+
+
+def anvlResponse(md):
+    body = ezid_query.anvl.formatDict(md)
+    return (
+        "success: doi:10.5072/FK2TEST\n_created: 1634000000\n_updated: 1634000100\n"
+        + body
+    )
+
+
+def anvlArgs(md):
+    args = []
+    for k, v in md.items():
+        args += [k.encode("utf-8"), v.encode("utf-8")]
+    return args
+
+
+def cases():
+    """Benchmark cases as (name, callable, bytes processed per call)."""
+    cli = ezid_query.apicli.EZIDClient("http://localhost", session_id="x")
+    res = []
+    for label, hits in (("small", 1), ("typical", 20), ("huge", 1000)):
+        page = searchPage(hits)
+        for parser in ezid_query.ezidq.EzidSearch.PARSERS:
+            search = ezid_query.ezidq.EzidSearch(
+                base_url="http://localhost", parser=parser
+            )
+            name = f"parseSearchResults.{label}"
+            if parser != ezid_query.ezidq.EzidSearch.PARSER_LXML:
+                name = f"{name}.{parser}"
+            res.append(
+                (
+                    name,
+                    lambda search=search, page=page: search.parseSearchResults(page),
+                    len(page),
+                )
+            )
+    for label, md in (
+        ("typical", metadata(3)),
+        ("crossref", metadata(50, crossref=True)),
+        ("crossref-huge", metadata(2000, crossref=True)),
+    ):
+        response = anvlResponse(md)
+        args = anvlArgs(md)
+        res += [
+            (
+                f"anvlresponseToDict.{label}",
+                lambda r=response: cli.anvlresponseToDict(r, decode=True),
+                len(response),
+            ),
+            (
+                f"anvlResponseToText.{label}",
+                lambda r=response: cli.anvlResponseToText(r, decode=True),
+                len(response),
+            ),
+            (
+                f"formatAnvlRequest.{label}",
+                lambda a=args: cli.formatAnvlRequest(a),
+                len(response),
+            ),
+        ]
+    return res
+
+
+def measure(func, repeat=5, min_time=0.2):
+    """Best per-call time in seconds over repeat runs of at least min_time."""
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        t = timer.timeit(number)
+        if t >= min_time:
+            break
+        number *= 2 if t <= 0 else max(2, int(min_time / t) + 1)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def peakMemory(func):
+    """Peak bytes allocated by one call of func, as traced by tracemalloc.
+
+    Includes allocations of C extensions made through the Python allocator,
+    such as lxml's, but not libxml2's own.
+    """
+    func()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def gitCommit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def run(name_filter=None, repeat=5):
+    results = {}
+    for name, func, nbytes in cases():
+        if name_filter and name_filter not in name:
+            continue
+        seconds = measure(func, repeat=repeat)
+        results[name] = {
+            "seconds": seconds,
+            "bytes": nbytes,
+            "mb_per_sec": nbytes / seconds / 1e6,
+            "peak_bytes": peakMemory(func),
+        }
+        logging.info("%s: %.3f ms", name, seconds * 1e3)
+    return {
+        "commit": gitCommit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def loadBaseline(path, commit=None):
+    """Load a saved run.
+
+    "latest" selects the most recently recorded run of a commit other than
+    commit, so a run is never compared with itself or with a save of the
+    same commit, whatever the file modification times.
+    """
+    if path != "latest":
+        with open(path) as f:
+            return json.load(f)
+    own = (commit or "").replace("-dirty", "")
+    latest = None
+    for fn in glob.glob(os.path.join(RESULTS_DIR, "*.json")):
+        with open(fn) as f:
+            data = json.load(f)
+        if own and data.get("commit", "").replace("-dirty", "") == own:
+            continue
+        if latest is None or data.get("timestamp", "") > latest.get("timestamp", ""):
+            latest = data
+    if latest is None:
+        raise click.ClickException(
+            f"No saved baselines of other commits in {RESULTS_DIR}"
+        )
+    return latest
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Per case ratio of current to baseline time.
+
+    Returns:
+        list of (name, baseline seconds, current seconds, ratio, regressed)
+    """
+    rows = []
+    for name, res in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = res["seconds"] / base["seconds"]
+        rows.append(
+            (name, base["seconds"], res["seconds"], ratio, ratio > 1 + threshold)
+        )
+    return rows
+
+
+@click.command()
+@click.option("--save", is_flag=True, help="Save results as a baseline")
+@click.option("--compare", "baseline", default=None, help='Baseline file or "latest"')
+@click.option("--threshold", default=DEFAULT_THRESHOLD, help="Regression threshold")
+@click.option("--filter", "name_filter", default=None, help="Run matching cases only")
+@click.option("--repeat", default=5, help="Timing repetitions per case")
+def main(save, baseline, threshold, name_filter, repeat):
+    """Benchmark parsing and encoding hot paths."""
+    base = None
+    if baseline is not None:
+        base = loadBaseline(baseline, commit=gitCommit())
+    current = run(name_filter=name_filter, repeat=repeat)
+    regressions = 0
+    if base is None:
+        for name, res in current["results"].items():
+            print(
+                f"{name:36s} {res['seconds'] * 1e3:10.3f} ms "
+                f"{res['mb_per_sec']:9.1f} MB/s {res['peak_bytes'] / 1024:9.1f} KiB peak"
+            )
+    else:
+        print(f"baseline {base['commit']} -> {current['commit']}")
+        for name, t_base, t_new, ratio, regressed in compare(base, current, threshold):
+            flag = "REGRESSION" if regressed else ""
+            regressions += regressed
+            print(
+                f"{name:36s} {t_base * 1e3:10.3f} -> {t_new * 1e3:10.3f} ms "
+                f"x{ratio:5.2f} {flag}"
+            )
+    if save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        fn = os.path.join(RESULTS_DIR, f"{current['commit']}.json")
+        with open(fn, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Saved {fn}")
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
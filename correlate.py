@@ -0,0 +1,224 @@
+import json
+import logging
+import threading
+import time
+
+import click
+
+import ezid_query.ezidq
+import qw
+import run_queries
+
+"""
+Correlate client searches with the SQL they cause.
+
+Runs the run_queries facet sweep one search at a time while qw's
+StatementCapture reads events_statements_history_long in the background.
+Each search is tagged with the wall clock window between sending the
+request and receiving the response, and captured statements are joined to
+the window containing their start time. The capture converts server timers
+to the client's clock, so the join does not depend on the DB host clock.
+
+When a query value contains the text {marker}, it is replaced with a token
+unique to the request. Statements whose SQL contains a token are attributed
+to that request whatever their timing. This needs a free text facet
+(keywords, title, ...) that EZID copies into its SQL.
+
+Statements from other EZID users during a window are attributed to the
+search too, so run against a quiet deployment.
+"""
+
+MARKER = "{marker}"
+
+
+def markQuery(params, token):
+    """params with MARKER in any str value replaced by token."""
+    res = {}
+    for k, v in params.items():
+        if isinstance(v, str) and MARKER in v:
+            v = v.replace(MARKER, token)
+        res[k] = v
+    return res
+
+
+class CaptureThread(threading.Thread):
+    """Polls a qw.StatementCapture until stopped, collecting statements."""
+
+    def __init__(self, capture, interval=0.1):
+        super().__init__(name="correlate-capture", daemon=True)
+        self.capture = capture
+        self.interval = interval
+        self.statements = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while True:
+            self.statements += self.capture.poll()
+            if self._stop_event.wait(self.interval):
+                # One last read for statements finishing as the run ended
+                self.statements += self.capture.poll()
+                return
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def correlate(windows, statements, slack=0.05):
+    """Attribute statements to search windows.
+
+    A statement containing a window's marker token goes to that window.
+    Otherwise it goes to the window that contains its start time, widened
+    by slack seconds on each side. If several windows match, the one whose
+    centre is nearest wins.
+
+    Args:
+        windows: list of dicts with start, end and optionally marker
+        statements: list of qw.StatementCapture records
+
+    Returns:
+        (list of statement lists, one per window, unattributed statements)
+    """
+    attributed = [[] for _ in windows]
+    unattributed = []
+    markers = {w["marker"]: i for i, w in enumerate(windows) if w.get("marker")}
+    for st in statements:
+        text = st.get("sql_text") or ""
+        index = None
+        for marker, i in markers.items():
+            if marker in text:
+                index = i
+                break
+        if index is None:
+            best = None
+            for i, w in enumerate(windows):
+                if w["start"] - slack <= st["start"] <= w["end"] + slack:
+                    distance = abs(st["start"] - (w["start"] + w["end"]) / 2.0)
+                    if best is None or distance < best:
+                        best, index = distance, i
+        if index is None:
+            unattributed.append(st)
+        else:
+            attributed[index].append(st)
+    return attributed, unattributed
+
+
+def searchReport(window, statements):
+    """SQL count, DB time and worst statement of one search."""
+    report = {k: v for k, v in window.items() if k not in ("start", "end")}
+    report["sql_count"] = len(statements)
+    report["db_time"] = sum(s["latency"] for s in statements)
+    report["rows_examined"] = sum(s["rows_examined"] or 0 for s in statements)
+    report["worst"] = None
+    if statements:
+        worst = max(statements, key=lambda s: s["latency"])
+        report["worst"] = {
+            "latency": worst["latency"],
+            "digest": worst["digest"],
+            "rows_examined": worst["rows_examined"],
+            "no_index_used": worst["no_index_used"],
+            "sql_text": worst["sql_text"],
+        }
+    return report
+
+
+@click.command()
+@click.option(
+    "--url", default=ezid_query.ezidq.EzidSearch.BASE_URL, help="EZID service URL"
+)
+@click.option("--manager", is_flag=True, help="Also sweep the manage form")
+@click.option("--filtered", default="t", help="Hidden filtered value, 't'")
+@click.option(
+    "-q", "--query", default=None, help="JSON of query values common to all searches"
+)
+@click.option("--user", default=None, help="EZID user to login as")
+@click.option("--password", default=None, help="EZID password")
+@click.option("--db-user", default=None, help="DB user with performance_schema access")
+@click.option("--db-passwd", default=None, help="DB password")
+@click.option("--db-host", default="localhost", help="DB host")
+@click.option("--db-port", default=3306, help="DB port")
+@click.option("-d", "--dbname", default="ezid", help="Database name")
+@click.option("--gap", default=0.25, help="Seconds between searches")
+@click.option("--slack", default=0.05, help="Seconds added to each side of a window")
+@click.option(
+    "-o", "--output", type=click.File("w"), default="-", help="JSON lines report"
+)
+def main(
+    url,
+    manager,
+    filtered,
+    query,
+    user,
+    password,
+    db_user,
+    db_passwd,
+    db_host,
+    db_port,
+    dbname,
+    gap,
+    slack,
+    output,
+):
+    """Report the SQL caused by each search of the query sweep."""
+    L = logging.getLogger("correlate")
+    params = {"filtered": filtered}
+    if query is not None:
+        params.update(json.loads(query))
+    db = qw.connect(
+        {
+            "user": db_user,
+            "passwd": db_passwd,
+            "dbname": dbname,
+            "host": db_host,
+            "port": db_port,
+        }
+    )
+    capture = CaptureThread(qw.StatementCapture(db.cursor(), schema=dbname))
+    cli = ezid_query.ezidq.EzidSearch(base_url=url)
+    if user is not None:
+        cli.login(user, password)
+    managers = (False, True) if manager else (False,)
+    windows = []
+    capture.start()
+    try:
+        for n, dims in enumerate(run_queries.queryMatrix(managers=managers)):
+            token = f"qwmark{n:06d}"
+            marked = markQuery(params, token)
+            t0 = time.time()
+            row = run_queries.runMatrixQuery(cli, marked, dims)
+            t1 = time.time()
+            if marked != params:
+                row["marker"] = token
+            row["start"] = t0
+            row["end"] = t1
+            windows.append(row)
+            time.sleep(gap)
+    finally:
+        capture.stop()
+    attributed, unattributed = correlate(windows, capture.statements, slack=slack)
+    reports = [searchReport(w, s) for w, s in zip(windows, attributed)]
+    for report in reports:
+        output.write(json.dumps(report) + "\n")
+    output.flush()
+    summary = {
+        "searches": len(windows),
+        "statements": len(capture.statements),
+        "unattributed": len(unattributed),
+        "overflows": capture.capture.overflows,
+        "top_db_time": [
+            {
+                k: r[k]
+                for k in run_queries.MATRIX_DIMENSIONS
+                + ["sql_count", "db_time", "elapsed"]
+            }
+            for r in sorted(reports, key=lambda r: r["db_time"], reverse=True)[:10]
+        ],
+    }
+    if capture.capture.overflows:
+        L.warning("History buffer overflowed, some statements were not captured")
+    click.echo(run_queries.pj(summary), err=output.name == "<stdout>")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
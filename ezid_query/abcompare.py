@@ -0,0 +1,343 @@
+"""A/B latency comparison of two EZID deployments.
+
+Runs the same set of probes, either searches through EzidSearch or API
+calls through EZIDClient, against two base URLs. Each round visits the
+probes in a fresh random order and issues every probe to both servers back
+to back in random order, so drift in load or the network affects A and B
+alike. The per round pairs give, for each probe, the change in median
+latency from A to B with a bootstrap confidence interval::
+
+    ezid-ab https://ezid-dev.cdlib.org https://ezid-stg.cdlib.org --rounds 30
+
+A probe fails when B is slower than A by more than the threshold with the
+given confidence, i.e. the lower bound of the interval of the relative
+change exceeds the threshold, or when B had more errors than A. A probe
+with fewer than 2 rounds where both sides succeeded is inconclusive. The
+run's verdict is failed if any probe failed, else inconclusive if any
+probe was, and the command exits with 1 or 2 respectively.
+"""
+
+import json
+import logging
+import os
+import random
+import statistics
+import time
+
+import click
+
+from . import apicli
+from . import ezidq
+
+WORKLOAD_SEARCH = "search"
+WORKLOAD_API = "api"
+WORKLOADS = [WORKLOAD_SEARCH, WORKLOAD_API]
+
+VERDICT_PASSED = "passed"
+VERDICT_FAILED = "failed"
+VERDICT_INCONCLUSIVE = "inconclusive"
+
+DEFAULT_THRESHOLD = 0.1
+"""Relative slowdown of B over A tolerated before a probe fails
+"""
+
+
+def searchProbes(queries=None):
+    """Probes running each query with EzidSearch.search.
+
+    Args:
+        queries: list of query dicts, by default each object type and
+            identifier type on the search form
+
+    Returns:
+        list of (name, function of an EzidSearch)
+    """
+    if queries is None:
+        queries = []
+        for ot in ezidq.EzidSearch.OBJECT_TYPES:
+            for it in ezidq.EzidSearch.IDENTIFIER_TYPES:
+                queries.append({"object_type": ot, "id_type": it, "filtered": "t"})
+    probes = []
+    for q in queries:
+        name = json.dumps({k: v for k, v in q.items() if v is not None}, sort_keys=True)
+        probes.append((name, lambda cli, q=q: cli.search(q)["status"] == 200))
+    return probes
+
+
+def apiProbes(identifiers=()):
+    """Probes of the EZID API: status and a view of each identifier.
+
+    Returns:
+        list of (name, function of an EZIDClient)
+    """
+    probes = [("status", lambda cli: cli.status()["status"] == "success")]
+    for pid in identifiers:
+        probes.append(
+            (f"view {pid}", lambda cli, pid=pid: cli.view(pid)["status"] == "success")
+        )
+    return probes
+
+
+def bootstrapCI(a, b, n=2000, confidence=0.95, rng=None):
+    """Confidence interval of the change in median from a to b.
+
+    a and b are paired samples, the pairs are resampled together.
+
+    Returns:
+        (delta, lower, upper, relative, rel_lower, rel_upper) where the
+        relative values are fractions of the median of a
+    """
+    rng = rng or random.Random()
+    m = len(a)
+    med_a = statistics.median(a)
+    deltas = []
+    rels = []
+    for _ in range(n):
+        idx = [rng.randrange(m) for _ in range(m)]
+        ra = statistics.median(a[i] for i in idx)
+        rb = statistics.median(b[i] for i in idx)
+        deltas.append(rb - ra)
+        rels.append((rb - ra) / ra if ra > 0 else 0.0)
+    deltas.sort()
+    rels.sort()
+    tail = (1.0 - confidence) / 2.0
+    lo = int(tail * n)
+    hi = min(n - 1, int((1.0 - tail) * n))
+    delta = statistics.median(b) - med_a
+    return (
+        delta,
+        deltas[lo],
+        deltas[hi],
+        delta / med_a if med_a > 0 else 0.0,
+        rels[lo],
+        rels[hi],
+    )
+
+
+class ABComparison(object):
+    """Paired, interleaved latency comparison of two clients.
+
+    Args:
+        client_a: client of deployment A
+        client_b: client of deployment B
+        probes: list of (name, function(client) returning True on success)
+        rounds: number of measured rounds
+        warmup: rounds run first and discarded, to open connections
+        threshold: tolerated relative slowdown of B
+        confidence: confidence level of the intervals
+        bootstrap: number of bootstrap resamples
+        seed: random seed for the probe order and resampling
+        report: called with a dict for each measurement
+        clock: function returning the current time in seconds
+    """
+
+    def __init__(
+        self,
+        client_a,
+        client_b,
+        probes,
+        rounds=20,
+        warmup=1,
+        threshold=DEFAULT_THRESHOLD,
+        confidence=0.95,
+        bootstrap=2000,
+        seed=None,
+        report=None,
+        clock=time.perf_counter,
+    ):
+        self._L = logging.getLogger(self.__class__.__name__)
+        self.clients = {"a": client_a, "b": client_b}
+        self.probes = probes
+        self.rounds = rounds
+        self.warmup = warmup
+        self.threshold = threshold
+        self.confidence = confidence
+        self.bootstrap = bootstrap
+        self.report = report
+        self._random = random.Random(seed)
+        self._clock = clock
+
+    def _measure(self, side, name, func):
+        t0 = self._clock()
+        try:
+            ok = func(self.clients[side])
+        except Exception as e:
+            self._L.error("%s %s failed: %s", side, name, e)
+            ok = False
+        return self._clock() - t0, ok
+
+    def run(self):
+        """Run the rounds and compare.
+
+        Returns:
+            dict with per probe comparisons, overall and passed
+        """
+        samples = {name: [] for name, _ in self.probes}
+        errors = {name: {"a": 0, "b": 0} for name, _ in self.probes}
+        for rnd in range(-self.warmup, self.rounds):
+            order = list(self.probes)
+            self._random.shuffle(order)
+            for name, func in order:
+                sides = ["a", "b"]
+                self._random.shuffle(sides)
+                pair = {}
+                for side in sides:
+                    latency, ok = self._measure(side, name, func)
+                    pair[side] = (latency, ok)
+                if rnd < 0:
+                    continue
+                if self.report is not None:
+                    self.report(
+                        {
+                            "round": rnd,
+                            "probe": name,
+                            "first": sides[0],
+                            "a": pair["a"][0],
+                            "b": pair["b"][0],
+                            "a_ok": pair["a"][1],
+                            "b_ok": pair["b"][1],
+                        }
+                    )
+                for side in sides:
+                    if not pair[side][1]:
+                        errors[name][side] += 1
+                if pair["a"][1] and pair["b"][1]:
+                    samples[name].append((pair["a"][0], pair["b"][0]))
+        return self.summarize(samples, errors)
+
+    def _compare(self, pairs):
+        a = [p[0] for p in pairs]
+        b = [p[1] for p in pairs]
+        delta, lo, hi, rel, rel_lo, rel_hi = bootstrapCI(
+            a, b, n=self.bootstrap, confidence=self.confidence, rng=self._random
+        )
+        return {
+            "n": len(pairs),
+            "median_a": statistics.median(a),
+            "median_b": statistics.median(b),
+            "delta": delta,
+            "delta_ci": [lo, hi],
+            "relative": rel,
+            "relative_ci": [rel_lo, rel_hi],
+            "passed": rel_lo <= self.threshold,
+        }
+
+    def summarize(self, samples, errors):
+        probes = {}
+        all_pairs = []
+        for name, pairs in samples.items():
+            if len(pairs) < 2:
+                res = {"n": len(pairs), "passed": None}
+            else:
+                res = self._compare(pairs)
+                all_pairs += pairs
+            res["errors"] = errors[name]
+            if errors[name]["b"] > errors[name]["a"]:
+                res["passed"] = False
+                res["reason"] = "errors"
+            probes[name] = res
+        overall = self._compare(all_pairs) if len(all_pairs) >= 2 else {"n": 0}
+        failed = [k for k, v in probes.items() if v["passed"] is False]
+        inconclusive = [k for k, v in probes.items() if v["passed"] is None]
+        if failed or overall.get("passed") is False:
+            verdict = VERDICT_FAILED
+        elif inconclusive or overall["n"] < 2:
+            verdict = VERDICT_INCONCLUSIVE
+        else:
+            verdict = VERDICT_PASSED
+        return {
+            "threshold": self.threshold,
+            "confidence": self.confidence,
+            "probes": probes,
+            "overall": overall,
+            "failed": failed,
+            "inconclusive": inconclusive,
+            "verdict": verdict,
+            "passed": verdict == VERDICT_PASSED,
+        }
+
+
+@click.command()
+@click.argument("url_a")
+@click.argument("url_b")
+@click.option("-u", "--user", default=lambda: os.environ.get("EZID_USER", None))
+@click.option("-p", "--password", default=lambda: os.environ.get("EZID_PASS", None))
+@click.option("--workload", type=click.Choice(WORKLOADS), default=WORKLOAD_SEARCH)
+@click.option(
+    "-q",
+    "--queries",
+    type=click.File("r"),
+    default=None,
+    help="JSON list of search queries",
+)
+@click.option(
+    "-i", "--identifier", multiple=True, help="Identifier to view, repeatable"
+)
+@click.option("--rounds", default=20, help="Measured rounds")
+@click.option("--warmup", default=1, help="Discarded warm up rounds")
+@click.option("--threshold", default=DEFAULT_THRESHOLD, help="Tolerated slowdown")
+@click.option("--confidence", default=0.95, help="Confidence level")
+@click.option("--bootstrap", default=2000, help="Bootstrap resamples")
+@click.option("--seed", default=None, type=int, help="Random seed")
+@click.option("-v", "--verbose", is_flag=True, help="Print each measurement")
+def main(
+    url_a,
+    url_b,
+    user,
+    password,
+    workload,
+    queries,
+    identifier,
+    rounds,
+    warmup,
+    threshold,
+    confidence,
+    bootstrap,
+    seed,
+    verbose,
+):
+    """Compare latency of URL_A and URL_B, exit non-zero if B is slower.
+
+    Prints a JSON report of the change in median latency per probe. Exits
+    with 1 if B is slower or fails more often, 2 if too few probes
+    succeeded on both sides to tell.
+    """
+    if workload == WORKLOAD_SEARCH:
+        probes = searchProbes(json.load(queries) if queries is not None else None)
+        clients = []
+        for url in (url_a, url_b):
+            cli = ezidq.EzidSearch(base_url=url)
+            if user is not None:
+                cli.login(user, password)
+            clients.append(cli)
+    else:
+        probes = apiProbes(identifier)
+        clients = [
+            apicli.EZIDClient(url, username=user, password=password)
+            for url in (url_a, url_b)
+        ]
+    comparison = ABComparison(
+        clients[0],
+        clients[1],
+        probes,
+        rounds=rounds,
+        warmup=warmup,
+        threshold=threshold,
+        confidence=confidence,
+        bootstrap=bootstrap,
+        seed=seed,
+        report=(lambda row: print(json.dumps(row), flush=True)) if verbose else None,
+    )
+    summary = comparison.run()
+    summary["a"] = url_a
+    summary["b"] = url_b
+    print(json.dumps(summary, indent=2))
+    if summary["verdict"] == VERDICT_FAILED:
+        raise SystemExit(1)
+    if summary["verdict"] == VERDICT_INCONCLUSIVE:
+        raise SystemExit(2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
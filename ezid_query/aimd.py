@@ -0,0 +1,198 @@
+"""Adaptive concurrency control for API workloads.
+
+AIMDController bounds the number of requests in flight with a limit that
+grows additively while requests succeed at healthy latency, and is cut
+multiplicatively on server errors, timeouts or latency spikes. Shared by the
+threads of a bulk job it settles near the concurrency the server can
+actually sustain::
+
+    controller = AIMDController(initial_limit=4, max_limit=64)
+    cli = EZIDClient(url, username=u, password=p, concurrency=controller)
+    for res in cli.mintMany(shoulder, records, workers=64):
+        ...
+    print(controller.stats(), controller.history())
+"""
+
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+REASON_INITIAL = "initial"
+REASON_INCREASE = "increase"
+REASON_ERROR = "error"
+REASON_LATENCY = "latency"
+
+
+class AIMDController(object):
+    """Additive increase / multiplicative decrease concurrency limit.
+
+    Args:
+        initial_limit: starting number of requests allowed in flight
+        min_limit: the limit is never cut below this
+        max_limit: the limit never grows above this
+        increase: amount added to the limit per limit's worth of successes
+        backoff: factor applied to the limit on a decrease
+        latency_threshold: seconds above which a request counts as a
+            latency spike, None to use spike_factor only
+        spike_factor: a request slower than spike_factor times the smoothed
+            latency counts as a spike
+        warmup: number of samples before relative spike detection applies
+        alpha: smoothing factor for the latency moving average
+        cooldown: minimum seconds between decreases, so a burst of failures
+            from one window of requests causes a single cut
+        history_size: number of limit changes retained
+        clock: function returning the current time in seconds
+    """
+
+    def __init__(
+        self,
+        initial_limit=4,
+        min_limit=1,
+        max_limit=256,
+        increase=1.0,
+        backoff=0.5,
+        latency_threshold=None,
+        spike_factor=3.0,
+        warmup=20,
+        alpha=0.1,
+        cooldown=1.0,
+        history_size=1000,
+        clock=time.monotonic,
+    ):
+        self._L = logging.getLogger(self.__class__.__name__)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.backoff = backoff
+        self.latency_threshold = latency_threshold
+        self.spike_factor = spike_factor
+        self.warmup = warmup
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._inflight = 0
+        self._latency = None
+        self._samples = 0
+        self._successes = 0
+        self._errors = 0
+        self._spikes = 0
+        self._last_decrease = None
+        self._history = collections.deque(maxlen=history_size)
+        self._record(REASON_INITIAL)
+
+    @property
+    def limit(self):
+        """Current number of requests allowed in flight."""
+        with self._cond:
+            return int(self._limit)
+
+    def _record(self, reason):
+        self._history.append((self._clock(), int(self._limit), reason))
+
+    def acquire(self):
+        """Block until a request may be issued."""
+        with self._cond:
+            while self._inflight >= int(self._limit):
+                self._cond.wait()
+            self._inflight += 1
+
+    def release(self, latency, error=False):
+        """Report the outcome of a request issued after acquire().
+
+        Args:
+            latency: seconds taken by the request
+            error: True for a server error (5xx, 429) or timeout
+        """
+        with self._cond:
+            self._inflight -= 1
+            spike = self._isSpike(latency)
+            if spike:
+                # The baseline follows spikes too, clamped so one outlier
+                # moves it little, so that a lasting rise in latency stops
+                # counting as spikes once the baseline has caught up
+                ceiling = latency
+                if self._latency is not None:
+                    ceiling = min(latency, self.spike_factor * self._latency)
+                self._updateLatency(ceiling)
+            if error or spike:
+                if error:
+                    self._errors += 1
+                else:
+                    self._spikes += 1
+                self._decrease(REASON_ERROR if error else REASON_LATENCY)
+            else:
+                self._successes += 1
+                self._updateLatency(latency)
+                if self._limit < self.max_limit:
+                    before = int(self._limit)
+                    self._limit = min(
+                        self.max_limit, self._limit + self.increase / self._limit
+                    )
+                    if int(self._limit) != before:
+                        self._record(REASON_INCREASE)
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Context manager pairing acquire() and release().
+
+        Yields a dict; set "error" to True in it to report a failure. An
+        exception raised in the block is reported as an error.
+        """
+        self.acquire()
+        outcome = {"error": False}
+        t0 = self._clock()
+        try:
+            yield outcome
+        except BaseException:
+            outcome["error"] = True
+            raise
+        finally:
+            self.release(self._clock() - t0, error=outcome["error"])
+
+    def _isSpike(self, latency):
+        if self.latency_threshold is not None and latency > self.latency_threshold:
+            return True
+        return (
+            self._samples >= self.warmup
+            and self._latency is not None
+            and latency > self.spike_factor * self._latency
+        )
+
+    def _updateLatency(self, latency):
+        self._samples += 1
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency += self.alpha * (latency - self._latency)
+
+    def _decrease(self, reason):
+        now = self._clock()
+        last = self._last_decrease
+        if last is not None and now - last < self.cooldown:
+            return
+        self._last_decrease = now
+        self._limit = max(float(self.min_limit), self._limit * self.backoff)
+        self._L.info("Concurrency limit cut to %d (%s)", int(self._limit), reason)
+        self._record(reason)
+
+    def history(self):
+        """List of (time, limit, reason) for each change of the limit."""
+        with self._cond:
+            return list(self._history)
+
+    def stats(self):
+        """Current limit, requests in flight and outcome counters."""
+        with self._cond:
+            return {
+                "limit": int(self._limit),
+                "inflight": self._inflight,
+                "successes": self._successes,
+                "errors": self._errors,
+                "latency_spikes": self._spikes,
+                "smoothed_latency": self._latency,
+            }
@@ -0,0 +1,260 @@
+"""asyncio counterpart of the minimal EZID API client.
+
+AsyncEZIDClient offers the same surface as ``apicli.EZIDClient`` (login,
+logout, status, mint, view) as coroutines, speaking HTTP/1.1 directly over
+asyncio streams so no additional dependencies are needed. Connections are
+kept alive and reused, and the number of requests in flight is bounded by a
+semaphore so that many hundreds of calls may be gathered concurrently::
+
+    async with AsyncEZIDClient(url, username=u, password=p) as cli:
+        await cli.login()
+        results = await asyncio.gather(
+            *[cli.mint("ark:/99999/fk4", params) for i in range(500)]
+        )
+"""
+
+import asyncio
+import base64
+import email.parser
+import http.client
+import logging
+import ssl
+import urllib.parse
+
+from . import apicli
+
+DEFAULT_MAX_CONCURRENCY = 100
+"""Default maximum number of requests in flight for one client.
+"""
+
+
+class AsyncEZIDClient(apicli.AnvlFormatter):
+    """Asynchronous EZID API client.
+
+    Args:
+        server_url: base URL of the EZID service
+        session_id: existing session id, or a full name=value cookie
+        username: user for HTTP basic authentication
+        password: password for HTTP basic authentication
+        encoding: text encoding of ANVL documents
+        max_concurrency: maximum number of requests in flight
+        timeout: seconds allowed per request, None for no limit
+    """
+
+    def __init__(
+        self,
+        server_url,
+        session_id=None,
+        username=None,
+        password=None,
+        encoding="utf-8",
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        timeout=None,
+    ):
+        self._L = logging.getLogger(self.__class__.__name__)
+        self._server = server_url.strip("/")
+        self._cookie = session_id
+        self._encoding = encoding
+        self._username = username  # preserve for test validation
+        self._password = password
+        self._timeout = timeout
+        self.max_concurrency = max_concurrency
+        _url = urllib.parse.urlsplit(self._server)
+        self._ssl = ssl.create_default_context() if _url.scheme == "https" else None
+        self._host = _url.hostname
+        self._port = _url.port or (443 if self._ssl else 80)
+        self._netloc = _url.netloc
+        self._base_path = _url.path
+        self._idle = []
+        self._semaphore = None
+        self._opened = 0
+        self._reused = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def poolStats(self):
+        """Counts of connections opened, reused and idle."""
+        return {
+            "opened": self._opened,
+            "reused": self._reused,
+            "idle": len(self._idle),
+        }
+
+    async def close(self):
+        """Close idle connections."""
+        idle, self._idle = self._idle, []
+        for reader, writer in idle:
+            writer.close()
+        for reader, writer in idle:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    def _getSemaphore(self):
+        # Created lazily so the semaphore belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _connect(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                self._reused += 1
+                return reader, writer, True
+            writer.close()
+        self._opened += 1
+        reader, writer = await asyncio.open_connection(
+            self._host, self._port, ssl=self._ssl
+        )
+        return reader, writer, False
+
+    def _requestHeaders(self, body):
+        headers = {
+            "Host": self._netloc,
+            "Accept-Encoding": "identity",
+            "Content-Length": str(len(body)),
+        }
+        if body:
+            headers["Content-Type"] = "text/plain; charset=utf-8"
+        if self._cookie is not None:
+            headers["Cookie"] = apicli.cookieHeader(self._cookie)
+        elif self._username is not None:
+            # Preemptive basic auth, there is no challenge round trip here
+            token = base64.b64encode(
+                f"{self._username}:{self._password}".encode("utf-8")
+            ).decode("ascii")
+            headers["Authorization"] = f"Basic {token}"
+        return headers
+
+    async def _readBody(self, reader, status, headers):
+        if status < 200 or status in (204, 304):
+            return b"", True
+        if headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Discard any trailers up to the terminating blank line
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks), True
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+        length = headers.get("Content-Length")
+        if length is not None:
+            return await reader.readexactly(int(length)), True
+        return await reader.read(), False
+
+    async def _roundTrip(self, method, path, body):
+        reader, writer, reused = await self._connect()
+        headers = self._requestHeaders(body)
+        head = [f"{method} {self._base_path}/{path} HTTP/1.1"]
+        head += [f"{k}: {v}" for k, v in headers.items()]
+        try:
+            try:
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+                writer.write(body)
+                await writer.drain()
+                status_line = await reader.readline()
+            except OSError:
+                if not reused:
+                    raise
+                status_line = b""
+            if not status_line:
+                writer.close()
+                if not reused:
+                    raise http.client.RemoteDisconnected("connection closed")
+                # The server dropped an idle connection, retry on another
+                self._L.debug("stale connection to %s", self._netloc)
+                return await self._roundTrip(method, path, body)
+            version, status, _ = (
+                status_line.decode("latin-1").split(" ", 2) + [""]
+            )[:3]
+            header_lines = []
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                header_lines.append(line)
+            response_headers = email.parser.BytesParser(
+                _class=http.client.HTTPMessage
+            ).parsebytes(b"".join(header_lines))
+            status = int(status)
+            response, keep_alive = await self._readBody(
+                reader, status, response_headers
+            )
+        except BaseException:
+            # Includes cancellation by a timeout, the stream state is unknown
+            writer.close()
+            raise
+        if (
+            keep_alive
+            and version != "HTTP/1.0"
+            and response_headers.get("Connection", "").lower() != "close"
+        ):
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        return status, response_headers, response
+
+    async def issueRequest(self, path, method, data=None):
+        """Send a request to the EZID API.
+
+        Returns:
+            (response text, headers)
+        """
+        url = f"{self._server}/{path}"
+        self._L.info("sending request: %s", url)
+        body = b"" if data is None else data.encode("utf-8")
+        async with self._getSemaphore():
+            status, headers, response = await asyncio.wait_for(
+                self._roundTrip(method, path, body), self._timeout
+            )
+        response = response.decode("utf-8")
+        if status >= 400:
+            self._L.error("%d %s", status, url)
+            self._L.error(response)
+            return response, {}
+        return response, headers
+
+    async def login(self, username=None, password=None):
+        if not username is None:
+            self._username = username
+            self._password = password
+            self._cookie = None
+        response, headers = await self.issueRequest("login", "GET")
+        try:
+            self._cookie = headers.get("set-cookie", "").split(";")[0].split("=")[1]
+            response += f"\nsessionid={self._cookie}\n"
+        except IndexError:
+            self._L.warning("No sessionid cookie in response.")
+        return self.anvlresponseToDict(response)
+
+    async def logout(self):
+        response, headers = await self.issueRequest("logout", "GET")
+        return self.anvlresponseToDict(response)
+
+    async def status(self):
+        response, headers = await self.issueRequest("status", "GET")
+        return self.anvlresponseToDict(response)
+
+    async def mint(self, shoulder, params=None):
+        if params is None:
+            params = []
+        data = self.formatAnvlRequest(params)
+        url = "shoulder/" + self._encode(shoulder)
+        response, headers = await self.issueRequest(url, "POST", data=data)
+        return self.anvlresponseToDict(response)
+
+    async def view(self, pid, bang=False):
+        path = "id/" + self._encode(pid)
+        if bang:
+            path += "?prefix_match=yes"
+        response, headers = await self.issueRequest(path, "GET")
+        return self.anvlresponseToDict(response)
@@ -0,0 +1,209 @@
+"""ANVL encoding and decoding for EZID API requests and responses.
+
+This is the single implementation used by the API clients and the tests.
+Escaping and decoding of the characters EZID escapes are done with chained
+``str.replace`` calls, falling back to a precomputed table of %XX escapes for
+anything else, so no Python code runs per escaped character.
+
+See https://ezid.cdlib.org/doc/apidoc.html#request-response-bodies
+"""
+
+import time
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+"""Format for rendering _created and _updated timestamps
+"""
+
+TIMESTAMP_KEYS = frozenset(["_created", "_updated"])
+"""Keys holding seconds since the epoch in EZID responses
+"""
+
+_HEX_CHAR = {
+    a + b: chr(int(a + b, 16))
+    for a in "0123456789abcdefABCDEF"
+    for b in "0123456789abcdefABCDEF"
+}
+
+
+def escapeKey(k):
+    """Percent-encode %, :, CR and LF in an ANVL key."""
+    return (
+        k.replace("%", "%25")
+        .replace(":", "%3A")
+        .replace("\r", "%0D")
+        .replace("\n", "%0A")
+    )
+
+
+def escapeValue(v):
+    """Percent-encode %, CR and LF in an ANVL value."""
+    return v.replace("%", "%25").replace("\r", "%0D").replace("\n", "%0A")
+
+
+def _unescapeAll(s):
+    parts = s.split("%")
+    res = [parts[0]]
+    for part in parts[1:]:
+        c = _HEX_CHAR.get(part[:2])
+        if c is None:
+            res.append("%")
+            res.append(part)
+        else:
+            res.append(c)
+            res.append(part[2:])
+    return "".join(res)
+
+
+def unescape(s):
+    """Decode %XX escapes in s.
+
+    Each escape maps to a single character, matching the escaping applied
+    by EZID. Malformed escapes are left as is.
+    """
+    if "%" not in s:
+        return s
+    # Every "%" in an escaped string starts an escape, so the common ones can
+    # be replaced independently provided "%25" is decoded last.
+    t = s.replace("%0A", "\n").replace("%0D", "\r").replace("%3A", ":")
+    if "%" in t.replace("%25", ""):
+        return _unescapeAll(s)
+    return t.replace("%25", "%")
+
+
+def formatTimestamp(v):
+    """Render seconds since the epoch as a local time string.
+
+    Values that are not integers are returned unchanged.
+    """
+    try:
+        return time.strftime(TIMESTAMP_FORMAT, time.localtime(int(v)))
+    except ValueError:
+        return v
+
+
+def _text(v, encoding):
+    if isinstance(v, bytes):
+        return v.decode(encoding)
+    return v
+
+
+def formatRequest(args, encoding="utf-8"):
+    """Generate an ANVL request document.
+
+    Follows the conventions of the EZID client tools: a key of "@" reads
+    lines from the named file, a value of "@filename" reads the value from a
+    file, and a leading "@@" escapes a literal "@".
+
+    Args:
+        args: list of [k, v, k, v, ...] as str or bytes
+        encoding: encoding of bytes arguments and referenced files
+
+    Returns:
+        str, ANVL formatted document
+    """
+    request = []
+    for i in range(0, len(args), 2):
+        k = _text(args[i], encoding)
+        if k == "@":
+            with open(_text(args[i + 1], encoding), encoding=encoding) as f:
+                request += [l.strip("\r\n") for l in f.readlines()]
+            continue
+        if k == "@@":
+            k = "@"
+        else:
+            k = escapeKey(k)
+        v = _text(args[i + 1], encoding)
+        if v.startswith("@@"):
+            v = v[1:]
+        elif v.startswith("@") and len(v) > 1:
+            with open(v[1:], encoding=encoding, newline="") as f:
+                v = f.read()
+        request.append(f"{k}: {escapeValue(v)}")
+    return "\n".join(request)
+
+
+def formatDict(d, encoding="utf-8"):
+    """Generate an ANVL request document from a dict of metadata."""
+    args = []
+    for k, v in d.items():
+        args.append(k)
+        args.append(v)
+    return formatRequest(args, encoding=encoding)
+
+
+def toDict(response, format_timestamps=True, decode=False, encoding="utf-8"):
+    """Parse an ANVL response into a dict.
+
+    The first line is the status line, giving "status" and
+    "status_message". Following "key: value" lines become entries, and lines
+    without a ":" are appended to "body".
+
+    Args:
+        response: response document, str or bytes
+        format_timestamps: render _created and _updated as local time
+        decode: percent-decode values
+        encoding: encoding of a bytes response
+
+    Returns:
+        dict
+    """
+    res = {"status": "unknown", "status_message": "no content", "body": ""}
+    if not response:
+        return res
+    if isinstance(response, bytes):
+        response = response.decode(encoding)
+    lines = response.splitlines()
+    # Treat the first response line as the status
+    K, _, V = lines[0].partition(":")
+    res["status"] = K
+    res["status_message"] = V.strip(" ")
+    body = []
+    for line in lines[1:]:
+        K, sep, V = line.partition(":")
+        if not sep:
+            body.append(line)
+            continue
+        V = V.strip()
+        if format_timestamps and K in TIMESTAMP_KEYS:
+            V = formatTimestamp(V)
+        if decode and "%" in V:
+            V = unescape(V)
+        res[K] = V
+    if body:
+        res["body"] = "".join(body)
+    return res
+
+
+def toText(
+    response,
+    sort_lines=False,
+    format_timestamps=True,
+    decode=False,
+    one_line=False,
+    encoding="utf-8",
+):
+    """Reformat an ANVL response for display.
+
+    Returns:
+        bytes, encoded with encoding, or None if response is None
+    """
+    if response is None:
+        return None
+    if isinstance(response, bytes):
+        response = response.decode(encoding)
+    lines = response.splitlines()
+    if sort_lines and len(lines) >= 1:
+        lines = lines[:1] + sorted(lines[1:])
+    res = []
+    for line in lines:
+        if format_timestamps and (
+            line.startswith("_created:") or line.startswith("_updated:")
+        ):
+            K, _, V = line.partition(":")
+            line = f"{K}: {formatTimestamp(V.strip())}"
+        if decode:
+            line = unescape(line)
+        if one_line:
+            line = line.replace("\n", " ").replace("\r", " ")
+        res.append(line)
+    return "\n".join(res).encode(encoding)
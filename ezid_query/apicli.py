@@ -6,14 +6,46 @@ developed using the same version of python utilized by the EZID application.
 Based on https://github.com/CDLUC3/ezid-client-tools
 """
 
-import codecs
+import collections
+import concurrent.futures
 import logging
-import re
+import threading
 import time
+import timeit
 import urllib.error
 import urllib.parse
 import urllib.request
 import urllib.response
+import zlib
+
+from . import anvl
+from . import batch
+from . import timing
+from . import transport
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+"""Read size used when streaming a response body to a file.
+"""
+
+DEFAULT_MINT_WORKERS = 8
+"""Default number of worker threads used by EZIDClient.mintMany
+"""
+
+DEFAULT_POLL_INTERVAL = 5.0
+"""Seconds between checks for a batch download becoming available
+"""
+
+
+def cookieHeader(session_id):
+    """Cookie header value for a session.
+
+    Args:
+        session_id: the sessionid value as kept by login(), or a full
+            name=value cookie
+    """
+    if "=" in session_id:
+        return session_id
+    return f"sessionid={session_id}"
 
 
 class EZIDHTTPErrorProcessor(urllib.request.HTTPErrorProcessor):
@@ -29,7 +61,48 @@ class EZIDHTTPErrorProcessor(urllib.request.HTTPErrorProcessor):
     https_response = http_response
 
 
-class EZIDClient(object):
+class AnvlFormatter(object):
+    """ANVL request encoding and response decoding shared by the API clients.
+
+    Thin wrappers over ezid_query.anvl. Subclasses provide ``self._encoding``.
+    """
+
+    def _encode(self, id_str):
+        return urllib.parse.quote(id_str, ":/")
+
+    def formatAnvlRequest(self, args):
+        return anvl.formatRequest(args, encoding=self._encoding)
+
+    def anvlresponseToDict(
+        self, response, format_timestamps=True, decode=False, _encoding="utf-8"
+    ):
+        return anvl.toDict(
+            response,
+            format_timestamps=format_timestamps,
+            decode=decode,
+            encoding=_encoding,
+        )
+
+    def anvlResponseToText(
+        self,
+        response,
+        sort_lines=False,
+        format_timestamps=True,
+        decode=False,
+        one_line=False,
+        encoding="utf-8",
+    ):
+        return anvl.toText(
+            response,
+            sort_lines=sort_lines,
+            format_timestamps=format_timestamps,
+            decode=decode,
+            one_line=one_line,
+            encoding=encoding,
+        )
+
+
+class EZIDClient(AnvlFormatter):
     def __init__(
         self,
         server_url,
@@ -37,18 +110,76 @@ class EZIDClient(object):
         username=None,
         password=None,
         encoding="utf-8",
+        pool_size=transport.DEFAULT_POOL_SIZE,
+        pool=None,
+        view_cache=None,
+        concurrency=None,
+        recorder=None,
+        timed=False,
+        timing_listener=None,
     ):
         self._L = logging.getLogger(self.__class__.__name__)
         self._server = server_url.strip("/")
         self._cookie = session_id
         self._encoding = encoding
-        self._opener = urllib.request.build_opener(EZIDHTTPErrorProcessor())
+        # Connections are kept alive and reused per host. A pool may be
+        # shared between clients (and threads) by passing it in.
+        if pool is None:
+            pool = transport.ConnectionPool(maxsize=pool_size)
+        self._pool = pool
+        self._opener = urllib.request.build_opener(
+            EZIDHTTPErrorProcessor(), transport.KeepAliveHandler(pool=self._pool)
+        )
         self._username = username  # preserve for test validation
+        # Optional cache.LRUCache of view() results, keyed by (pid, bang)
+        self._view_cache = view_cache
+        # Optional aimd.AIMDController gating every request issued
+        self._concurrency = concurrency
+        # Optional traffic.TrafficRecorder logging every request
+        self._recorder = recorder
+        # Per phase request timing, added to results as "timing" and passed
+        # to timing_listener with the method, url and status of the request
+        self._timed = timed or timing_listener is not None
+        self._timing_listener = timing_listener
+        self._local = threading.local()
         if self._cookie is None:
             self._setAuthHandler(username, password)
 
-    def _encode(self, id_str):
-        return urllib.parse.quote(id_str, ":/")
+    def poolStats(self):
+        """Counts of connections opened, reused, discarded and idle."""
+        return self._pool.stats()
+
+    def cacheStats(self):
+        """Counters of the view cache, None if caching is not enabled."""
+        if self._view_cache is None:
+            return None
+        return self._view_cache.stats()
+
+    def _invalidateView(self, pid):
+        # Drops the entry for pid and any prefix match views that cover it
+        if self._view_cache is None or not pid:
+            return
+        self._view_cache.invalidate(
+            lambda key: key[0] == pid or (key[1] and pid.startswith(key[0]))
+        )
+
+    def lastTiming(self):
+        """Phase timing of the last request issued by this thread.
+
+        Returns:
+            dict as timing.RequestTiming.asDict(), None if timing is not
+            enabled or no request has been sent
+        """
+        return getattr(self._local, "timing", None)
+
+    def _withTiming(self, res, sent=True):
+        if self._timed:
+            res["timing"] = self.lastTiming() if sent else None
+        return res
+
+    def close(self):
+        """Close idle pooled connections."""
+        self._pool.close()
 
     def _setAuthHandler(self, username, password):
         h = urllib.request.HTTPBasicAuthHandler()
@@ -56,125 +187,152 @@ class EZIDClient(object):
         h.add_password("EZID", self._server, username, password)
         self._opener.add_handler(h)
 
-    def formatAnvlRequest(self, args):
-        request = []
-        for i in range(0, len(args), 2):
-            k = args[i].decode(self._encoding)
-            if k == "@":
-                f = codecs.open(args[i + 1], encoding=self._encoding)
-                request += [l.strip("\r\n") for l in f.readlines()]
-                f.close()
-            else:
-                if k == "@@":
-                    k = "@"
-                else:
-                    k = re.sub("[%:\r\n]", lambda c: f"%{ord(c.group(0)):02X}", k)
-                v = args[i + 1].decode(self._encoding)
-                if v.startswith("@@"):
-                    v = v[1:]
-                elif v.startswith("@") and len(v) > 1:
-                    f = codecs.open(v[1:], encoding=self._encoding)
-                    v = f.read()
-                    f.close()
-                v = re.sub("[%\r\n]", lambda c: f"%{ord(c.group(0)):02X}", v)
-                request.append(f"{k}: {v}")
-        return "\n".join(request)
+    def _streamResponse(self, connection, dest_f, t0, chunk_size, gunzip):
+        """Copy a response body to dest_f in chunk_size reads.
 
-    def anvlresponseToDict(
-        self, response, format_timestamps=True, decode=False, _encoding="utf-8"
-    ):
-        res = {"status": "unknown", "status_message": "no content", "body": ""}
-        if response is None:
-            return res
-        response = response.splitlines()
-        # Treat the first response line as the status
-        K, V = response[0].split(":", 1)
-        res["status"] = K
-        res["status_message"] = V.strip(" ")
-        for line in response[1:]:
-            try:
-                K, V = line.split(":", 1)
-                V = V.strip()
-                if format_timestamps and (K == "_created:" or K == "_updated:"):
-                    ls = line.split(":")
-                    V = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(int(ls[1])))
-                if decode:
-                    V = re.sub(
-                        "%([0-9a-fA-F][0-9a-fA-F])",
-                        lambda m: chr(int(m.group(1), 16)),
-                        V,
-                    )
-                self._L.debug("K : V = %s : %s", K, V)
-                res[K] = V
-            except ValueError:
-                res["body"] += line
-        return res
+        Returns:
+            dict of transfer statistics
+        """
+        t_headers = timeit.default_timer()
+        inflater = zlib.decompressobj(zlib.MAX_WBITS | 32) if gunzip else None
+        n_read = 0
+        n_written = 0
+        t_first = None
+        while True:
+            chunk = connection.read(chunk_size)
+            if not chunk:
+                break
+            if t_first is None:
+                t_first = timeit.default_timer()
+            n_read += len(chunk)
+            if inflater is not None:
+                data = inflater.decompress(chunk)
+                # Concatenated gzip members, each needs a fresh decompressor
+                while inflater.eof and inflater.unused_data:
+                    tail = inflater.unused_data
+                    inflater = zlib.decompressobj(zlib.MAX_WBITS | 32)
+                    data += inflater.decompress(tail)
+                chunk = data
+            if chunk:
+                dest_f.write(chunk)
+                n_written += len(chunk)
+        if inflater is not None:
+            tail = inflater.flush()
+            dest_f.write(tail)
+            n_written += len(tail)
+        dest_f.flush()
+        t_end = timeit.default_timer()
+        elapsed = t_end - t0
+        return {
+            "bytes_read": n_read,
+            "bytes_written": n_written,
+            "ttfb": t_headers - t0,
+            "first_chunk": (t_first if t_first is not None else t_end) - t0,
+            "elapsed": elapsed,
+            "bytes_per_sec": n_read / elapsed if elapsed > 0 else 0.0,
+        }
 
-    def anvlResponseToText(
+    def issueRequest(
         self,
-        response,
-        sort_lines=False,
-        format_timestamps=True,
-        decode=False,
-        one_line=False,
-        encoding="utf-8",
+        path,
+        method,
+        data=None,
+        dest_f=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        gunzip=False,
+        content_type="text/plain; charset=utf-8",
     ):
-        lines = []
-        if response is None:
-            return None
-        response = response.splitlines()
-        if sort_lines and len(response) >= 1:
-            statusLine = response[0]
-            response = response[1:]
-            response.sort()
-            response.insert(0, statusLine)
-        for line in response:
-            if format_timestamps and (
-                line.startswith("_created:") or line.startswith("_updated:")
-            ):
-                ls = line.split(":")
-                line = (
-                    ls[0]
-                    + ": "
-                    + time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(int(ls[1])))
-                )
-            if decode:
-                line = re.sub(
-                    "%([0-9a-fA-F][0-9a-fA-F])",
-                    lambda m: chr(int(m.group(1), 16)),
-                    line,
-                )
-            if one_line:
-                line = line.replace("\n", " ").replace("\r", " ")
-            lines.append(line.encode(encoding))
-        return b"\n".join(lines)
+        """Send a request to the EZID API.
+
+        When dest_f is provided the response body is streamed to it in
+        chunk_size reads, decompressing gzip content on the fly if gunzip is
+        True, and the first value returned is a dict of transfer statistics
+        (bytes_read, bytes_written, ttfb, first_chunk, elapsed, bytes_per_sec)
+        instead of the response text.
 
-    def issueRequest(self, path, method, data=None, dest_f=None):
+        Returns:
+            (response, headers)
+        """
         url = f"{self._server}/{path}"
         self._L.info("sending request: %s", url)
         request = urllib.request.Request(url)
         request.get_method = lambda: method
-        response = None
         if data is not None:
-            request.add_header("Content-Type", "text/plain; charset=utf-8")
+            request.add_header("Content-Type", content_type)
             # noinspection PyUnresolvedReferences
             request.data = data.encode("utf-8")
         if self._cookie is not None:
-            request.add_header("Cookie", self._cookie)
+            request.add_header("Cookie", cookieHeader(self._cookie))
+        if self._concurrency is not None:
+            with self._concurrency.slot() as outcome:
+                return self._sendRequest(
+                    request, dest_f, chunk_size, gunzip, outcome
+                )
+        return self._sendRequest(request, dest_f, chunk_size, gunzip)
+
+    def _sendRequest(self, request, dest_f, chunk_size, gunzip, outcome=None):
+        response = None
+        status = None
+        t0 = timeit.default_timer()
+        req_timing = timing.begin() if self._timed else None
         try:
             connection = self._opener.open(request)
+            status = connection.status
+            if req_timing is not None:
+                req_timing.headers()
+                req_timing.response_header_bytes = timing.headerBytes(
+                    connection.info()
+                )
             if not dest_f is None:
-                while True:
-                    dest_f.write(connection.read(1))
-                    dest_f.flush()
+                stats = self._streamResponse(
+                    connection, dest_f, t0, chunk_size, gunzip
+                )
+                if req_timing is not None:
+                    req_timing.response_bytes = stats["bytes_read"]
+                return stats, connection.info()
             else:
                 response = connection.read()
+                if req_timing is not None:
+                    req_timing.response_bytes = len(response)
                 return response.decode("utf-8"), connection.info()
         except urllib.error.HTTPError as e:
+            status = e.code
+            if req_timing is not None:
+                req_timing.headers()
+                req_timing.response_header_bytes = timing.headerBytes(e.headers)
             self._L.error(f"{e.code:d} {str(e)}")
+            if outcome is not None:
+                # Server overload, as opposed to a problem with the request
+                outcome["error"] = e.code >= 500 or e.code == 429
             if e.fp is not None:
                 response = e.fp.read()
+                if req_timing is not None:
+                    req_timing.response_bytes = len(response)
+                response = response.decode("utf-8")
                 self._L.error(response)
+        finally:
+            if req_timing is not None:
+                timing.end()
+                req_timing.finish()
+                self._local.timing = req_timing.asDict()
+                if self._timing_listener is not None:
+                    event = {
+                        "client": "api",
+                        "method": request.get_method(),
+                        "url": request.full_url,
+                        "status": status,
+                    }
+                    event.update(self._local.timing)
+                    self._timing_listener(event)
+            if self._recorder is not None:
+                self._recorder.record(
+                    "api",
+                    request.get_method(),
+                    request.full_url,
+                    request.data,
+                    status,
+                    timeit.default_timer() - t0,
+                )
         return response, {}
 
     def login(self, username=None, password=None):
@@ -187,15 +345,15 @@ class EZIDClient(object):
             response += f"\nsessionid={self._cookie}\n"
         except IndexError:
             self._L.warning("No sessionid cookie in response.")
-        return self.anvlresponseToDict(response)
+        return self._withTiming(self.anvlresponseToDict(response))
 
     def logout(self):
         response, headers = self.issueRequest("logout", "GET")
-        return self.anvlresponseToDict(response)
+        return self._withTiming(self.anvlresponseToDict(response))
 
     def status(self):
         response, headers = self.issueRequest("status", "GET")
-        return self.anvlresponseToDict(response)
+        return self._withTiming(self.anvlresponseToDict(response))
 
     def mint(self, shoulder, params=None):
         if params is None:
@@ -203,11 +361,208 @@ class EZIDClient(object):
         data = self.formatAnvlRequest(params)
         url = "shoulder/" + self._encode(shoulder)
         response, headers = self.issueRequest(url, "POST", data=data)
-        return self.anvlresponseToDict(response)
+        res = self.anvlresponseToDict(response)
+        if res["status"] == "success":
+            # e.g. "doi:10.5072/FK2X | ark:/b5072/fk2x"
+            for pid in res["status_message"].split("|"):
+                self._invalidateView(pid.strip())
+        return self._withTiming(res)
+
+    def modify(self, pid, params=None):
+        if params is None:
+            params = []
+        data = self.formatAnvlRequest(params)
+        path = "id/" + self._encode(pid)
+        response, headers = self.issueRequest(path, "POST", data=data)
+        self._invalidateView(pid)
+        return self._withTiming(self.anvlresponseToDict(response))
+
+    def anvlArgs(self, record):
+        """Element name, value pairs of record as args for mint() or modify().
+
+        Args:
+            record: dict of element name to value, returned as-is if already
+              a list of encoded names and values
+
+        Returns:
+            list of alternating encoded names and values
+        """
+        if not isinstance(record, dict):
+            return record
+        args = []
+        for k, v in record.items():
+            args.append(k.encode(self._encoding))
+            args.append(v.encode(self._encoding))
+        return args
+
+    def _mintRecord(self, shoulder, index, record):
+        t0 = timeit.default_timer()
+        try:
+            res = self.mint(shoulder, self.anvlArgs(record))
+        except Exception as e:
+            self._L.error("mint %d failed: %s", index, e)
+            res = {"status": "error", "status_message": str(e)}
+        identifier = None
+        if res["status"] == "success" and res["status_message"]:
+            identifier = res["status_message"].split()[0]
+        rec = {
+            "index": index,
+            "identifier": identifier,
+            "status": res["status"],
+            "status_message": res["status_message"],
+            "elapsed": timeit.default_timer() - t0,
+        }
+        if "timing" in res:
+            rec["timing"] = res["timing"]
+        return rec
+
+    def mintMany(
+        self,
+        shoulder,
+        records,
+        workers=DEFAULT_MINT_WORKERS,
+        ordered=True,
+        window=None,
+    ):
+        """Mint an identifier on shoulder for each metadata record.
+
+        Records are drawn lazily from the iterable and minted on a pool of
+        worker threads sharing this client's connection pool. At most window
+        records are in flight at any time, so memory use does not depend on
+        the number of records.
+
+        Args:
+            shoulder: shoulder to mint on, e.g. "ark:/99999/fk4"
+            records: iterable of metadata dicts (or mint() argument lists)
+            workers: number of worker threads
+            ordered: yield results in input order, otherwise as completed
+            window: maximum records in flight, defaults to 2 * workers
+
+        Yields:
+            dict with index, identifier, status, status_message and elapsed,
+            plus timing as for mint() when enabled
+        """
+        if window is None:
+            window = 2 * workers
+        window = max(window, workers)
+        records = enumerate(records)
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="mintMany"
+        )
+        pending = collections.deque()
+
+        def _fill():
+            for index, record in records:
+                pending.append(
+                    executor.submit(self._mintRecord, shoulder, index, record)
+                )
+                if len(pending) >= window:
+                    break
+
+        try:
+            _fill()
+            while pending:
+                if ordered:
+                    yield pending.popleft().result()
+                else:
+                    done, not_done = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    pending = collections.deque(
+                        f for f in pending if f in not_done
+                    )
+                    for future in done:
+                        yield future.result()
+                _fill()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
     def view(self, pid, bang=False):
+        if self._view_cache is not None:
+            res = self._view_cache.get((pid, bang))
+            if res is not None:
+                return self._withTiming(dict(res), sent=False)
+            # A mint or modify completing while the request is in flight
+            # invalidates, so the response may be stale and is not cached.
+            generation = self._view_cache.generation
         path = "id/" + self._encode(pid)
         if bang:
             path += "?prefix_match=yes"
         response, headers = self.issueRequest(path, "GET")
-        return self.anvlresponseToDict(response)
+        res = self.anvlresponseToDict(response)
+        if self._view_cache is not None and res["status"] == "success":
+            self._view_cache.put((pid, bang), dict(res), generation=generation)
+        return self._withTiming(res)
+
+    def requestDownload(self, format="anvl", compression="gzip", **params):
+        """Submit a batch download request.
+
+        Args:
+            format: one of batch.FORMATS
+            compression: "gzip" or "zip", only gzip can be streamed by iterDownload
+            params: other download parameters, e.g. column, createdAfter,
+                type, permanence. A list value repeats the parameter.
+
+        Returns:
+            URL of the download file, or None if the request failed
+        """
+        form = [("format", format), ("compression", compression)]
+        for k, v in params.items():
+            if isinstance(v, (list, tuple)):
+                form += [(k, _v) for _v in v]
+            else:
+                form.append((k, v))
+        response, headers = self.issueRequest(
+            "download_request",
+            "POST",
+            data=urllib.parse.urlencode(form),
+            content_type="application/x-www-form-urlencoded",
+        )
+        res = self.anvlresponseToDict(response)
+        if res["status"] != "success":
+            self._L.error("Download request failed: %s", res["status_message"])
+            return None
+        return res["status_message"]
+
+    def _openDownload(self, url, poll_interval, timeout):
+        t0 = time.time()
+        while True:
+            request = urllib.request.Request(url)
+            if self._cookie is not None:
+                request.add_header("Cookie", cookieHeader(self._cookie))
+            try:
+                return self._opener.open(request)
+            except urllib.error.HTTPError as e:
+                # The file is not published until the download has been built
+                if e.code != 404:
+                    raise
+                e.read()
+                e.close()
+            if timeout is not None and time.time() - t0 > timeout:
+                raise TimeoutError(f"Download not available after {timeout}s: {url}")
+            self._L.info("Waiting for download: %s", url)
+            time.sleep(poll_interval)
+
+    def iterDownload(
+        self,
+        url,
+        format="anvl",
+        poll_interval=DEFAULT_POLL_INTERVAL,
+        timeout=None,
+    ):
+        """Wait for a batch download to be ready, then stream its records.
+
+        Args:
+            url: download URL returned by requestDownload
+            format: format the download was requested in
+            poll_interval: seconds between availability checks
+            timeout: seconds to wait for the download, None to wait forever
+
+        Yields:
+            dict per record, see batch.iterRecords
+        """
+        connection = self._openDownload(url, poll_interval, timeout)
+        try:
+            yield from batch.iterRecords(connection, format=format)
+        finally:
+            connection.close()
@@ -0,0 +1,121 @@
+"""Incremental parsers for EZID batch download files.
+
+EZID batch downloads (https://ezid.cdlib.org/doc/apidoc.html#batch-download)
+are delivered as gzip or zip compressed ANVL, CSV or XML documents. The
+parsers here consume a file object and yield one record at a time, so memory
+use is independent of the size of the download::
+
+    with open("download.anvl.gz", "rb") as f:
+        for record in iterRecords(f, "anvl"):
+            print(record["_id"])
+"""
+
+import csv
+import gzip
+import io
+import xml.etree.ElementTree
+
+from . import anvl
+
+FORMATS = ["anvl", "csv", "xml"]
+"""Batch download formats supported by EZID
+"""
+
+ID_KEY = "_id"
+"""Record key holding the identifier
+"""
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def iterAnvlRecords(lines):
+    """Yield records from ANVL download lines.
+
+    Each record starts with a ":: identifier" line followed by "key: value"
+    lines and ends at a blank line. Values are percent-decoded.
+
+    Args:
+        lines: iterable of str lines
+
+    Yields:
+        dict with ID_KEY and the record metadata
+    """
+    record = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line:
+            if record is not None:
+                yield record
+                record = None
+            continue
+        if line.startswith("::"):
+            if record is not None:
+                yield record
+            record = {ID_KEY: line[2:].strip()}
+            continue
+        if record is None:
+            # Metadata without an identifier line, should not happen
+            continue
+        K, sep, V = line.partition(":")
+        if sep:
+            record[anvl.unescape(K)] = anvl.unescape(V.strip())
+    if record is not None:
+        yield record
+
+
+def iterCsvRecords(lines):
+    """Yield records from CSV download lines.
+
+    The first row names the columns, as selected by the "column" parameters
+    of the download request.
+    """
+    yield from csv.DictReader(lines)
+
+
+def iterXmlRecords(f):
+    """Yield records from an XML download.
+
+    Elements are discarded as soon as each record has been read, so the
+    document tree is never held in memory.
+
+    Args:
+        f: binary file object
+    """
+    context = xml.etree.ElementTree.iterparse(f, events=("start", "end"))
+    _, root = next(context)
+    for event, element in context:
+        if event != "end" or element.tag != "record":
+            continue
+        record = {ID_KEY: element.get("identifier")}
+        for child in element.iter("element"):
+            record[child.get("name")] = child.text if child.text is not None else ""
+        yield record
+        root.clear()
+
+
+def iterRecords(f, format="anvl", encoding="utf-8"):
+    """Yield records from a batch download file object.
+
+    Gzip compressed content is detected and decompressed on the fly.
+
+    Args:
+        f: binary file object, e.g. an open file or HTTP response
+        format: one of FORMATS
+        encoding: text encoding of the download
+
+    Yields:
+        dict per record
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unsupported download format: {format}")
+    f = io.BufferedReader(f) if not hasattr(f, "peek") else f
+    if f.peek(2)[:2] == _GZIP_MAGIC:
+        f = gzip.GzipFile(fileobj=f, mode="rb")
+    if format == "xml":
+        yield from iterXmlRecords(f)
+        return
+    text = io.TextIOWrapper(f, encoding=encoding, newline="")
+    if format == "csv":
+        yield from iterCsvRecords(text)
+    else:
+        yield from iterAnvlRecords(text)
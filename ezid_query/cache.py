@@ -0,0 +1,114 @@
+"""Bounded in-memory cache with LRU eviction and per-entry expiry.
+"""
+
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """Thread safe least recently used cache with a time to live.
+
+    Args:
+        maxsize: maximum number of entries
+        ttl: seconds an entry remains valid, None for no expiry
+        clock: function returning the current time in seconds
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+        # Incremented by invalidate and clear, see put
+        self._generation = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return default
+            expires, value = entry
+            if expires is not None and expires <= self._clock():
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    @property
+    def generation(self):
+        """Counter incremented each time entries are invalidated or cleared."""
+        with self._lock:
+            return self._generation
+
+    def put(self, key, value, generation=None):
+        """Store value under key.
+
+        Args:
+            key: cache key
+            value: value to store
+            generation: generation read before value was fetched. If entries
+              have been invalidated since, value may be stale and is not stored.
+
+        Returns:
+            True if value was stored
+        """
+        expires = None if self.ttl is None else self._clock() + self.ttl
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return True
+
+    def invalidate(self, predicate):
+        """Remove entries for which predicate(key) is True.
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            keys = [k for k in self._entries if predicate(k)]
+            for k in keys:
+                del self._entries[k]
+            self._invalidations += len(keys)
+            self._generation += 1
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        """Cache counters.
+
+        Returns:
+            dict with size, hits, misses, evictions, expirations and invalidations
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+            }
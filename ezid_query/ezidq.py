@@ -1,10 +1,18 @@
+import concurrent.futures
 import json
 import logging
+import math
 import requests
+import requests.adapters
 import requests.auth
 import bs4
+import datetime
+import lxml.etree
 import re
 
+from . import searchcache
+from . import timing
+
 '''
 Watch queries with:
 
@@ -15,6 +23,78 @@ mysqladmin -h hostname -u username -p -i 1 processlist
 
 '''
 
+
+class _SearchResultsTarget(object):
+    """lxml parser target keeping only the results table and count header.
+
+    Receives parse events without a tree being built. Text is collected
+    only within td cells of the first table.table3 and within the
+    body > div.customize-table > form > h2 header, everything else is
+    discarded as it is read.
+    """
+
+    def __init__(self):
+        # (tag, classes) of the open elements
+        self._stack = []
+        self._table_depth = None
+        self._cell_depth = 0
+        self._cell = None
+        self._count_depth = None
+        self._count = None
+        self.records = []
+
+    def start(self, tag, attrib):
+        classes = attrib.get("class", "").split()
+        self._stack.append((tag, classes))
+        depth = len(self._stack)
+        if self._table_depth is None:
+            if tag == "table" and "table3" in classes:
+                self._table_depth = depth
+            elif (
+                tag == "h2"
+                and self._count is None
+                and self._count_depth is None
+                and [t for t, _ in self._stack] == ["html", "body", "div", "form", "h2"]
+                and "customize-table" in self._stack[2][1]
+            ):
+                self._count_depth = depth
+                self._count = []
+        elif self._table_depth > 0:
+            if tag == "tr":
+                self.records.append([])
+            elif tag == "td":
+                self._cell_depth += 1
+                if self._cell_depth == 1:
+                    self._cell = []
+
+    def end(self, tag):
+        depth = len(self._stack)
+        self._stack.pop()
+        if self._table_depth is not None and self._table_depth > 0:
+            if depth == self._table_depth:
+                # Done with the table, 0 so no later table3 is read
+                self._table_depth = 0
+            elif tag == "td" and self._cell_depth > 0:
+                self._cell_depth -= 1
+                if self._cell_depth == 0:
+                    if self.records:
+                        self.records[-1].append("".join(self._cell).strip())
+                    self._cell = None
+        elif depth == self._count_depth:
+            self._count_depth = None
+
+    def data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+        elif self._count_depth is not None:
+            self._count.append(data)
+
+    def close(self):
+        """(table found, records, count header text or None)"""
+        count = None if self._count is None else "".join(self._count)
+        return self._table_depth is not None, self.records, count
+
+
 class EzidSearch(object):
     BASE_URL = "https://ezid-stg.cdlib.org"
 
@@ -53,14 +133,74 @@ class EzidSearch(object):
     TARGET_SEARCH = "search"
     TARGET_MANAGE = "manage"
 
-    RESULTS_RE = re.compile("of\s([,0-9]*)\sSearch")
+    # Result page number and page size query parameters
+    PAGE_PARAM = "p"
+    PAGE_SIZE_PARAM = "ps"
+    DEFAULT_PAGE_SIZE = 100
+    DEFAULT_PREFETCH = 4
 
-    def __init__(self):
+    RESULTS_RE = re.compile(r"of\s([,0-9]*)\sSearch")
+
+    # Engines for parseSearchResults. lxml streams parse events to a target
+    # keeping only the results table and count header, no tree is built.
+    # bs4 builds the full soup.
+    PARSER_LXML = "lxml"
+    PARSER_BS4 = "bs4"
+    PARSERS = [PARSER_LXML, PARSER_BS4]
+
+    def __init__(
+        self,
+        base_url=None,
+        parser=PARSER_LXML,
+        pool_size=None,
+        cache=None,
+        recorder=None,
+        timed=False,
+        timing_listener=None,
+    ):
+        if base_url is None:
+            base_url = EzidSearch.BASE_URL
+        assert parser in EzidSearch.PARSERS
+        self._base_url = base_url.rstrip("/")
+        self._parser = parser
+        # Optional searchcache.SearchCache of search responses
+        self._cache = cache
+        # User of the current login, part of the cache key
+        self._username = None
+        # Optional traffic.TrafficRecorder logging every request
+        self._recorder = recorder
+        # Per phase request timing, added to search results as "timing" and
+        # passed to timing_listener with the method, url and status
+        self._timed = timed or timing_listener is not None
+        self._timing_listener = timing_listener
         self._session = requests.Session()
+        if pool_size is not None or self._timed:
+            adapter_class = requests.adapters.HTTPAdapter
+            if self._timed:
+                adapter_class = timing.TimedHTTPAdapter
+            # Keep a connection per thread when the session is shared
+            pool_size = pool_size or requests.adapters.DEFAULT_POOLSIZE
+            adapter = adapter_class(
+                pool_connections=pool_size, pool_maxsize=pool_size
+            )
+            self._session.mount("http://", adapter)
+            self._session.mount("https://", adapter)
+        if recorder is not None:
+            self._session.hooks["response"].append(self._recordResponse)
 
     def getLogger(self):
         return logging.getLogger("EzidSearch")
 
+    def _recordResponse(self, r, *args, **kwargs):
+        self._recorder.record(
+            "search",
+            r.request.method,
+            r.request.url,
+            r.request.body,
+            r.status_code,
+            r.elapsed.total_seconds(),
+        )
+
     def logResponse(self, r):
         L = self.getLogger()
         L.info("Request: %s", r.url)
@@ -68,19 +208,102 @@ class EzidSearch(object):
         L.info("Status: %s", r.status_code)
         L.info("Message: %s", r.reason)
 
+    def _get(self, url, **kwargs):
+        """GET url, timing each phase when enabled.
+
+        Returns:
+            (response, timing dict or None)
+        """
+        if not self._timed:
+            return self._session.get(url, **kwargs), None
+        req_timing = timing.begin()
+        try:
+            response = self._session.get(url, stream=True, **kwargs)
+            req_timing.headers()
+            response.content
+        finally:
+            timing.end()
+            req_timing.finish()
+        req_timing.response_header_bytes = timing.headerBytes(response.raw.headers)
+        req_timing.response_bytes = response.raw.tell()
+        res = req_timing.asDict()
+        if self._timing_listener is not None:
+            event = {
+                "client": "search",
+                "method": "GET",
+                "url": response.url,
+                "status": response.status_code,
+            }
+            event.update(res)
+            self._timing_listener(event)
+        return response, res
+
+    def _responseSummary(self, response, res_timing):
+        return {
+            "url": response.url,
+            "status": response.status_code,
+            "elapsed": response.elapsed,
+            "timing": res_timing,
+        }
+
     def login(self, username, passwd):
-        url = f"{EzidSearch.BASE_URL}/login"
-        response = self._session.get(url, auth=(username, passwd))
+        """Login to the UI.
+
+        Returns:
+            dict with url, status, elapsed and timing as for search
+        """
+        url = f"{self._base_url}/login"
+        response, res_timing = self._get(url, auth=(username, passwd))
         self.logResponse(response)
+        self._username = username
+        return self._responseSummary(response, res_timing)
 
     def logout(self):
-        url = f"{EzidSearch.BASE_URL}/logout"
-        response = self._session.get(url)
+        """Logout, returning a dict as for login."""
+        url = f"{self._base_url}/logout"
+        response, res_timing = self._get(url)
         self.logResponse(response)
+        self._username = None
+        return self._responseSummary(response, res_timing)
+
+    def cacheStats(self):
+        """Counters of the search cache, None if caching is not enabled."""
+        if self._cache is None:
+            return None
+        return self._cache.stats()
+
+    def _totalFromText(self, txt):
+        matches = EzidSearch.RESULTS_RE.search(txt)
+        if matches is None:
+            return -1
+        return int(matches.group(1).replace(",", ""))
 
     def parseSearchResults(self, body):
-        # TODO: returns only the first page of hits
-        # #page-directselect-bottom
+        """Records and total hit count from a search results page.
+
+        Returns:
+            dict with total (-1 if not found) and records, a list of rows
+            of cell text
+        """
+        if self._parser == EzidSearch.PARSER_BS4:
+            return self._parseSearchResultsSoup(body)
+        if not body:
+            return {"total": -1, "records": []}
+        parser = lxml.etree.HTMLParser(target=_SearchResultsTarget())
+        try:
+            parser.feed(body)
+            found, records, count_text = parser.close()
+        except (ValueError, lxml.etree.ParserError):
+            return self._parseSearchResultsSoup(body)
+        res = {"total": -1, "records": []}
+        if not found:
+            return res
+        res["records"] = records
+        if count_text is not None:
+            res["total"] = self._totalFromText(count_text)
+        return res
+
+    def _parseSearchResultsSoup(self, body):
         soup = bs4.BeautifulSoup(body, features="lxml")
         res = {"total": -1, "records": []}
         tbl = soup.find("table", class_="table3")
@@ -93,34 +316,147 @@ class EzidSearch(object):
             res["records"].append(row)
         result_count = soup.select("body > div.customize-table > form > h2")
         if len(result_count) > 0:
-            _txt = result_count[0].text
-
-            matches = EzidSearch.RESULTS_RE.search(_txt)
-            if matches is not None:
-                _total = matches.group(1).replace(",", "")
-                res["total"] = int(_total)
+            res["total"] = self._totalFromText(result_count[0].text)
         return res
 
-    def search(self, query, target=None):
+    def search(self, query, target=None, cache_mode=None):
+        """Run a search and parse the first page of results.
+
+        Args:
+            query: search form values, None values are omitted
+            target: search or manage
+            cache_mode: searchcache mode overriding the cache default
+
+        Returns:
+            dict with results, url, status, elapsed, cached and timing,
+            the per phase timing dict or None if not enabled
+        """
         if target is None:
             target = EzidSearch.TARGET_SEARCH
         assert query.get("object_type", None) in EzidSearch.OBJECT_TYPES
         assert query.get("id_type", None) in EzidSearch.IDENTIFIER_TYPES
-        url = f"{EzidSearch.BASE_URL}/{target}"
+        url = f"{self._base_url}/{target}"
         headers = {"Accept": "application/json"}
         params = {}
         for k, v in query.items():
             if not v is None:
                 params[k] = v
-        response = self._session.get(url, headers=headers, params=params)
+        key = None
+        if self._cache is not None:
+            if cache_mode is None:
+                cache_mode = self._cache.mode
+            if cache_mode != searchcache.MODE_BYPASS:
+                key = searchcache.queryKey(
+                    self._base_url, target, params, self._username
+                )
+            if cache_mode == searchcache.MODE_USE:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    return {
+                        "results": self.parseSearchResults(cached["text"]),
+                        "url": cached["url"],
+                        "status": cached["status"],
+                        "elapsed": datetime.timedelta(seconds=cached["elapsed"]),
+                        "cached": True,
+                        "timing": None,
+                    }
+        response, res_timing = self._get(url, headers=headers, params=params)
+        if key is not None and response.status_code == 200:
+            self._cache.put(
+                key,
+                response.url,
+                response.status_code,
+                response.elapsed.total_seconds(),
+                response.text,
+            )
         res = {
             "results": self.parseSearchResults(response.text),
             "url": response.url,
             "status": response.status_code,
             "elapsed": response.elapsed,
+            "cached": False,
+            "timing": res_timing,
         }
         return res
 
+    def _searchPage(self, query, target, page, page_size):
+        q = dict(query)
+        q[EzidSearch.PAGE_PARAM] = page
+        q[EzidSearch.PAGE_SIZE_PARAM] = page_size
+        res = self.search(q, target=target)
+        if res["status"] != 200:
+            raise requests.HTTPError(f"{res['status']} response for {res['url']}")
+        # Header rows contain th cells only
+        res["results"]["records"] = [r for r in res["results"]["records"] if r]
+        return res
+
+    def iterSearch(
+        self,
+        query,
+        target=None,
+        page_size=DEFAULT_PAGE_SIZE,
+        prefetch=DEFAULT_PREFETCH,
+        max_pages=None,
+        max_records=None,
+    ):
+        """Yield the records of every page of results for query.
+
+        The first page is fetched to learn the total, after which up to
+        prefetch following pages are requested concurrently over the shared
+        session while earlier pages are consumed. At most prefetch pages
+        are held in memory.
+
+        Args:
+            query: search form, as for search()
+            target: search or manage
+            page_size: records requested per page
+            prefetch: number of pages requested ahead of the consumer
+            max_pages: stop after this many pages
+            max_records: stop after this many records
+
+        Yields:
+            list of cell text for each result row
+        """
+        L = self.getLogger()
+        first = self._searchPage(query, target, 1, page_size)
+        total = first["results"]["total"]
+        n_pages = 1
+        if total > 0:
+            n_pages = math.ceil(total / page_size)
+        if max_pages is not None:
+            n_pages = min(n_pages, max_pages)
+        if max_records is not None:
+            n_pages = min(n_pages, math.ceil(max_records / page_size))
+        L.info("Harvesting %s pages of %s results", n_pages, total)
+        remaining = max_records
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, prefetch), thread_name_prefix="EzidSearch"
+        )
+        pending = []
+        next_page = 2
+        try:
+            res = first
+            while True:
+                while next_page <= n_pages and len(pending) < max(1, prefetch):
+                    pending.append(
+                        executor.submit(
+                            self._searchPage, query, target, next_page, page_size
+                        )
+                    )
+                    next_page += 1
+                records = res["results"]["records"]
+                for record in records:
+                    if remaining is not None:
+                        if remaining <= 0:
+                            return
+                        remaining -= 1
+                    yield record
+                if not records or not pending:
+                    return
+                res = pending.pop(0).result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
     def blankQueryForm(self, manager=False):
         query_form = {
             "keywords": None,
@@ -0,0 +1,501 @@
+"""Local stand-in for the EZID service, for offline testing and benchmarking.
+
+Implements enough of the EZID API and UI for the clients in this package:
+``/status``, ``/login``, ``/logout``, ``/shoulder/<shoulder>``,
+``/id/<id>`` (view and modify), ``/download_request`` and an HTML
+``/search`` page shaped like the real one. Identifiers are held in memory.
+Each endpoint can be given an artificial latency, and the size of view and
+search responses is configurable, so client throughput can be measured
+without a network::
+
+    python -m ezid_query.fakeezid --port 18880 --latency mint=0.05,view=0.01
+
+or from Python::
+
+    server = FakeEZIDServer(latency={"view": 0.01})
+    url = server.start()
+    ...
+    server.stop()
+
+The server speaks HTTP/1.1 with keep-alive over asyncio streams.
+"""
+
+import asyncio
+import base64
+import email.parser
+import gzip
+import html
+import http
+import http.client
+import logging
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+
+import click
+
+from . import anvl
+
+ENDPOINTS = [
+    "status",
+    "login",
+    "logout",
+    "mint",
+    "view",
+    "modify",
+    "search",
+    "download",
+]
+"""Endpoint names used for latency configuration
+"""
+
+DEFAULT_SEARCH_TOTAL = 1234
+DEFAULT_PAGE_SIZE = 10
+
+SEARCH_COLUMNS = [
+    "Identifier",
+    "Owner",
+    "Title",
+    "Creator",
+    "Publisher",
+    "Date",
+    "Type",
+]
+
+
+def parseLatency(spec):
+    """Parse "endpoint=seconds,..." into a dict."""
+    latency = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        k, _, v = item.partition("=")
+        if k not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint: {k}")
+        latency[k] = float(v)
+    return latency
+
+
+class FakeEZID(object):
+    """In-memory EZID behaviour, independent of the HTTP layer.
+
+    Args:
+        latency: dict of endpoint name to seconds of added latency
+        jitter: fraction of the latency added or removed at random
+        users: dict of username to password, None accepts any credentials
+        view_padding: bytes of extra metadata added to view responses
+        search_total: number of hits reported by every search
+        host: host:port used in generated download URLs
+    """
+
+    def __init__(
+        self,
+        latency=None,
+        jitter=0.0,
+        users=None,
+        view_padding=0,
+        search_total=DEFAULT_SEARCH_TOTAL,
+        host="localhost",
+    ):
+        self._L = logging.getLogger(self.__class__.__name__)
+        self.latency = latency or {}
+        self.jitter = jitter
+        self.users = users
+        self.view_padding = view_padding
+        self.search_total = search_total
+        self.host = host
+        self.identifiers = {}
+        self.sessions = {}
+        self.downloads = {}
+        self.requests = 0
+        self._counter = 0
+        self._random = random.Random()
+
+    async def delay(self, endpoint):
+        t = self.latency.get(endpoint, 0.0)
+        if t > 0 and self.jitter > 0:
+            t *= 1.0 + self.jitter * (2.0 * self._random.random() - 1.0)
+        if t > 0:
+            await asyncio.sleep(t)
+
+    def authenticate(self, headers):
+        """Username for the request credentials or session, None if anonymous."""
+        cookies = headers.get("Cookie", "")
+        for cookie in cookies.split(";"):
+            k, _, v = cookie.strip().partition("=")
+            if k == "sessionid" and v in self.sessions:
+                return self.sessions[v]
+        auth = headers.get("Authorization", "")
+        if auth.startswith("Basic "):
+            try:
+                user, _, passwd = (
+                    base64.b64decode(auth[6:]).decode("utf-8").partition(":")
+                )
+            except ValueError:
+                return None
+            if self.users is None or self.users.get(user) == passwd:
+                return user
+        return None
+
+    def mintIdentifier(self, shoulder, owner, metadata):
+        self._counter += 1
+        suffix = f"{self._counter:07d}"
+        if shoulder.startswith("doi:"):
+            pid = f"{shoulder}{suffix}".upper().replace("DOI:", "doi:", 1)
+            shadow = "ark:/b" + pid[len("doi:10.") :].lower()
+        else:
+            pid = f"{shoulder}{suffix}"
+            shadow = None
+        now = str(int(time.time()))
+        record = {
+            "_owner": owner,
+            "_ownergroup": owner,
+            "_created": now,
+            "_updated": now,
+            "_profile": "datacite" if shoulder.startswith("doi:") else "erc",
+            "_status": "public",
+            "_export": "yes",
+            "_target": metadata.pop("_target", metadata.get("target", "")),
+        }
+        if shadow is not None:
+            record["_shadowedby"] = shadow
+        record.update(metadata)
+        self.identifiers[pid] = record
+        if shadow is not None:
+            return f"{pid} | {shadow}"
+        return pid
+
+    def viewBody(self, pid, record):
+        lines = [f"success: {pid}"]
+        for k, v in record.items():
+            lines.append(f"{anvl.escapeKey(k)}: {anvl.escapeValue(v)}")
+        if self.view_padding > 0:
+            lines.append(f"_padding: {'x' * self.view_padding}")
+        return "\n".join(lines)
+
+    def searchPage(self, params):
+        try:
+            page = max(1, int(params.get("p", 1)))
+            page_size = max(1, int(params.get("ps", DEFAULT_PAGE_SIZE)))
+        except ValueError:
+            page, page_size = 1, DEFAULT_PAGE_SIZE
+        total = self.search_total
+        first = (page - 1) * page_size
+        last = min(total, first + page_size)
+        rows = []
+        for i in range(first, last):
+            cells = [
+                f"ark:/99999/fk4{i:07d}",
+                "apitest",
+                f"Test record {i}",
+                "ezid-testing",
+                "test-publisher",
+                "2021-10-12 10:00:00",
+                "Text",
+            ]
+            rows.append(
+                '<tr class="table3__row">'
+                + "".join(
+                    f'<td class="table3__cell">{html.escape(c)}</td>' for c in cells
+                )
+                + "</tr>"
+            )
+        pages = max(1, -(-total // page_size))
+        options = "".join(
+            f'<option value="{p}">{p}</option>' for p in range(1, min(pages, 100) + 1)
+        )
+        heading = (
+            f"Results: {first + 1 if rows else 0} to {last} of {total:,} Search Results"
+        )
+        return (
+            '<!DOCTYPE html>\n<html lang="en"><head><title>EZID: Search</title>'
+            '<link rel="stylesheet" href="/static/stylesheets/main.css"></head>\n'
+            '<body>\n<header class="header"><div><a href="/">EZID</a></div></header>\n'
+            '<div class="customize-table">\n'
+            '<form id="search-results-form" method="get" action="/search">\n'
+            f'<h2 class="heading__primary-text">{heading}</h2>\n'
+            '<table class="table3">\n<thead><tr class="table3__row">'
+            + "".join(f'<th class="table3__head">{c}</th>' for c in SEARCH_COLUMNS)
+            + "</tr></thead>\n<tbody>\n"
+            + "\n".join(rows)
+            + "\n</tbody>\n</table>\n"
+            f'<select id="page-directselect-bottom" name="p">{options}</select>\n'
+            "</form>\n</div>\n</body></html>\n"
+        )
+
+    def downloadBody(self):
+        records = []
+        for pid, record in self.identifiers.items():
+            lines = [f":: {pid}"]
+            for k, v in record.items():
+                lines.append(f"{anvl.escapeKey(k)}: {anvl.escapeValue(v)}")
+            records.append("\n".join(lines) + "\n")
+        return gzip.compress("\n".join(records).encode("utf-8"))
+
+    async def handle(self, method, target, headers, body):
+        """Dispatch a request.
+
+        Returns:
+            (status, dict of headers, body bytes or str)
+        """
+        self.requests += 1
+        url = urllib.parse.urlsplit(target)
+        path = urllib.parse.unquote(url.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        text = {"Content-Type": "text/plain; charset=utf-8"}
+        # urllib's basic auth handler only sends credentials when challenged
+        unauthorized = (
+            401,
+            dict(text, **{"WWW-Authenticate": 'Basic realm="EZID"'}),
+            "error: unauthorized",
+        )
+        if path == "/" and method == "GET":
+            return 200, {"Content-Type": "text/html"}, "<html><body>EZID</body></html>"
+        if path.startswith("/static/"):
+            return 200, {"Content-Type": "text/css"}, "/* fake */\n"
+        if path == "/status":
+            await self.delay("status")
+            return 200, text, "success: EZID is up"
+        if path == "/login":
+            await self.delay("login")
+            user = self.authenticate(headers)
+            if user is None:
+                return unauthorized
+            session = uuid.uuid4().hex
+            self.sessions[session] = user
+            return (
+                200,
+                dict(text, **{"Set-Cookie": f"sessionid={session}; Path=/"}),
+                "success: session cookie returned",
+            )
+        if path == "/logout":
+            await self.delay("logout")
+            return 200, text, "success: authentication credentials flushed"
+        if path == "/search":
+            await self.delay("search")
+            return (
+                200,
+                {"Content-Type": "text/html; charset=utf-8"},
+                self.searchPage(params),
+            )
+        if path.startswith("/download/"):
+            await self.delay("download")
+            data = self.downloads.get(path[len("/download/") :])
+            if data is None:
+                return 404, text, "error: not found"
+            return 200, {"Content-Type": "application/gzip"}, data
+        user = self.authenticate(headers)
+        if path == "/download_request" and method == "POST":
+            await self.delay("download")
+            if user is None:
+                return unauthorized
+            name = f"{uuid.uuid4().hex}.txt.gz"
+            self.downloads[name] = self.downloadBody()
+            return 200, text, f"success: http://{self.host}/download/{name}"
+        if path.startswith("/shoulder/") and method == "POST":
+            await self.delay("mint")
+            if user is None:
+                return unauthorized
+            metadata = anvl.toDict(
+                "success:\n" + body.decode("utf-8"),
+                format_timestamps=False,
+                decode=True,
+            )
+            for k in ("status", "status_message", "body"):
+                metadata.pop(k)
+            pid = self.mintIdentifier(path[len("/shoulder/") :], user, metadata)
+            return 201, text, f"success: {pid}"
+        if path.startswith("/id/"):
+            pid = path[len("/id/") :]
+            record = self.identifiers.get(pid)
+            if method == "POST":
+                await self.delay("modify")
+                if user is None:
+                    return unauthorized
+                if record is None:
+                    return 400, text, "error: bad request - no such identifier"
+                metadata = anvl.toDict(
+                    "success:\n" + body.decode("utf-8"),
+                    format_timestamps=False,
+                    decode=True,
+                )
+                for k in ("status", "status_message", "body"):
+                    metadata.pop(k)
+                record.update(metadata)
+                record["_updated"] = str(int(time.time()))
+                return 200, text, f"success: {pid}"
+            await self.delay("view")
+            if record is None and params.get("prefix_match") == "yes":
+                for k in self.identifiers:
+                    if k.startswith(pid):
+                        pid, record = k, self.identifiers[k]
+                        break
+            if record is None:
+                return 400, text, "error: bad request - no such identifier"
+            return 200, text, self.viewBody(pid, record)
+        return 404, text, "error: not found"
+
+
+class FakeEZIDServer(object):
+    """HTTP/1.1 front end for FakeEZID.
+
+    Args:
+        host: interface to listen on
+        port: port to listen on, 0 picks a free port
+        kwargs: passed to FakeEZID
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, **kwargs):
+        self._L = logging.getLogger(self.__class__.__name__)
+        self.host = host
+        self.port = port
+        self.ezid = FakeEZID(**kwargs)
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def _readRequest(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, version = request_line.decode("latin-1").rstrip().split(" ", 2)
+        header_lines = []
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            header_lines.append(line)
+        headers = email.parser.BytesParser(_class=http.client.HTTPMessage).parsebytes(
+            b"".join(header_lines)
+        )
+        length = int(headers.get("Content-Length", 0) or 0)
+        body = await reader.readexactly(length) if length else b""
+        return method, target, version, headers, body
+
+    async def _handleConnection(self, reader, writer):
+        try:
+            while True:
+                request = await self._readRequest(reader)
+                if request is None:
+                    break
+                method, target, version, headers, body = request
+                try:
+                    status, response_headers, data = await self.ezid.handle(
+                        method, target, headers, body
+                    )
+                except Exception as e:
+                    self._L.exception(e)
+                    status, response_headers, data = 500, {}, "error: internal"
+                if isinstance(data, str):
+                    data = data.encode("utf-8")
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("Connection", "").lower() != "close"
+                )
+                reason = http.HTTPStatus(status).phrase
+                head = [f"HTTP/1.1 {status} {reason}"]
+                response_headers = dict(response_headers)
+                response_headers["Content-Length"] = str(len(data))
+                if not keep_alive:
+                    response_headers["Connection"] = "close"
+                head += [f"{k}: {v}" for k, v in response_headers.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # stop() cancels handlers for clients still holding keep-alive
+            # connections; end quietly rather than logging a traceback.
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """Start listening on the running loop."""
+        self._server = await asyncio.start_server(
+            self._handleConnection, self.host, self.port
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.ezid.host = f"{self.host}:{self.port}"
+        return self._server
+
+    def start(self):
+        """Run the server on an event loop in a background thread.
+
+        Returns:
+            base URL of the server
+        """
+        started = threading.Event()
+
+        def _run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.serve())
+            started.set()
+            self._loop.run_forever()
+            self._server.close()
+            # Drop connections clients are still holding open
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True)
+            )
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=_run, name="fakeezid", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.url
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Interface to listen on")
+@click.option("--port", default=18880, help="Port to listen on")
+@click.option("--latency", default="", help="Added latency, endpoint=seconds,...")
+@click.option("--jitter", default=0.0, help="Latency jitter as a fraction")
+@click.option("--view-padding", default=0, help="Extra bytes per view response")
+@click.option("--search-total", default=DEFAULT_SEARCH_TOTAL, help="Hits per search")
+def main(host, port, latency, jitter, view_padding, search_total):
+    """Run a local stand-in EZID service."""
+    try:
+        latency = parseLatency(latency)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--latency")
+    server = FakeEZIDServer(
+        host=host,
+        port=port,
+        latency=latency,
+        jitter=jitter,
+        view_padding=view_padding,
+        search_total=search_total,
+    )
+
+    async def _serve():
+        srv = await server.serve()
+        logging.info("Fake EZID listening on %s", server.url)
+        async with srv:
+            await srv.serve_forever()
+
+    asyncio.run(_serve())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,399 @@
+"""Open-loop load generator for the EZID API.
+
+Issues a weighted mix of status, login, mint and view operations through
+EZIDClient at a target request rate. Requests are scheduled on a fixed (or
+Poisson) timetable independent of how quickly earlier requests complete, and
+latency is measured from the scheduled start time, so a slow server shows up
+as high latency rather than as a lower request rate (coordinated omission).
+
+Example::
+
+    ezid-load -u apitest -p apitest --rate 20 --duration 120 \\
+        --mix status=5,view=3,mint=1,login=1 http://localhost:18880
+"""
+
+import bisect
+import collections
+import concurrent.futures
+import datetime
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+
+import click
+
+from . import apicli
+from . import transport
+
+OPERATIONS = ["status", "login", "mint", "view"]
+
+DEFAULT_MIX = "status=5,view=3,mint=1,login=1"
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def parseMix(mix):
+    """Parse "op=weight,op=weight" into a dict of weights.
+
+    Raises:
+        ValueError for unknown operations or invalid weights
+    """
+    weights = {}
+    for item in mix.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        op, _, w = item.partition("=")
+        op = op.strip()
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {op}")
+        weights[op] = float(w) if w else 1.0
+        if weights[op] < 0:
+            raise ValueError(f"Negative weight for {op}")
+    if sum(weights.values()) <= 0:
+        raise ValueError("At least one operation must have a positive weight")
+    return weights
+
+
+class LatencyHistogram(object):
+    """Log bucketed latency histogram with bounded relative error.
+
+    Latencies are recorded in buckets whose width grows geometrically by
+    precision, so percentiles are accurate to about precision/2 whatever the
+    number of samples, in constant memory.
+
+    Args:
+        precision: relative width of each bucket
+        minimum: smallest latency distinguished, in seconds
+    """
+
+    def __init__(self, precision=0.01, minimum=1e-6):
+        self._log_base = math.log1p(precision)
+        self._minimum = minimum
+        self._buckets = collections.Counter()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, v):
+        return int(math.log(max(v, self._minimum) / self._minimum) / self._log_base)
+
+    def _value(self, index):
+        # Midpoint of the bucket
+        return self._minimum * math.exp((index + 0.5) * self._log_base)
+
+    def record(self, v):
+        self._buckets[self._index(v)] += 1
+        self.count += 1
+        self.total += v
+        self.min = v if self.min is None else min(self.min, v)
+        self.max = v if self.max is None else max(self.max, v)
+
+    def merge(self, other):
+        self._buckets.update(other._buckets)
+        self.count += other.count
+        self.total += other.total
+        for v in (other.min, other.max):
+            if v is not None:
+                self.min = v if self.min is None else min(self.min, v)
+                self.max = v if self.max is None else max(self.max, v)
+
+    def percentile(self, p):
+        """Latency at percentile p (0-100), None if empty."""
+        if self.count == 0:
+            return None
+        rank = max(1, math.ceil(self.count * p / 100.0))
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def summary(self):
+        res = {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+        }
+        for p in PERCENTILES:
+            res[f"p{p:g}".replace(".", "")] = self.percentile(p)
+        return res
+
+
+class OperationStats(object):
+    """Latency histogram and outcome counters for one operation."""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = 0
+        self.skipped = 0
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.errors += other.errors
+        self.skipped += other.skipped
+
+    def summary(self, elapsed):
+        res = self.latency.summary()
+        res["errors"] = self.errors
+        res["skipped"] = self.skipped
+        res["throughput"] = self.latency.count / elapsed if elapsed > 0 else None
+        return res
+
+
+class LoadGenerator(object):
+    """Replay a weighted operation mix against EZID at a fixed rate.
+
+    Args:
+        server_url: base URL of the EZID service
+        username: EZID user, used for login and mint
+        password: password for username
+        mix: dict of operation weights, see parseMix
+        rate: target requests per second
+        duration: seconds to generate load for
+        workers: maximum requests in flight
+        shoulder: shoulder used by mint operations
+        identifiers: identifiers used by view operations, minted
+            identifiers are added as the run proceeds
+        poisson: use exponentially distributed arrivals instead of a
+            fixed interval
+        interval: seconds per reporting window
+        seed: random seed for reproducible operation sequences
+        report: called with a dict for each reporting window
+    """
+
+    def __init__(
+        self,
+        server_url,
+        username=None,
+        password=None,
+        mix=None,
+        rate=10.0,
+        duration=60.0,
+        workers=64,
+        shoulder="ark:/99999/fk4",
+        identifiers=None,
+        poisson=False,
+        interval=10.0,
+        seed=None,
+        report=None,
+    ):
+        self._L = logging.getLogger(self.__class__.__name__)
+        self.server_url = server_url
+        self.username = username
+        self.password = password
+        self.mix = mix if mix is not None else parseMix(DEFAULT_MIX)
+        self.rate = rate
+        self.duration = duration
+        self.workers = workers
+        self.shoulder = shoulder
+        self.poisson = poisson
+        self.interval = interval
+        self.report = report
+        self._random = random.Random(seed)
+        self._ops = list(self.mix.keys())
+        self._cumulative = []
+        _total = 0.0
+        for op in self._ops:
+            _total += self.mix[op]
+            self._cumulative.append(_total)
+        self._identifiers = collections.deque(identifiers or [], maxlen=10000)
+        self._pool = transport.ConnectionPool(maxsize=workers)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._window = collections.defaultdict(OperationStats)
+        self._totals = collections.defaultdict(OperationStats)
+
+    def _client(self):
+        cli = getattr(self._local, "client", None)
+        if cli is None:
+            cli = apicli.EZIDClient(
+                self.server_url,
+                username=self.username,
+                password=self.password,
+                pool=self._pool,
+            )
+            self._local.client = cli
+        return cli
+
+    def _chooseOperation(self):
+        r = self._random.random() * self._cumulative[-1]
+        return self._ops[bisect.bisect_right(self._cumulative, r)]
+
+    def _mintMetadata(self):
+        return {
+            "erc.who": "ezid-load",
+            "erc.what": "load test",
+            "erc.when": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+
+    def _invoke(self, op, pid):
+        cli = self._client()
+        if op == "status":
+            return cli.status()
+        if op == "login":
+            return cli.login()
+        if op == "mint":
+            res = cli.mint(self.shoulder, cli.anvlArgs(self._mintMetadata()))
+            if res["status"] == "success":
+                self._identifiers.append(res["status_message"].split()[0])
+            return res
+        return cli.view(pid)
+
+    def _execute(self, op, scheduled, pid):
+        error = False
+        try:
+            res = self._invoke(op, pid)
+            error = res["status"] != "success"
+        except Exception as e:
+            self._L.error("%s failed: %s", op, e)
+            error = True
+        latency = time.perf_counter() - scheduled
+        with self._lock:
+            stats = self._window[op]
+            stats.latency.record(latency)
+            if error:
+                stats.errors += 1
+
+    def _skip(self, op):
+        with self._lock:
+            self._window[op].skipped += 1
+
+    def _flush(self, t_start, t_window):
+        now = time.perf_counter()
+        with self._lock:
+            window, self._window = self._window, collections.defaultdict(
+                OperationStats
+            )
+        rows = []
+        for op in sorted(window):
+            self._totals[op].merge(window[op])
+            row = {"t": round(now - t_start, 3), "op": op}
+            row.update(window[op].summary(now - t_window))
+            rows.append(row)
+        if self.report is not None:
+            for row in rows:
+                self.report(row)
+        return now
+
+    def _arrivals(self, t_start):
+        t = 0.0
+        while True:
+            if self.poisson:
+                t += self._random.expovariate(self.rate)
+            else:
+                t += 1.0 / self.rate
+            if t >= self.duration:
+                return
+            yield t_start + t
+
+    def run(self):
+        """Generate load for the configured duration.
+
+        Returns:
+            dict of per operation summaries over the whole run
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="ezid-load"
+        )
+        t_start = time.perf_counter()
+        t_window = t_start
+        try:
+            for scheduled in self._arrivals(t_start):
+                while True:
+                    now = time.perf_counter()
+                    if now - t_window >= self.interval:
+                        t_window = self._flush(t_start, t_window)
+                    delay = scheduled - now
+                    if delay <= 0:
+                        break
+                    time.sleep(min(delay, self.interval))
+                op = self._chooseOperation()
+                pid = None
+                if op == "view":
+                    if not self._identifiers:
+                        self._skip(op)
+                        continue
+                    pid = self._random.choice(self._identifiers)
+                executor.submit(self._execute, op, scheduled, pid)
+        finally:
+            executor.shutdown(wait=True)
+        t_end = self._flush(t_start, t_window)
+        elapsed = t_end - t_start
+        summary = {op: s.summary(elapsed) for op, s in sorted(self._totals.items())}
+        overall = OperationStats()
+        for s in self._totals.values():
+            overall.merge(s)
+        summary["all"] = overall.summary(elapsed)
+        summary["all"]["target_rate"] = self.rate
+        summary["all"]["connections"] = self._pool.stats()
+        return summary
+
+
+@click.command()
+@click.argument("server_url", default="http://localhost:18880")
+@click.option("-u", "--user", default=lambda: os.environ.get("EZID_USER", None))
+@click.option("-p", "--password", default=lambda: os.environ.get("EZID_PASS", None))
+@click.option("--mix", default=DEFAULT_MIX, help="Operation weights, op=weight,...")
+@click.option("--rate", default=10.0, help="Target requests per second")
+@click.option("--duration", default=60.0, help="Seconds to generate load")
+@click.option("--workers", default=64, help="Maximum requests in flight")
+@click.option("--shoulder", default="ark:/99999/fk4", help="Shoulder to mint on")
+@click.option(
+    "-i", "--identifier", multiple=True, help="Identifier to view, repeatable"
+)
+@click.option("--poisson", is_flag=True, help="Poisson instead of fixed arrivals")
+@click.option("--interval", default=10.0, help="Seconds per report window")
+@click.option("--seed", default=None, type=int, help="Random seed")
+def main(
+    server_url,
+    user,
+    password,
+    mix,
+    rate,
+    duration,
+    workers,
+    shoulder,
+    identifier,
+    poisson,
+    interval,
+    seed,
+):
+    """Open-loop load test of the EZID API at SERVER_URL.
+
+    Prints one JSON line per operation per report window, then a JSON
+    summary of the whole run.
+    """
+    try:
+        weights = parseMix(mix)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--mix")
+    generator = LoadGenerator(
+        server_url,
+        username=user,
+        password=password,
+        mix=weights,
+        rate=rate,
+        duration=duration,
+        workers=workers,
+        shoulder=shoulder,
+        identifiers=list(identifier),
+        poisson=poisson,
+        interval=interval,
+        seed=seed,
+        report=lambda row: print(json.dumps(row), flush=True),
+    )
+    summary = generator.run()
+    print(json.dumps({"summary": summary}, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,212 @@
+"""Persistent SQLite cache of search result pages.
+
+Responses are stored by a key normalized from the service URL, search
+target, the non-None query parameters in sorted order and the logged in
+user, so repeated sweeps and offline re-analysis of the same queries do not
+touch the server::
+
+    cache = SearchCache("search_cache.sqlite", ttl=24 * 3600)
+    cli = EzidSearch(base_url=url, cache=cache)
+    cli.search(query)                      # fetched and stored
+    cli.search(query)                      # served from the cache
+    cli.search(query, cache_mode=MODE_REFRESH)  # fetched and replaced
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+MODE_USE = "use"
+"""Read from and write to the cache
+"""
+
+MODE_REFRESH = "refresh"
+"""Always fetch, replacing any cached response
+"""
+
+MODE_BYPASS = "bypass"
+"""Neither read nor write the cache
+"""
+
+MODES = [MODE_USE, MODE_REFRESH, MODE_BYPASS]
+
+DEFAULT_TTL = 24 * 3600.0
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT,
+    status INTEGER,
+    elapsed REAL,
+    body BLOB,
+    size INTEGER,
+    created REAL,
+    accessed REAL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+def queryKey(base_url, target, params, identity=None):
+    """Normalized cache key for a search.
+
+    Args:
+        base_url: URL of the EZID service
+        target: search or manage
+        params: query parameters, None values are ignored
+        identity: logged in user, None if anonymous
+
+    Returns:
+        str
+    """
+    items = sorted((str(k), str(v)) for k, v in params.items() if v is not None)
+    return json.dumps([base_url.rstrip("/"), target, items, identity])
+
+
+class SearchCache(object):
+    """Size bounded SQLite store of search responses with a time to live.
+
+    Args:
+        path: SQLite database file, ":memory:" for a transient cache
+        ttl: seconds a response remains valid, None for no expiry
+        max_bytes: compressed body bytes retained, least recently used
+            responses are evicted beyond this
+        mode: default cache mode, one of MODES
+        clock: function returning the current time in seconds
+    """
+
+    def __init__(
+        self,
+        path,
+        ttl=DEFAULT_TTL,
+        max_bytes=DEFAULT_MAX_BYTES,
+        mode=MODE_USE,
+        clock=time.time,
+    ):
+        assert mode in MODES
+        self._L = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.mode = mode
+        self._clock = clock
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            path = os.path.expanduser(path)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, key):
+        """Cached response for key.
+
+        Returns:
+            dict with url, status, elapsed (seconds) and text, or None
+        """
+        now = self._clock()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, status, elapsed, body, created FROM responses WHERE key=?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            url, status, elapsed, body, created = row
+            if self.ttl is not None and created + self.ttl <= now:
+                self._db.execute("DELETE FROM responses WHERE key=?", (key,))
+                self._db.commit()
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed=? WHERE key=?", (now, key))
+            self._db.commit()
+            self._hits += 1
+        return {
+            "url": url,
+            "status": status,
+            "elapsed": elapsed,
+            "text": zlib.decompress(body).decode("utf-8"),
+        }
+
+    def put(self, key, url, status, elapsed, text):
+        """Store a response, evicting least recently used entries if needed.
+
+        Args:
+            key: from queryKey
+            url: URL of the request
+            status: HTTP status code
+            elapsed: seconds taken by the request
+            text: response body
+        """
+        body = zlib.compress(text.encode("utf-8"))
+        now = self._clock()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, status, elapsed, body, len(body), now, now),
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        total = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY accessed"
+        ):
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key=?", victims)
+        self._evictions += len(victims)
+        self._L.debug("Evicted %d cached responses", len(victims))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def stats(self):
+        """Cache counters.
+
+        Returns:
+            dict with size, bytes, hits, misses, evictions and expirations
+        """
+        with self._lock:
+            size, nbytes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            return {
+                "size": size,
+                "bytes": nbytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
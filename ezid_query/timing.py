@@ -0,0 +1,239 @@
+"""Per-phase timing of HTTP requests.
+
+A request is split into consecutive, non-overlapping phases:
+
+dns
+    resolving the host name, 0 on a reused connection
+connect
+    establishing the TCP connection, 0 on a reused connection
+tls
+    the TLS handshake, 0 for http or a reused connection
+ttfb
+    from the connection being ready to the response headers arriving,
+    i.e. sending the request and waiting for the server
+body
+    reading the response body
+
+so that the phases add up to the total. Request and response byte counts
+are recorded alongside.
+
+The connection classes here record into the RequestTiming started by
+begin() on the current thread, so one set of connections can serve any
+number of threads. ConnectionPool in transport uses TimedHTTPConnection and
+TimedHTTPSConnection for EZIDClient, and TimedHTTPAdapter provides the same
+for a requests.Session as used by EzidSearch.
+"""
+
+import http.client
+import socket
+import threading
+import time
+
+import requests.adapters
+import urllib3.connection
+import urllib3.connectionpool
+import urllib3.exceptions
+
+PHASES = ["dns", "connect", "tls", "ttfb", "body"]
+
+_local = threading.local()
+
+
+class RequestTiming(object):
+    """Phase durations and byte counts of one request."""
+
+    def __init__(self):
+        self.t_start = time.perf_counter()
+        self.t_headers = None
+        self.t_end = None
+        self.dns = 0.0
+        self.connect = 0.0
+        self.tls = 0.0
+        self.connections = 0
+        self.request_bytes = 0
+        self.response_header_bytes = 0
+        self.response_bytes = 0
+
+    def headers(self):
+        """Mark the response headers as received."""
+        self.t_headers = time.perf_counter()
+
+    def finish(self):
+        """Mark the response body as read."""
+        self.t_end = time.perf_counter()
+        if self.t_headers is None:
+            self.t_headers = self.t_end
+
+    def asDict(self):
+        if self.t_end is None:
+            self.finish()
+        setup = self.dns + self.connect + self.tls
+        return {
+            "dns": self.dns,
+            "connect": self.connect,
+            "tls": self.tls,
+            "ttfb": max(0.0, self.t_headers - self.t_start - setup),
+            "body": self.t_end - self.t_headers,
+            "total": self.t_end - self.t_start,
+            "new_connections": self.connections,
+            "request_bytes": self.request_bytes,
+            "response_header_bytes": self.response_header_bytes,
+            "response_bytes": self.response_bytes,
+        }
+
+
+def begin():
+    """Start timing a request issued by the current thread.
+
+    Returns:
+        RequestTiming
+    """
+    timing = RequestTiming()
+    _local.timing = timing
+    return timing
+
+
+def current():
+    """RequestTiming of the request in progress on this thread, or None."""
+    return getattr(_local, "timing", None)
+
+
+def end():
+    """Stop recording connection events for the current thread."""
+    _local.timing = None
+
+
+def headerBytes(headers):
+    """Approximate size on the wire of a block of response headers.
+
+    Args:
+        headers: http.client.HTTPMessage or a mapping of header values
+    """
+    if headers is None:
+        return 0
+    if hasattr(headers, "as_bytes"):
+        return len(headers.as_bytes())
+    return sum(len(f"{k}: {v}\r\n") for k, v in headers.items()) + 2
+
+
+def _resolve(host, port):
+    timing = current()
+    t0 = time.perf_counter()
+    infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    if timing is not None:
+        timing.dns += time.perf_counter() - t0
+    return infos
+
+
+class _TimedSendMixin(object):
+    def send(self, data):
+        timing = current()
+        if timing is not None and isinstance(data, (bytes, bytearray)):
+            timing.request_bytes += len(data)
+        super().send(data)
+
+
+class TimedHTTPConnection(_TimedSendMixin, http.client.HTTPConnection):
+    """http.client connection recording dns, connect and sent bytes."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = self._timedCreateConnection
+
+    def _timedCreateConnection(self, address, timeout, source_address=None):
+        host, port = address
+        infos = _resolve(host, port)
+        timing = current()
+        t0 = time.perf_counter()
+        err = None
+        for _af, _type, _proto, _name, sa in infos:
+            try:
+                sock = socket.create_connection(sa[:2], timeout, source_address)
+                break
+            except OSError as e:
+                err = e
+        else:
+            raise err if err is not None else OSError(f"No address for {host}")
+        if timing is not None:
+            timing.connect += time.perf_counter() - t0
+            timing.connections += 1
+        return sock
+
+
+class TimedHTTPSConnection(TimedHTTPConnection, http.client.HTTPSConnection):
+    """http.client TLS connection also recording the handshake."""
+
+    def connect(self):
+        timing = current()
+        if timing is None:
+            return super().connect()
+        t0 = time.perf_counter()
+        before = timing.dns + timing.connect
+        super().connect()
+        timing.tls += time.perf_counter() - t0 - (timing.dns + timing.connect - before)
+
+
+class _TimedUrllib3Mixin(_TimedSendMixin):
+    def _new_conn(self):
+        infos = _resolve(self._dns_host, self.port)
+        timing = current()
+        t0 = time.perf_counter()
+        host = self._dns_host
+        err = None
+        try:
+            for _af, _type, _proto, _name, sa in infos:
+                # Connect to the resolved address, SNI and certificate checks
+                # still use self.host
+                self._dns_host = sa[0]
+                try:
+                    conn = super()._new_conn()
+                    break
+                except (
+                    urllib3.exceptions.NewConnectionError,
+                    urllib3.exceptions.ConnectTimeoutError,
+                ) as e:
+                    err = e
+            else:
+                raise err
+        finally:
+            self._dns_host = host
+        if timing is not None:
+            timing.connect += time.perf_counter() - t0
+            timing.connections += 1
+        return conn
+
+
+class TimedUrllib3HTTPConnection(_TimedUrllib3Mixin, urllib3.connection.HTTPConnection):
+    pass
+
+
+class TimedUrllib3HTTPSConnection(
+    _TimedUrllib3Mixin, urllib3.connection.HTTPSConnection
+):
+    def connect(self):
+        timing = current()
+        if timing is None:
+            return super().connect()
+        t0 = time.perf_counter()
+        before = timing.dns + timing.connect
+        super().connect()
+        timing.tls += time.perf_counter() - t0 - (timing.dns + timing.connect - before)
+
+
+class TimedHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    ConnectionCls = TimedUrllib3HTTPConnection
+
+
+class TimedHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+    ConnectionCls = TimedUrllib3HTTPSConnection
+
+
+class TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+    """requests transport adapter whose connections record phase timing."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
@@ -0,0 +1,323 @@
+"""Record HTTP traffic to a JSON lines log and replay it against a server.
+
+EZIDClient and EzidSearch accept a TrafficRecorder; every request they
+issue is appended to the log with its method, path, query parameters, a
+hash of the body, the time it was sent relative to the start of the
+recording, status and elapsed time. Credentials and cookies are never
+written. With store_bodies the request bodies are kept as well, so that
+mint and modify requests replay with their original metadata.
+
+Replayer re-issues a log against any base URL, either with the original
+spacing between requests, accelerated by a factor, or as fast as the
+workers allow::
+
+    ezid-replay traffic.jsonl http://localhost:18880 --speed 4 -u apitest -p apitest
+"""
+
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+import click
+import requests
+
+from . import load
+
+DEFAULT_LOG = "traffic.jsonl"
+"""Default recording file
+"""
+
+SPEED_ORIGINAL = "original"
+SPEED_MAX = "max"
+
+
+def parseSpeed(speed):
+    """Replay speed factor from "original", "max" or a number such as "4x".
+
+    Returns:
+        float factor, or None for as fast as possible
+    """
+    speed = str(speed).strip().lower()
+    if speed == SPEED_ORIGINAL:
+        return 1.0
+    if speed == SPEED_MAX:
+        return None
+    factor = float(speed.rstrip("x"))
+    if factor <= 0:
+        raise ValueError(f"Speed must be positive: {speed}")
+    return factor
+
+
+class TrafficRecorder(object):
+    """Thread safe append only JSON lines log of HTTP requests.
+
+    Args:
+        path: log file, appended to
+        store_bodies: also record request bodies, needed to replay
+            requests carrying metadata
+        clock: monotonic function returning the current time in seconds
+    """
+
+    def __init__(self, path=DEFAULT_LOG, store_bodies=False, clock=time.monotonic):
+        self._L = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.store_bodies = store_bodies
+        self._clock = clock
+        self._t0 = clock()
+        self._lock = threading.Lock()
+        self._f = open(os.path.expanduser(path), "a", encoding="utf-8")
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def record(self, client, method, url, body, status, elapsed):
+        """Append one request to the log.
+
+        Args:
+            client: name of the issuing client, e.g. "api" or "search"
+            method: HTTP method
+            url: full request URL
+            body: request body as bytes or str, or None
+            status: HTTP status code, None if no response was received
+            elapsed: seconds from sending the request to the response
+        """
+        # Time the request was sent, relative to the start of recording
+        t = self._clock() - self._t0 - (elapsed or 0.0)
+        parts = urllib.parse.urlsplit(url)
+        entry = {
+            "t": round(max(t, 0.0), 6),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "client": client,
+            "method": method,
+            "path": parts.path,
+            "params": dict(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)),
+            "body_sha256": None,
+            "body_len": 0,
+            "status": status,
+            "elapsed": None if elapsed is None else round(elapsed, 6),
+        }
+        if body is not None:
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            entry["body_sha256"] = hashlib.sha256(body).hexdigest()
+            entry["body_len"] = len(body)
+            if self.store_bodies:
+                entry["body"] = body.decode("utf-8")
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+
+def loadEntries(path):
+    """Entries of a recorded log, ordered by send time."""
+    entries = []
+    with open(os.path.expanduser(path), encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    entries.sort(key=lambda e: e["t"])
+    return entries
+
+
+class Replayer(object):
+    """Re-issue recorded requests against a server.
+
+    Requests are scheduled open loop at their recorded offsets divided by
+    speed, so the original spacing and overlap are kept regardless of how
+    quickly the server responds, up to the number of workers.
+
+    With a speed, each row reports lag, the seconds a request was sent
+    after its scheduled time, and the summary the max_lag. Without one
+    there is no schedule and both are omitted.
+
+    Args:
+        base_url: server to replay against
+        speed: factor applied to the recorded pace, None for no delays
+        workers: maximum requests in flight
+        username: EZID user, sent as basic auth with every request
+        password: password for username
+        timeout: seconds to wait for each response
+        report: called with a dict for each replayed request
+    """
+
+    def __init__(
+        self,
+        base_url,
+        speed=1.0,
+        workers=16,
+        username=None,
+        password=None,
+        timeout=60.0,
+        report=None,
+    ):
+        self._L = logging.getLogger(self.__class__.__name__)
+        self.base_url = base_url.rstrip("/")
+        self.speed = speed
+        self.workers = workers
+        self.timeout = timeout
+        self.report = report
+        self._auth = None if username is None else (username, password)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._rows = []
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.auth = self._auth
+            self._local.session = session
+        return session
+
+    def _issue(self, entry, scheduled):
+        row = {
+            "t": entry["t"],
+            "method": entry["method"],
+            "path": entry["path"],
+            "recorded_status": entry.get("status"),
+            "recorded_elapsed": entry.get("elapsed"),
+            "status": None,
+            "error": None,
+        }
+        body = entry.get("body")
+        if body is None and entry.get("body_len"):
+            # Sending the request without its body would replay a different
+            # request, so record the entry as failed instead.
+            row["error"] = "body not recorded"
+            self._finish(row)
+            return
+        headers = {}
+        if body is not None and entry.get("client") == "api":
+            headers["Content-Type"] = "text/plain; charset=utf-8"
+        t0 = time.perf_counter()
+        if scheduled is not None:
+            row["lag"] = round(t0 - scheduled, 6)
+        try:
+            response = self._session().request(
+                entry["method"],
+                self.base_url + entry["path"],
+                params=entry.get("params") or None,
+                data=None if body is None else body.encode("utf-8"),
+                headers=headers,
+                timeout=self.timeout,
+            )
+            row["status"] = response.status_code
+        except requests.RequestException as e:
+            row["error"] = str(e)
+        row["latency"] = round(time.perf_counter() - t0, 6)
+        self._finish(row)
+
+    def _finish(self, row):
+        with self._lock:
+            self._rows.append(row)
+        if self.report is not None:
+            self.report(row)
+
+    def run(self, entries):
+        """Replay entries, as returned by loadEntries.
+
+        Returns:
+            dict summarizing latency, errors and status mismatches
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="ezid-replay"
+        )
+        t_start = time.perf_counter()
+        t_first = entries[0]["t"] if entries else 0.0
+        try:
+            for entry in entries:
+                scheduled = None
+                if self.speed is not None:
+                    scheduled = t_start + (entry["t"] - t_first) / self.speed
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                executor.submit(self._issue, entry, scheduled)
+        finally:
+            executor.shutdown(wait=True)
+        return self.summary(time.perf_counter() - t_start)
+
+    def summary(self, elapsed):
+        latency = load.LatencyHistogram()
+        recorded = load.LatencyHistogram()
+        errors = 0
+        mismatches = 0
+        lag = None
+        with self._lock:
+            rows = list(self._rows)
+        for row in rows:
+            if row["error"] is not None or (row["status"] or 500) >= 500:
+                errors += 1
+            if row["status"] != row["recorded_status"]:
+                mismatches += 1
+            if row["status"] is not None:
+                latency.record(row["latency"])
+            if row["recorded_elapsed"] is not None:
+                recorded.record(row["recorded_elapsed"])
+            if "lag" in row:
+                lag = max(lag or 0.0, row["lag"])
+        res = {
+            "requests": len(rows),
+            "elapsed": elapsed,
+            "errors": errors,
+            "status_mismatches": mismatches,
+            "latency": latency.summary(),
+            "recorded_latency": recorded.summary(),
+        }
+        if lag is not None:
+            res["max_lag"] = lag
+        return res
+
+
+@click.command()
+@click.argument("log", type=click.Path(exists=True, dir_okay=False))
+@click.argument("server_url", default="http://localhost:18880")
+@click.option("-u", "--user", default=lambda: os.environ.get("EZID_USER", None))
+@click.option("-p", "--password", default=lambda: os.environ.get("EZID_PASS", None))
+@click.option(
+    "--speed", default=SPEED_ORIGINAL, help='"original", "max" or a factor, e.g. 4'
+)
+@click.option("--workers", default=16, help="Maximum requests in flight")
+@click.option("--timeout", default=60.0, help="Seconds to wait per response")
+def main(log, server_url, user, password, speed, workers, timeout):
+    """Replay the requests recorded in LOG against SERVER_URL.
+
+    Prints one JSON line per request, then a JSON summary.
+    """
+    try:
+        factor = parseSpeed(speed)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--speed")
+    replayer = Replayer(
+        server_url,
+        speed=factor,
+        workers=workers,
+        username=user,
+        password=password,
+        timeout=timeout,
+        report=lambda row: print(json.dumps(row), flush=True),
+    )
+    summary = replayer.run(loadEntries(log))
+    print(json.dumps({"summary": summary}, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    main()
@@ -0,0 +1,246 @@
+"""Keep-alive HTTP transport for the EZID API client.
+
+Provides a thread safe pool of persistent ``http.client`` connections and a
+``urllib.request`` handler that draws on it, so that consecutive requests
+issued by an ``EZIDClient`` reuse the same TCP / TLS connection instead of
+paying the connection setup cost on every call.
+"""
+
+import http.client
+import logging
+import select
+import socket
+import ssl
+import threading
+import urllib.error
+import urllib.request
+
+from . import timing
+
+DEFAULT_POOL_SIZE = 10
+"""Default maximum number of idle connections retained per host.
+"""
+
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "DELETE"])
+"""Methods safe to send again after the connection failed awaiting the response
+"""
+
+
+def isDropped(conn):
+    """True if the server closed an idle connection, or sent unexpected data."""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class PooledHTTPResponse(http.client.HTTPResponse):
+    """HTTPResponse that hands its connection back to the pool when done.
+
+    http.client closes the response file once the body has been consumed,
+    which is the point at which the underlying connection may carry another
+    request. A response closed before the body is exhausted leaves unread
+    data on the socket, so the connection is discarded instead.
+    """
+
+    _release = None
+    _abandoned = False
+
+    def close(self):
+        if self.fp is not None:
+            self._abandoned = True
+        super().close()
+
+    def _close_conn(self):
+        super()._close_conn()
+        release, self._release = self._release, None
+        if release is not None:
+            release(not (self.will_close or self._abandoned))
+
+
+class ConnectionPool(object):
+    """Thread safe pool of persistent connections, keyed by scheme and host.
+
+    Args:
+        maxsize: maximum number of idle connections kept for each host
+        context: ssl.SSLContext used for https connections
+    """
+
+    def __init__(self, maxsize=DEFAULT_POOL_SIZE, context=None):
+        self._L = logging.getLogger(self.__class__.__name__)
+        self.maxsize = maxsize
+        self._context = context
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._opened = 0
+        self._reused = 0
+        self._discarded = 0
+
+    def _newConnection(self, scheme, host, timeout):
+        if scheme == "https":
+            if self._context is None:
+                self._context = ssl.create_default_context()
+            conn = timing.TimedHTTPSConnection(
+                host, timeout=timeout, context=self._context
+            )
+        else:
+            conn = timing.TimedHTTPConnection(host, timeout=timeout)
+        conn.response_class = PooledHTTPResponse
+        return conn
+
+    def acquire(
+        self, scheme, host, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, fresh=False
+    ):
+        """Check out a connection for (scheme, host).
+
+        Args:
+            scheme: "http" or "https"
+            host: host[:port] of the server
+            timeout: socket timeout for a newly opened connection
+            fresh: drop idle connections for the host and open a new one
+
+        Returns:
+            (connection, reused) where reused is True for a pooled connection
+        """
+        key = (scheme, host)
+        with self._lock:
+            idle = self._idle.get(key)
+            if fresh and idle:
+                stale, self._idle[key] = idle, []
+                self._discarded += len(stale)
+                for conn in stale:
+                    conn.close()
+            while idle:
+                conn = idle.pop()
+                if isDropped(conn):
+                    self._discarded += 1
+                    conn.close()
+                    continue
+                self._reused += 1
+                return conn, True
+            self._opened += 1
+        self._L.debug("opening connection to %s://%s", scheme, host)
+        return self._newConnection(scheme, host, timeout), False
+
+    def release(self, scheme, host, conn, reusable=True):
+        """Return a connection to the pool, closing it if it can not be reused."""
+        key = (scheme, host)
+        if reusable and conn.sock is not None:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.maxsize:
+                    idle.append(conn)
+                    return
+        with self._lock:
+            self._discarded += 1
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def stats(self):
+        """Connection counters.
+
+        Returns:
+            dict with opened, reused, discarded and idle counts
+        """
+        with self._lock:
+            return {
+                "opened": self._opened,
+                "reused": self._reused,
+                "discarded": self._discarded,
+                "idle": sum(len(v) for v in self._idle.values()),
+            }
+
+
+class KeepAliveHandler(urllib.request.HTTPHandler, urllib.request.HTTPSHandler):
+    """urllib handler issuing http and https requests over pooled connections.
+
+    Subclassing both default handlers keeps ``build_opener`` from installing
+    the stock, connection-per-request, handlers alongside this one.
+
+    A request that fails on a reused connection because the server closed
+    it is sent again once on a new connection, if the failure came before
+    the request was fully written or the method is idempotent. Otherwise
+    URLError is raised, since the server may have processed it.
+    """
+
+    def __init__(self, pool=None, debuglevel=0):
+        urllib.request.HTTPSHandler.__init__(self, debuglevel=debuglevel)
+        self._L = logging.getLogger(self.__class__.__name__)
+        self.pool = pool if pool is not None else ConnectionPool()
+
+    def http_open(self, req):
+        return self._poolOpen("http", req)
+
+    def https_open(self, req):
+        return self._poolOpen("https", req)
+
+    def _write(self, conn, req, headers):
+        conn.request(
+            req.get_method(),
+            req.selector,
+            req.data,
+            headers,
+            encode_chunked=req.has_header("Transfer-encoding"),
+        )
+
+    def _poolOpen(self, scheme, req):
+        host = req.host
+        if not host:
+            raise urllib.error.URLError("no host given")
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers = {name.title(): val for name, val in headers.items()}
+        conn, reused = self.pool.acquire(scheme, host, timeout=req.timeout)
+        written = False
+        try:
+            self._write(conn, req, headers)
+            written = True
+            response = conn.getresponse()
+        except (
+            http.client.RemoteDisconnected,
+            ConnectionResetError,
+            BrokenPipeError,
+        ) as e:
+            conn.close()
+            if not reused:
+                raise urllib.error.URLError(e)
+            if written and req.get_method() not in IDEMPOTENT_METHODS:
+                # The server may have acted on the request before the
+                # connection failed, e.g. minted an identifier
+                raise urllib.error.URLError(e)
+            # The server dropped an idle connection, retry once on a fresh one
+            self._L.debug("stale pooled connection to %s: %s", host, e)
+            conn, reused = self.pool.acquire(
+                scheme, host, timeout=req.timeout, fresh=True
+            )
+            try:
+                self._write(conn, req, headers)
+                response = conn.getresponse()
+            except OSError as e2:
+                conn.close()
+                raise urllib.error.URLError(e2)
+        except OSError as e:
+            conn.close()
+            raise urllib.error.URLError(e)
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            self.pool.release(scheme, host, conn, reusable=False)
+        else:
+            response._release = lambda reusable: self.pool.release(
+                scheme, host, conn, reusable=reusable
+            )
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        return response
@@ -1,4 +1,6 @@
 import asyncio
+import collections
+import contextlib
 import click
 import cmd
 import os
@@ -9,6 +11,7 @@ import pyppeteer.errors
 from pyppeteer import launch
 import logging
 import csv
+import urllib.parse
 
 EZID_URL = "https://ezid-stg.cdlib.org"
 DEFAULT_WIDTH = 1024
@@ -33,6 +36,28 @@ JSON_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
 
 DEFAULT_TIMEOUT = 30000
 
+RESOURCE_TYPES = [
+    "document",
+    "stylesheet",
+    "image",
+    "media",
+    "font",
+    "script",
+    "texttrack",
+    "xhr",
+    "fetch",
+    "eventsource",
+    "websocket",
+    "manifest",
+    "other",
+]
+"""Resource types reported by the browser for a request
+"""
+
+DEFAULT_BLOCKED_TYPES = ["image", "media", "font"]
+"""Resource types blocked by --block-default, not needed to drive the UI
+"""
+
 
 def dtnow():
     """
@@ -61,48 +86,193 @@ async def doClick(page, ele):
     return await page.evaluate("(ele) => ele.click()", ele)
 
 
-class EZBrowser(cmd.Cmd):
-    intro = "Welcome to M.Bot!"
-    prompt = "EZID: "
+class RequestFilter(object):
+    """Decides which requests made by a page are aborted.
 
-    def __init__(self, username, password, *args, **kwargs):
-        self._usr = username
-        self._pass = password
-        self._devtools = kwargs.pop("devtools", False)
-        self._width = kwargs.pop("width", DEFAULT_WIDTH)
-        self._height = kwargs.pop("height", DEFAULT_HEIGHT)
-        self._base_url = kwargs.pop("url", EZID_URL)
-        self._browser = None
-        self._page = None
-        super().__init__(*args, **kwargs)
-        self._adv_search = ADV_SEARCH_BLANK
-        self._loop = asyncio.get_event_loop()
-        logging.info(self._usr)
+    Args:
+        base_url: the EZID service, its host is first party
+        block_types: resource types to block, see RESOURCE_TYPES
+        block_third_party: block requests to hosts other than that of
+            base_url and allowed_hosts
+        allowed_hosts: additional first party host names
+    """
 
-    def _tokenize(self, inpt):
-        res = list(
-            csv.reader(
-                [
-                    inpt,
-                ],
-                delimiter=" ",
-            )
+    def __init__(
+        self, base_url, block_types=(), block_third_party=False, allowed_hosts=()
+    ):
+        self.base_url = base_url
+        self.block_types = set(block_types)
+        self.block_third_party = block_third_party
+        self.allowed_hosts = set(allowed_hosts)
+
+    @property
+    def enabled(self):
+        return bool(self.block_types) or self.block_third_party
+
+    def isThirdParty(self, url):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https", "ws", "wss"):
+            # data:, blob: and the like are not fetched from anywhere
+            return False
+        host = parts.hostname
+        return host != urllib.parse.urlsplit(self.base_url).hostname and (
+            host not in self.allowed_hosts
         )
-        if len(res) < 1:
-            return []
-        return res[0]
 
-    async def _initialize(self):
-        self._browser = await launch(
-            {
-                "headless": False,
-                "devtools": self._devtools,
-                "args": [f"--window-size={self._width},{self._height+74}"],
-            }
-        )
-        self._page = await self._browser.newPage()
-        await self._page.setViewport({"width": self._width, "height": self._height})
-        await self._page.goto(f"{EZID_URL}/")
+    def reason(self, resource_type, url):
+        """Why a request is blocked.
+
+        Returns:
+            "type", "third_party" or None if the request is allowed
+        """
+        if resource_type in self.block_types:
+            return "type"
+        if self.block_third_party and self.isThirdParty(url):
+            return "third_party"
+        return None
+
+
+class NavigationStats(object):
+    """Requests and bytes transferred by one main frame navigation.
+
+    Args:
+        url: URL navigated to
+        clock: function returning the current time in seconds
+    """
+
+    def __init__(self, url, clock=time.monotonic):
+        self._clock = clock
+        self.url = url
+        self.t_start = clock()
+        self.t_load = None
+        self.requests = 0
+        self.blocked = 0
+        self.failed = 0
+        self.bytes = 0
+        self.by_type = {}
+
+    def loaded(self):
+        if self.t_load is None:
+            self.t_load = self._clock()
+
+    def asDict(self):
+        return {
+            "url": self.url,
+            "load": None if self.t_load is None else self.t_load - self.t_start,
+            "requests": self.requests,
+            "blocked": self.blocked,
+            "failed": self.failed,
+            "bytes": self.bytes,
+            "by_type": dict(self.by_type),
+        }
+
+
+class PageMonitor(object):
+    """Filters the requests of a page and keeps per navigation stats.
+
+    A navigation starts with each main frame document request and collects
+    every request issued until the next one, so the stats of a form
+    submitted by a click are recorded as well as those of goto().
+
+    Args:
+        request_filter: RequestFilter, None to allow everything
+        keep: number of completed navigations retained
+        clock: function returning the current time in seconds
+    """
+
+    def __init__(self, request_filter=None, keep=100, clock=time.monotonic):
+        self.filter = request_filter
+        self.keep = keep
+        self.navigations = []
+        self.current = None
+        self._clock = clock
+        self._page = None
+
+    @property
+    def intercepting(self):
+        return self.filter is not None and self.filter.enabled
+
+    async def attach(self, page):
+        self._page = page
+        if self.intercepting:
+            await page.setRequestInterception(True)
+        page.on("request", self._onRequest)
+        page.on("requestfailed", self._onRequestFailed)
+        page.on("load", self._onLoad)
+        # Transferred sizes are only available from the protocol events
+        client = await page.target.createCDPSession()
+        await client.send("Network.enable")
+        client.on("Network.loadingFinished", self._onLoadingFinished)
+
+    def _startNavigation(self, url):
+        if self.current is not None:
+            self.navigations.append(self.current.asDict())
+            del self.navigations[: -self.keep]
+        self.current = NavigationStats(url, clock=self._clock)
+
+    def _onRequest(self, request):
+        main = request.isNavigationRequest() and request.frame == self._page.mainFrame
+        if main and not request.redirectChain:
+            self._startNavigation(request.url)
+        reason = None
+        # Navigation of the page itself is never blocked
+        if self.intercepting and not main:
+            reason = self.filter.reason(request.resourceType, request.url)
+        if self.current is not None:
+            self.current.requests += 1
+            rtype = request.resourceType
+            self.current.by_type[rtype] = self.current.by_type.get(rtype, 0) + 1
+            if reason is not None:
+                self.current.blocked += 1
+        if self.intercepting:
+            if reason is None:
+                asyncio.ensure_future(request.continue_())
+            else:
+                L.debug("Blocked %s %s", reason, request.url)
+                asyncio.ensure_future(request.abort("blockedbyclient"))
+
+    def _onRequestFailed(self, request):
+        if self.current is not None:
+            failure = request.failure() or {}
+            if failure.get("errorText") != "net::ERR_BLOCKED_BY_CLIENT":
+                self.current.failed += 1
+
+    def _onLoad(self):
+        if self.current is not None:
+            self.current.loaded()
+            L.info(json.dumps(self.current.asDict()))
+
+    def _onLoadingFinished(self, event):
+        if self.current is not None:
+            self.current.bytes += int(event.get("encodedDataLength", 0))
+
+    def report(self):
+        """Completed navigations followed by the current one, oldest first."""
+        res = list(self.navigations)
+        if self.current is not None:
+            res.append(self.current.asDict())
+        return res
+
+
+class EZPage(object):
+    """The EZID UI flows, driven through one browser page.
+
+    Args:
+        page: pyppeteer Page
+        base_url: EZID service URL
+        monitor: PageMonitor attached to page
+    """
+
+    def __init__(self, page, base_url=EZID_URL, monitor=None):
+        self._page = page
+        self._base_url = base_url
+        self._monitor = monitor if monitor is not None else PageMonitor()
+        self._context = None
+
+    async def heapUsed(self):
+        """Bytes of JavaScript heap in use by the page."""
+        metrics = await self._page.metrics()
+        return int(metrics.get("JSHeapUsedSize", 0))
 
     async def _waitForNavigation(self, timeout=DEFAULT_TIMEOUT):
         try:
@@ -162,7 +332,7 @@ class EZBrowser(cmd.Cmd):
         await asyncio.wait(
             [
                 asyncio.create_task(self._page.waitForNavigation()),
-                asyncio.create_task(self._page.goto(f"{EZID_URL}/")),
+                asyncio.create_task(self._page.goto(f"{self._base_url}/")),
             ]
         )
 
@@ -205,11 +375,19 @@ class EZBrowser(cmd.Cmd):
             L.error(e)
         return success
 
+    def navigationStats(self):
+        """Requests, blocked requests and bytes of recent navigations.
+
+        Returns:
+            list of dicts, oldest first
+        """
+        return self._monitor.report()
+
     async def runScript(self, script, timeout=DEFAULT_TIMEOUT):
         return await self._page.evaluate(script, timeout=timeout)
 
     async def basicSearch(self, qry_str, timeout=DEFAULT_TIMEOUT):
-        await self._page.goto(f"{EZID_URL}/search")
+        await self._page.goto(f"{self._base_url}/search")
         await self._doinput("#search__simple-label", qry_str)
         await self._doclick(
             "#search-form > div.search__simple > button", timeout=timeout
@@ -217,7 +395,7 @@ class EZBrowser(cmd.Cmd):
         return await self._elementText("body > div.customize-table > form > h2")
 
     async def create(self, id_type, location, who, what, when):
-        await self._page.goto(f"{EZID_URL}/")
+        await self._page.goto(f"{self._base_url}/")
         await self._doinput("#target", location)
         await self._doinput("#erc\.who", who)
         await self._doinput("#erc\.what", what)
@@ -231,11 +409,311 @@ class EZBrowser(cmd.Cmd):
         )
         return result
 
+
+class PagePool(object):
+    """Pre-warmed pages of one browser, checked out for concurrent flows.
+
+    Each page is opened in its own incognito browser context by default,
+    so a login in one flow is not seen by the others. Pages are navigated
+    to base_url, and given to setup, before being handed out. A page
+    returned after its flow raised, or whose JavaScript heap exceeds
+    max_heap, is closed and replaced by a fresh one.
+
+    Args:
+        browser: pyppeteer Browser
+        size: pages prepared by start()
+        max_size: limit on open pages, more than size are created when
+            all are checked out, None for size
+        base_url: EZID service URL
+        incognito: open each page in its own incognito context
+        max_heap: bytes of used JavaScript heap above which a page is
+            recycled, None for no limit
+        request_filter: RequestFilter applied to every page
+        setup: coroutine function called with each new EZPage
+        viewport: dict with the width and height of pages
+    """
+
+    def __init__(
+        self,
+        browser,
+        size=4,
+        max_size=None,
+        base_url=EZID_URL,
+        incognito=True,
+        max_heap=None,
+        request_filter=None,
+        setup=None,
+        viewport=None,
+    ):
+        self._browser = browser
+        self.size = size
+        self.max_size = max(size, max_size or size)
+        self.base_url = base_url
+        self.incognito = incognito
+        self.max_heap = max_heap
+        self.filter = request_filter
+        self._setup = setup
+        self._viewport = viewport
+        self._free = collections.deque()
+        # Pages checked out and not yet returned, closed by close() too
+        self._busy = set()
+        # Signalled when a page is returned or a slot under max_size frees up
+        self._cond = asyncio.Condition()
+        self.pages = 0
+        self.stats = {"created": 0, "recycled": 0, "checkouts": 0, "waits": 0}
+
+    async def _newPage(self):
+        context = None
+        if self.incognito:
+            context = await self._browser.createIncognitoBrowserContext()
+            page = await context.newPage()
+        else:
+            page = await self._browser.newPage()
+        if self._viewport is not None:
+            await page.setViewport(self._viewport)
+        ezpage = EZPage(page, self.base_url, PageMonitor(self.filter))
+        ezpage._context = context
+        await ezpage._monitor.attach(page)
+        await page.goto(f"{self.base_url}/")
+        if self._setup is not None:
+            await self._setup(ezpage)
+        return ezpage
+
+    async def _create(self, reserved=False):
+        # Reserve the slot first so concurrent checkouts respect max_size
+        if not reserved:
+            self.pages += 1
+        try:
+            ezpage = await self._newPage()
+        except (Exception, asyncio.CancelledError):
+            self.pages -= 1
+            # A waiting checkout may use the slot to try again
+            async with self._cond:
+                self._cond.notify()
+            raise
+        self.stats["created"] += 1
+        return ezpage
+
+    async def _close(self, ezpage):
+        try:
+            if ezpage._context is not None:
+                await ezpage._context.close()
+            else:
+                await ezpage._page.close()
+        except Exception as e:
+            L.error(e)
+        self.pages -= 1
+
+    async def start(self):
+        """Create and warm size pages."""
+        pages = await asyncio.gather(
+            *[self._create() for _ in range(self.size - self.pages)]
+        )
+        self._free.extend(pages)
+
+    async def checkout(self, timeout=None):
+        """Take a page for exclusive use.
+
+        Args:
+            timeout: seconds to wait for a page when max_size are in use,
+                None to wait indefinitely
+
+        Returns:
+            EZPage
+
+        Raises:
+            asyncio.TimeoutError: no page became available in time
+        """
+        ezpage = await self._take(timeout)
+        if ezpage is None:
+            ezpage = await self._create(reserved=True)
+        self._busy.add(ezpage)
+        self.stats["checkouts"] += 1
+        return ezpage
+
+    async def _take(self, timeout):
+        # Returns a free page, or None with a slot reserved for a new one.
+        # Only the wait is bounded by timeout, so a page or slot is never
+        # taken by a checkout that then times out.
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        async with self._cond:
+            waited = False
+            while True:
+                if self._free:
+                    return self._free.popleft()
+                if self.pages < self.max_size:
+                    self.pages += 1
+                    return None
+                if not waited:
+                    self.stats["waits"] += 1
+                    waited = True
+                remaining = None if deadline is None else deadline - loop.time()
+                try:
+                    await asyncio.wait_for(self._cond.wait(), remaining)
+                except (asyncio.TimeoutError, asyncio.CancelledError):
+                    # Pass on a notification this waiter may have consumed
+                    if self._free or self.pages < self.max_size:
+                        self._cond.notify()
+                    raise
+
+    async def checkin(self, ezpage, discard=False):
+        """Return a checked out page to the pool.
+
+        Args:
+            ezpage: EZPage from checkout()
+            discard: replace the page instead of reusing it
+        """
+        if ezpage not in self._busy:
+            # Already returned, or closed by close()
+            return
+        self._busy.discard(ezpage)
+        if not discard and self.max_heap is not None:
+            try:
+                discard = await ezpage.heapUsed() > self.max_heap
+            except Exception as e:
+                L.error(e)
+                discard = True
+        if discard:
+            self.stats["recycled"] += 1
+            await self._close(ezpage)
+            try:
+                ezpage = await self._create()
+            except Exception as e:
+                # The slot stays free, a waiting checkout creates its own page
+                L.error("Replacing a pooled page failed: %s", e)
+                return
+        async with self._cond:
+            self._free.append(ezpage)
+            self._cond.notify()
+
+    @contextlib.asynccontextmanager
+    async def page(self, timeout=None):
+        """Check out a page for the duration of a with block.
+
+        The page is replaced if the block raises.
+        """
+        ezpage = await self.checkout(timeout=timeout)
+        ok = False
+        try:
+            yield ezpage
+            ok = True
+        finally:
+            await self.checkin(ezpage, discard=not ok)
+
+    async def map(self, flow, items, timeout=None):
+        """Run flow(ezpage, item) for each item concurrently.
+
+        Returns:
+            list of results in the order of items, an exception in place of
+            the result of a flow that failed
+        """
+
+        async def one(item):
+            async with self.page(timeout=timeout) as ezpage:
+                return await flow(ezpage, item)
+
+        return await asyncio.gather(*[one(i) for i in items], return_exceptions=True)
+
+    async def close(self):
+        """Close all pages, including those still checked out."""
+        while self._busy:
+            await self._close(self._busy.pop())
+        while self._free:
+            await self._close(self._free.popleft())
+
+
+class EZBrowser(EZPage, cmd.Cmd):
+    intro = "Welcome to M.Bot!"
+    prompt = "EZID: "
+
+    def __init__(self, username, password, *args, **kwargs):
+        self._usr = username
+        self._pass = password
+        self._devtools = kwargs.pop("devtools", False)
+        self._width = kwargs.pop("width", DEFAULT_WIDTH)
+        self._height = kwargs.pop("height", DEFAULT_HEIGHT)
+        base_url = kwargs.pop("url", EZID_URL)
+        self._headless = kwargs.pop("headless", False)
+        monitor = PageMonitor(
+            RequestFilter(
+                base_url,
+                block_types=kwargs.pop("block_types", ()),
+                block_third_party=kwargs.pop("block_third_party", False),
+                allowed_hosts=kwargs.pop("allowed_hosts", ()),
+            )
+        )
+        EZPage.__init__(self, None, base_url=base_url, monitor=monitor)
+        self._browser = None
+        self._pool = None
+        cmd.Cmd.__init__(self, *args, **kwargs)
+        self._adv_search = ADV_SEARCH_BLANK
+        self._loop = asyncio.get_event_loop()
+        logging.info(self._usr)
+
+    def _tokenize(self, inpt):
+        res = list(
+            csv.reader(
+                [
+                    inpt,
+                ],
+                delimiter=" ",
+            )
+        )
+        if len(res) < 1:
+            return []
+        return res[0]
+
+    async def _initialize(self):
+        self._browser = await launch(
+            {
+                "headless": self._headless,
+                "devtools": self._devtools,
+                "args": [f"--window-size={self._width},{self._height+74}"],
+            }
+        )
+        self._page = await self._browser.newPage()
+        await self._page.setViewport({"width": self._width, "height": self._height})
+        await self._monitor.attach(self._page)
+        await self._page.goto(f"{self._base_url}/")
+
+    async def pagePool(
+        self, size=4, max_size=None, incognito=True, max_heap=None, login=False
+    ):
+        """Start a PagePool on this browser.
+
+        Pages share the request filter and viewport of the main page.
+
+        Args:
+            login: login each page with the shell's credentials, needs
+                incognito for separate sessions
+        """
+
+        async def setup(ezpage):
+            if not await ezpage.login(self._usr, self._pass):
+                raise RuntimeError("Login of pooled page failed")
+
+        pool = PagePool(
+            self._browser,
+            size=size,
+            max_size=max_size,
+            base_url=self._base_url,
+            incognito=incognito,
+            max_heap=max_heap,
+            request_filter=self._monitor.filter,
+            setup=setup if login else None,
+            viewport={"width": self._width, "height": self._height},
+        )
+        await pool.start()
+        return pool
+
     def preloop(self) -> None:
         self._loop.run_until_complete(self._initialize())
 
     def postloop(self) -> None:
         print("Bye!")
+        if self._pool is not None:
+            self._loop.run_until_complete(self._pool.close())
         self._loop.run_until_complete(self._browser.close())
         self._loop.close()
 
@@ -319,6 +797,7 @@ class EZBrowser(cmd.Cmd):
         inp = self._tokenize(arg)
         if len(inp) == 1:
             self._base_url = inp[0]
+            self._monitor.filter.base_url = self._base_url
             self._loop.run_until_complete(self.navigateTo(self._base_url))
         print(self._base_url)
 
@@ -337,6 +816,83 @@ class EZBrowser(cmd.Cmd):
         res = res.lstrip("*").strip()
         print(f"Identifier = {res}")
 
+    def do_stats(self, arg):
+        """stats [N]
+        Requests and bytes of the last N navigations, default 1
+        """
+        inp = self._tokenize(arg)
+        n = int(inp[0]) if len(inp) > 0 else 1
+        for nav in self.navigationStats()[-n:]:
+            print(json.dumps(nav, indent=2))
+
+    def do_pool(self, arg):
+        """pool [SIZE [MAX_SIZE [MAX_HEAP_MB]]]
+        Start a pool of pages, logged in as the shell's user, for pcreate
+        and psearch, or show
+        the stats of the current pool
+        """
+        inp = [int(v) for v in self._tokenize(arg)]
+        if len(inp) == 0:
+            if self._pool is None:
+                print("No pool")
+                return
+            print(json.dumps(dict(self._pool.stats, pages=self._pool.pages)))
+            return
+        if self._pool is not None:
+            self._loop.run_until_complete(self._pool.close())
+        self._pool = self._loop.run_until_complete(
+            self.pagePool(
+                size=inp[0],
+                max_size=inp[1] if len(inp) > 1 else None,
+                max_heap=inp[2] * 1024 * 1024 if len(inp) > 2 else None,
+                login=bool(self._usr),
+            )
+        )
+        print(f"{self._pool.pages} pages ready")
+
+    def _runPooled(self, flow, items):
+        if self._pool is None:
+            L.error("Start a pool first")
+            return
+        t0 = time.monotonic()
+        res = self._loop.run_until_complete(self._pool.map(flow, items))
+        for r in res:
+            print(r)
+        print(f"{len(items)} flows in {time.monotonic() - t0:.2f}s")
+
+    def do_pcreate(self, arg):
+        """pcreate N
+        Create N identifiers concurrently using the page pool
+        """
+        inp = self._tokenize(arg)
+        n = int(inp[0]) if len(inp) > 0 else 1
+
+        async def flow(ezpage, i):
+            res = await ezpage.create(
+                "ARK",
+                "https://example.net/",
+                "Maria Bot",
+                f"mbot test {i}",
+                datetimeToJsonStr(dtnow()),
+            )
+            return res.lstrip("*").strip()
+
+        self._runPooled(flow, list(range(n)))
+
+    def do_psearch(self, arg):
+        """psearch N TERM
+        Run a simple search for TERM N times concurrently using the page pool
+        """
+        inp = self._tokenize(arg)
+        if len(inp) != 2:
+            L.error('Expecting N "term"')
+            return
+
+        async def flow(ezpage, term):
+            return await ezpage.basicSearch(term)
+
+        self._runPooled(flow, [inp[1]] * int(inp[0]))
+
     def do_script(self, arg):
         """script SCRIPT
         Execute the provided script
@@ -361,9 +917,47 @@ class EZBrowser(cmd.Cmd):
 @click.option("--width", default=DEFAULT_WIDTH, help="Browser window width in pixels")
 @click.option("--height", default=DEFAULT_HEIGHT, help="Browser window height in pixels")
 @click.option("--url", default=EZID_URL, help="EZID Service URL to use")
-def doShell(user, password, devtools, width, height, url):
+@click.option("--headless", is_flag=True, help="Run the browser without a window")
+@click.option(
+    "--block",
+    type=click.Choice(RESOURCE_TYPES),
+    multiple=True,
+    help="Resource type to block, repeatable",
+)
+@click.option(
+    "--block-default", is_flag=True, help=f"Block {', '.join(DEFAULT_BLOCKED_TYPES)}"
+)
+@click.option("--block-third-party", is_flag=True, help="Block hosts other than --url")
+@click.option(
+    "--allow-host", multiple=True, help="Host not blocked as third party, repeatable"
+)
+def doShell(
+    user,
+    password,
+    devtools,
+    width,
+    height,
+    url,
+    headless,
+    block,
+    block_default,
+    block_third_party,
+    allow_host,
+):
+    block_types = list(block)
+    if block_default:
+        block_types += DEFAULT_BLOCKED_TYPES
     ezid = EZBrowser(
-        user, password, devtools=devtools, width=width, height=height, url=url
+        user,
+        password,
+        devtools=devtools,
+        width=width,
+        height=height,
+        url=url,
+        headless=headless,
+        block_types=block_types,
+        block_third_party=block_third_party,
+        allowed_hosts=allow_host,
     )
     ezid.cmdloop()
 
@@ -1,4 +1,9 @@
+import hashlib
+import http.server
 import logging
+import os
+import sys
+import threading
 import time
 import mysql.connector
 import json
@@ -13,28 +18,725 @@ ssh -L3306:rds-ias-ezid-search-dev.cmcguhglinoa.us-west-2.rds.amazonaws.com:3306
 
 stage:
 ssh -L3306:rds-ias-ezid-search2-stg.cmcguhglinoa.us-west-2.rds.amazonaws.com:3306 ezid-stage2
+
+Without a command, prints the statements in flight every interval. The
+digests command reports the top statement digests per interval,
+capture streams every completed statement to JSON lines, explain
+records the plans of slow SELECTs, and export publishes OpenMetrics.
 '''
 
 JSON_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
 """datetime format string for generating JSON content
 """
 
-@click.command()
+PICOSECONDS = 1e12
+"""performance_schema timers count picoseconds
+"""
+
+DIGEST_COUNTERS = [
+    "COUNT_STAR",
+    "SUM_TIMER_WAIT",
+    "SUM_LOCK_TIME",
+    "SUM_ROWS_EXAMINED",
+    "SUM_ROWS_SENT",
+    "SUM_NO_INDEX_USED",
+    "SUM_CREATED_TMP_DISK_TABLES",
+]
+"""Cumulative columns of events_statements_summary_by_digest
+"""
+
+DIGEST_SORT = {
+    "latency": "SUM_TIMER_WAIT",
+    "count": "COUNT_STAR",
+    "rows": "SUM_ROWS_EXAMINED",
+    "lock": "SUM_LOCK_TIME",
+}
+"""Orderings offered for the top digests
+"""
+
+DIGEST_Q = (
+    "SELECT SCHEMA_NAME, DIGEST, DIGEST_TEXT, "
+    + ", ".join(DIGEST_COUNTERS)
+    + " FROM performance_schema.events_statements_summary_by_digest"
+    + " WHERE SCHEMA_NAME = %s"
+)
+
+HISTORY_COLUMNS = [
+    "THREAD_ID",
+    "EVENT_ID",
+    "CURRENT_SCHEMA",
+    "DIGEST",
+    "SQL_TEXT",
+    "TIMER_START",
+    "TIMER_END",
+    "TIMER_WAIT",
+    "LOCK_TIME",
+    "ROWS_EXAMINED",
+    "ROWS_SENT",
+    "ROWS_AFFECTED",
+    "NO_INDEX_USED",
+    "CREATED_TMP_TABLES",
+    "CREATED_TMP_DISK_TABLES",
+    "SORT_ROWS",
+    "ERRORS",
+]
+
+HISTORY_Q = (
+    "SELECT "
+    + ", ".join(HISTORY_COLUMNS)
+    + " FROM performance_schema.events_statements_history_long"
+    + " WHERE END_EVENT_ID IS NOT NULL"
+)
+
+OWN_THREAD_Q = (
+    "SELECT THREAD_ID FROM performance_schema.threads"
+    " WHERE PROCESSLIST_ID = CONNECTION_ID()"
+)
+
+HISTORY_SIZE_Q = "SELECT @@performance_schema_events_statements_history_long_size"
+
+TIMER_NOW_Q = (
+    "SELECT TIMER_START FROM performance_schema.events_statements_current"
+    " WHERE THREAD_ID = (SELECT THREAD_ID FROM performance_schema.threads"
+    " WHERE PROCESSLIST_ID = CONNECTION_ID())"
+)
+"""Timer value at the start of this query, relates timers to wall time
+"""
+
+
+def nowJson():
+    return datetime.datetime.now(datetime.timezone.utc).strftime(JSON_TIME_FORMAT)
+
+
+def digestSnapshot(csr, schema):
+    """Cumulative digest counters keyed by (schema, digest)."""
+    csr.execute(DIGEST_Q, (schema,))
+    snapshot = {}
+    for row in csr.fetchall():
+        rec = {"schema": row[0], "digest": row[1], "digest_text": row[2]}
+        for k, v in zip(DIGEST_COUNTERS, row[3:]):
+            rec[k] = int(v or 0)
+        snapshot[(row[0], row[1])] = rec
+    return snapshot
+
+
+def digestDeltas(previous, current):
+    """Per digest activity between two snapshots.
+
+    A digest absent from previous, or whose count went backwards because
+    the summary table was truncated, contributes its current totals.
+
+    Returns:
+        list of dicts with the counter deltas of digests that ran
+    """
+    deltas = []
+    for key, cur in current.items():
+        prev = previous.get(key)
+        if prev is None or cur["COUNT_STAR"] < prev["COUNT_STAR"]:
+            prev = {k: 0 for k in DIGEST_COUNTERS}
+        d = {k: cur[k] - prev[k] for k in DIGEST_COUNTERS}
+        if d["COUNT_STAR"] <= 0:
+            continue
+        d["schema"] = cur["schema"]
+        d["digest"] = cur["digest"]
+        d["digest_text"] = cur["digest_text"]
+        deltas.append(d)
+    return deltas
+
+
+def digestSummary(d):
+    """Readable form of a digest delta, times in seconds."""
+    count = d["COUNT_STAR"]
+    return {
+        "digest": d["digest"],
+        "count": count,
+        "latency": d["SUM_TIMER_WAIT"] / PICOSECONDS,
+        "mean_latency": d["SUM_TIMER_WAIT"] / PICOSECONDS / count,
+        "lock": d["SUM_LOCK_TIME"] / PICOSECONDS,
+        "rows_examined": d["SUM_ROWS_EXAMINED"],
+        "rows_sent": d["SUM_ROWS_SENT"],
+        "no_index_used": d["SUM_NO_INDEX_USED"],
+        "tmp_disk_tables": d["SUM_CREATED_TMP_DISK_TABLES"],
+        "digest_text": d["digest_text"],
+    }
+
+
+def topDigests(deltas, sort="latency", n=10):
+    column = DIGEST_SORT[sort]
+    ranked = sorted(deltas, key=lambda d: d[column], reverse=True)
+    return [digestSummary(d) for d in ranked[:n]]
+
+
+def printDigests(t, interval, sort, top, as_json):
+    if as_json:
+        for rank, d in enumerate(top, 1):
+            row = {"t": t, "interval": interval, "sort": sort, "rank": rank}
+            row.update(d)
+            print(json.dumps(row), flush=True)
+        return
+    print(f"--- {t} top {len(top)} by {sort} over {interval:.1f}s")
+    print(f"{'count':>7} {'latency':>9} {'mean':>9} {'lock':>8} {'rows_exam':>10}  statement")
+    for d in top:
+        text = " ".join((d["digest_text"] or "").split())[:100]
+        print(
+            f"{d['count']:7d} {d['latency']:9.3f} {d['mean_latency']:9.4f} "
+            f"{d['lock']:8.3f} {d['rows_examined']:10d}  {text}"
+        )
+
+
+def timerOrigin(csr, clock=time.time):
+    """Wall clock time, in epoch seconds, at which the server timers were 0."""
+    t_wall = clock()
+    csr.execute(TIMER_NOW_Q)
+    row = csr.fetchall()[0]
+    return t_wall - int(row[0]) / PICOSECONDS
+
+
+class StatementCapture(object):
+    """Incremental reader of events_statements_history_long.
+
+    The table is a ring buffer shared by all threads. A high-water mark of
+    the last EVENT_ID read is kept for each THREAD_ID, so every completed
+    statement is returned exactly once, provided the buffer does not wrap
+    between polls. The buffer keeps the latest statements in the order
+    they completed, so while any row read by the previous poll remains,
+    none completed since can have been lost. A full buffer of only unseen
+    rows may have lost statements and is counted in overflows. The whole
+    buffer is read for this, the schema and own thread filters are applied
+    afterwards.
+
+    Args:
+        csr: cursor on a connection with access to performance_schema
+        schema: only capture statements with this default schema, None
+            for all
+        skip_existing: ignore statements already in the buffer
+    """
+
+    def __init__(self, csr, schema=None, skip_existing=True):
+        self._L = logging.getLogger(self.__class__.__name__)
+        self._csr = csr
+        self.schema = schema
+        self.marks = {}
+        self.overflows = 0
+        self.captured = 0
+        self._primed = False
+        # Unseen rows of any schema found by the latest read, the buffer fill
+        self.unseen = 0
+        csr.execute(HISTORY_SIZE_Q)
+        self.capacity = int(csr.fetchall()[0][0])
+        # Statements of this connection are not captured
+        csr.execute(OWN_THREAD_Q)
+        self.thread_id = csr.fetchall()[0][0]
+        self.origin = timerOrigin(csr)
+        if skip_existing:
+            self._read()
+
+    def _read(self):
+        self._csr.execute(HISTORY_Q)
+        rows = self._csr.fetchall()
+        marks = {}
+        new = []
+        for row in rows:
+            thread_id, event_id = row[0], row[1]
+            if event_id > self.marks.get(thread_id, -1):
+                new.append(row)
+            marks[thread_id] = max(event_id, marks.get(thread_id, -1))
+        if self._primed and rows and len(new) == len(rows) >= self.capacity:
+            self.overflows += 1
+            self._L.warning("History buffer wrapped, statements may have been lost")
+        # Threads absent from the buffer have no rows left to re-read
+        self.marks = marks
+        self._primed = True
+        self.unseen = len(new)
+        new = [
+            r
+            for r in new
+            if r[0] != self.thread_id and (self.schema is None or r[2] == self.schema)
+        ]
+        new.sort(key=lambda r: r[5])
+        return new
+
+    def record(self, row):
+        """JSON record of a history row, times in seconds."""
+        r = dict(zip(HISTORY_COLUMNS, row))
+        start = self.origin + int(r["TIMER_START"]) / PICOSECONDS
+        end = self.origin + int(r["TIMER_END"]) / PICOSECONDS
+        return {
+            "thread_id": r["THREAD_ID"],
+            "event_id": r["EVENT_ID"],
+            "schema": r["CURRENT_SCHEMA"],
+            "digest": r["DIGEST"],
+            "sql_text": r["SQL_TEXT"],
+            "start": start,
+            "end": end,
+            "latency": int(r["TIMER_WAIT"]) / PICOSECONDS,
+            "lock": int(r["LOCK_TIME"]) / PICOSECONDS,
+            "rows_examined": r["ROWS_EXAMINED"],
+            "rows_sent": r["ROWS_SENT"],
+            "rows_affected": r["ROWS_AFFECTED"],
+            "no_index_used": r["NO_INDEX_USED"],
+            "tmp_tables": r["CREATED_TMP_TABLES"],
+            "tmp_disk_tables": r["CREATED_TMP_DISK_TABLES"],
+            "sort_rows": r["SORT_ROWS"],
+            "errors": r["ERRORS"],
+        }
+
+    def poll(self):
+        """Statements completed since the previous poll, oldest first.
+
+        Returns:
+            list of record() dicts
+        """
+        self.origin = timerOrigin(self._csr)
+        res = [self.record(row) for row in self._read()]
+        self.captured += len(res)
+        return res
+
+
+class AdaptiveInterval(object):
+    """Poll interval that tightens as the history buffer fills.
+
+    The next interval is scaled so that a poll is expected to find about
+    target of the buffer capacity filled, within the minimum and maximum.
+
+    Args:
+        minimum: shortest interval in seconds
+        maximum: longest interval in seconds
+        target: fraction of the buffer to aim to read per poll
+    """
+
+    def __init__(self, minimum=0.1, maximum=5.0, target=0.25):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.interval = maximum
+
+    def update(self, n_rows, capacity):
+        """Next interval after a poll that read n_rows of capacity."""
+        fill = n_rows / capacity if capacity else 0.0
+        if fill <= 0:
+            self.interval *= 2.0
+        else:
+            self.interval *= min(2.0, self.target / fill)
+        self.interval = max(self.minimum, min(self.maximum, self.interval))
+        return self.interval
+
+
+DEFAULT_PLAN_CACHE = "qw_plans.json"
+"""File retaining EXPLAIN results between runs
+"""
+
+
+def walkPlan(node):
+    """Yield every dict of an EXPLAIN FORMAT=JSON document, depth first."""
+    if isinstance(node, dict):
+        yield node
+        for v in node.values():
+            yield from walkPlan(v)
+    elif isinstance(node, list):
+        for v in node:
+            yield from walkPlan(v)
+
+
+def planFlags(plan):
+    """Costly operations in an EXPLAIN FORMAT=JSON plan.
+
+    Returns:
+        dict with full_scan and full_index_scan (lists of table names),
+        filesort and temporary (bool), and signature, a hash of the plan
+        shape that ignores cost and row estimates
+    """
+    flags = {
+        "full_scan": [],
+        "full_index_scan": [],
+        "filesort": False,
+        "temporary": False,
+    }
+    shape = []
+    for node in walkPlan(plan):
+        if "table_name" in node and "access_type" in node:
+            table = node["table_name"]
+            access = node["access_type"]
+            if access == "ALL":
+                flags["full_scan"].append(table)
+            elif access == "index":
+                flags["full_index_scan"].append(table)
+            shape.append([table, access, node.get("key")])
+        if node.get("using_filesort"):
+            flags["filesort"] = True
+            shape.append("filesort")
+        if node.get("using_temporary_table"):
+            flags["temporary"] = True
+            shape.append("temporary")
+    flags["signature"] = hashlib.sha1(json.dumps(shape).encode("utf-8")).hexdigest()
+    return flags
+
+
+def isExplainable(sql_text):
+    return (sql_text or "").lstrip(" (\n\t").lower().startswith("select")
+
+
+class PlanCache(object):
+    """Plans by statement digest, persisted between runs.
+
+    Each digest is explained at most once per run. A digest already known
+    from an earlier run whose plan signature differs is reported as a plan
+    change.
+
+    Args:
+        path: JSON file holding the plans
+    """
+
+    def __init__(self, path=DEFAULT_PLAN_CACHE):
+        self._L = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.plans = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.plans = json.load(f)
+        self._seen = set()
+
+    def seen(self, digest):
+        """True if digest was already explained during this run."""
+        return digest in self._seen
+
+    def markSeen(self, digest):
+        """Skip digest for the rest of this run, e.g. when it can't be explained."""
+        self._seen.add(digest)
+
+    def update(self, digest, sql_text, flags, plan):
+        """Store the plan of digest.
+
+        Returns:
+            plan change dict if the plan differs from the stored one, else None
+        """
+        self.markSeen(digest)
+        previous = self.plans.get(digest)
+        t = nowJson()
+        self.plans[digest] = {
+            "sql_text": sql_text,
+            "flags": flags,
+            "plan": plan,
+            "first_seen": previous["first_seen"] if previous else t,
+            "last_seen": t,
+        }
+        if previous is None or previous["flags"]["signature"] == flags["signature"]:
+            return None
+        return {
+            "t": t,
+            "digest": digest,
+            "sql_text": sql_text,
+            "previous_flags": previous["flags"],
+            "flags": flags,
+            "previous_seen": previous["last_seen"],
+        }
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.plans, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+class Explainer(object):
+    """Runs EXPLAIN FORMAT=JSON for slow SELECT statements.
+
+    Args:
+        db: connection used only for EXPLAIN, separate from the watcher
+        cache: PlanCache
+        threshold: seconds of latency above which a statement is explained
+    """
+
+    def __init__(self, db, cache, threshold=1.0):
+        self._L = logging.getLogger(self.__class__.__name__)
+        self._db = db
+        self._csr = db.cursor()
+        self.cache = cache
+        self.threshold = threshold
+        self.explained = 0
+        self.errors = 0
+
+    def explain(self, rec):
+        """Explain a StatementCapture record if it qualifies.
+
+        Returns:
+            dict with the digest, latency, flags and any plan change, or
+            None if the statement was not explained
+        """
+        if rec["latency"] < self.threshold or not rec["digest"]:
+            return None
+        if self.cache.seen(rec["digest"]) or not isExplainable(rec["sql_text"]):
+            return None
+        try:
+            if rec["schema"] and rec["schema"] != self._db.database:
+                self._db.database = rec["schema"]
+            self._csr.execute("EXPLAIN FORMAT=JSON " + rec["sql_text"])
+            plan = json.loads(self._csr.fetchall()[0][0])
+        except (mysql.connector.Error, ValueError) as e:
+            # e.g. SQL_TEXT truncated by performance_schema_max_sql_text_length
+            self._L.info("Unable to explain %s: %s", rec["digest"], e)
+            self.errors += 1
+            self.cache.markSeen(rec["digest"])
+            return None
+        self.explained += 1
+        flags = planFlags(plan)
+        change = self.cache.update(rec["digest"], rec["sql_text"], flags, plan)
+        return {
+            "digest": rec["digest"],
+            "latency": rec["latency"],
+            "rows_examined": rec["rows_examined"],
+            "flags": flags,
+            "plan_changed": change is not None,
+            "change": change,
+            "sql_text": rec["sql_text"],
+        }
+
+
+INFLIGHT_Q = (
+    "SELECT COUNT(*) FROM performance_schema.events_statements_current"
+    " WHERE END_EVENT_ID IS NULL AND THREAD_ID <> %s"
+)
+
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+"""Upper bounds, in seconds, of the statement latency histogram buckets
+"""
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+OTHER_DIGEST = "other"
+"""Digest label of statements beyond the limit of distinct digests
+"""
+
+
+def inFlight(csr, thread_id, schema=None):
+    """Number of statements executing, other than on thread_id."""
+    if schema is None:
+        csr.execute(INFLIGHT_Q, (thread_id,))
+    else:
+        csr.execute(INFLIGHT_Q + " AND CURRENT_SCHEMA = %s", (thread_id, schema))
+    return int(csr.fetchall()[0][0])
+
+
+def metricLabels(labels):
+    """OpenMetrics label set, values escaped."""
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def metricValue(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class WatcherMetrics(object):
+    """OpenMetrics view of captured statements.
+
+    Statements from StatementCapture.poll() feed per digest latency
+    histograms and rows examined counters. Gauges record the statements
+    in flight and the lag of the latest poll, the time from the end of the
+    oldest statement it returned to when it was read.
+
+    Args:
+        buckets: histogram bucket upper bounds in seconds
+        max_digests: digests given their own series, later ones are
+            counted under OTHER_DIGEST
+        clock: function returning the current time in epoch seconds
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, max_digests=200, clock=time.time):
+        self.buckets = sorted(buckets)
+        self.max_digests = max_digests
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.digests = {}
+        self.texts = {}
+        self.in_flight = 0
+        self.poll_lag = 0.0
+        self.poll_duration = 0.0
+        self.polls = 0
+        self.captured = 0
+        self.overflows = 0
+
+    def _series(self, schema, digest):
+        key = (schema or "", digest or "")
+        if key not in self.digests:
+            if len(self.digests) >= self.max_digests:
+                key = (schema or "", OTHER_DIGEST)
+            if key not in self.digests:
+                self.digests[key] = {
+                    "buckets": [0] * len(self.buckets),
+                    "count": 0,
+                    "sum": 0.0,
+                    "rows_examined": 0,
+                }
+        return self.digests[key]
+
+    def observe(self, records, in_flight, poll_duration, overflows=0):
+        """Add the result of one poll.
+
+        Args:
+            records: StatementCapture records
+            in_flight: statements executing at the time of the poll
+            poll_duration: seconds taken by the poll queries
+            overflows: StatementCapture.overflows so far
+        """
+        now = self._clock()
+        with self._lock:
+            for rec in records:
+                series = self._series(rec["schema"], rec["digest"])
+                for i, le in enumerate(self.buckets):
+                    if rec["latency"] <= le:
+                        series["buckets"][i] += 1
+                        break
+                series["count"] += 1
+                series["sum"] += rec["latency"]
+                series["rows_examined"] += rec["rows_examined"] or 0
+                if rec["digest"] and rec["digest"] not in self.texts:
+                    text = " ".join((rec["sql_text"] or "").split())
+                    self.texts[rec["digest"]] = text[:200]
+            self.in_flight = in_flight
+            self.poll_lag = max([now - r["end"] for r in records] + [0.0])
+            self.poll_duration = poll_duration
+            self.polls += 1
+            self.captured += len(records)
+            self.overflows = overflows
+
+    def render(self):
+        """Metrics in the OpenMetrics text format."""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"# HELP {name} {help_text}")
+
+        def sample(name, labels, value):
+            lines.append(f"{name}{metricLabels(labels)} {metricValue(value)}")
+
+        with self._lock:
+            family("qw_statements_in_flight", "gauge", "Statements executing.")
+            sample("qw_statements_in_flight", None, self.in_flight)
+            family(
+                "qw_poll_lag_seconds",
+                "gauge",
+                "Age of the oldest statement read by the last poll.",
+            )
+            sample("qw_poll_lag_seconds", None, self.poll_lag)
+            family("qw_poll_duration_seconds", "gauge", "Time taken by the last poll.")
+            sample("qw_poll_duration_seconds", None, self.poll_duration)
+            family("qw_polls", "counter", "Polls of the statement history.")
+            sample("qw_polls_total", None, self.polls)
+            family("qw_history_overflows", "counter", "Polls that may have lost statements.")
+            sample("qw_history_overflows_total", None, self.overflows)
+            family("qw_statement_latency_seconds", "histogram", "Statement latency by digest.")
+            for (schema, digest), series in sorted(self.digests.items()):
+                labels = {"schema": schema, "digest": digest}
+                cumulative = 0
+                for le, n in zip(self.buckets, series["buckets"]):
+                    cumulative += n
+                    sample(
+                        "qw_statement_latency_seconds_bucket",
+                        dict(labels, le=metricValue(float(le))),
+                        cumulative,
+                    )
+                sample(
+                    "qw_statement_latency_seconds_bucket",
+                    dict(labels, le="+Inf"),
+                    series["count"],
+                )
+                sample("qw_statement_latency_seconds_count", labels, series["count"])
+                sample("qw_statement_latency_seconds_sum", labels, series["sum"])
+            family("qw_rows_examined", "counter", "Rows examined by digest.")
+            for (schema, digest), series in sorted(self.digests.items()):
+                labels = {"schema": schema, "digest": digest}
+                sample("qw_rows_examined_total", labels, series["rows_examined"])
+            family("qw_digest", "info", "Statement text of a digest.")
+            for digest, text in sorted(self.texts.items()):
+                sample("qw_digest_info", {"digest": digest, "text": text}, 1)
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def writeTextfile(self, path):
+        """Atomically replace path with the rendered metrics."""
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+def metricsServer(metrics, port, host="127.0.0.1"):
+    """Serve metrics.render() on http://host:port/metrics from a thread.
+
+    Returns:
+        the started http.server.ThreadingHTTPServer
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="qw-metrics", daemon=True).start()
+    return server
+
+
+def connect(opts):
+    if opts["user"] is None or opts["passwd"] is None:
+        raise ValueError("user and passwd required")
+    return mysql.connector.connect(
+        host=opts["host"],
+        port=opts["port"],
+        user=opts["user"],
+        password=opts["passwd"],
+        database=opts["dbname"]
+    )
+
+
+@click.group(invoke_without_command=True)
 @click.option("-s", "--seconds", default=5, help="Interval period")
 @click.option("-u", "--user", default=None, help="DB user with priviledges")
 @click.option("-p", "--passwd", default=None, help="DB password")
 @click.option("-d", "--dbname", default="ezid", help="Database name")
-def main(seconds, user, passwd, dbname):
+@click.option("--host", default="localhost", help="DB host")
+@click.option("--port", default=3306, help="DB port")
+@click.pass_context
+def main(ctx, seconds, user, passwd, dbname, host, port):
     if seconds < 1:
         seconds = 1;
-    if user is None or passwd is None:
-        raise ValueError("user and passwd required")
-    db = mysql.connector.connect(
-        host="localhost",
-        user=user,
-        password=passwd,
-        database=dbname
-    )
+    ctx.obj = {
+        "seconds": seconds,
+        "user": user,
+        "passwd": passwd,
+        "dbname": dbname,
+        "host": host,
+        "port": port,
+    }
+    if ctx.invoked_subcommand is None:
+        ctx.invoke(watch)
+
+
+@main.command()
+@click.pass_obj
+def watch(opts):
+    """Print statements in flight every interval."""
+    seconds = opts["seconds"]
+    db = connect(opts)
     csr = db.cursor()
     Q = "SELECT current_schema, sql_text FROM performance_schema.events_statements_current"
     while True:
@@ -49,5 +751,167 @@ def main(seconds, user, passwd, dbname):
             print("---")
         time.sleep(seconds)
 
+
+@main.command()
+@click.option("-n", "--top", "n_top", default=10, help="Digests per report")
+@click.option(
+    "--sort",
+    type=click.Choice(list(DIGEST_SORT)),
+    multiple=True,
+    default=["latency"],
+    help="Ranking, repeatable",
+)
+@click.option("--count", default=0, help="Number of intervals, 0 to run until stopped")
+@click.option("--json", "as_json", is_flag=True, help="JSON lines output")
+@click.pass_obj
+def digests(opts, n_top, sort, count, as_json):
+    """Top statement digests by cost in each interval.
+
+    Diffs snapshots of events_statements_summary_by_digest, so statements
+    shorter than the interval are included.
+    """
+    db = connect(opts)
+    csr = db.cursor()
+    previous = digestSnapshot(csr, opts["dbname"])
+    t_prev = time.monotonic()
+    n = 0
+    while count == 0 or n < count:
+        time.sleep(opts["seconds"])
+        current = digestSnapshot(csr, opts["dbname"])
+        t_cur = time.monotonic()
+        deltas = digestDeltas(previous, current)
+        t = nowJson()
+        for s in sort:
+            printDigests(t, t_cur - t_prev, s, topDigests(deltas, s, n_top), as_json)
+        previous, t_prev = current, t_cur
+        n += 1
+
+
+@main.command()
+@click.option(
+    "-o", "--output", type=click.File("a"), default="-", help="JSON lines output"
+)
+@click.option("--min-interval", default=0.1, help="Shortest poll interval, seconds")
+@click.option("--all-schemas", is_flag=True, help="Capture every schema")
+@click.option("--include-existing", is_flag=True, help="Also emit buffered history")
+@click.option("--duration", default=0.0, help="Seconds to capture, 0 until stopped")
+@click.pass_obj
+def capture(opts, output, min_interval, all_schemas, include_existing, duration):
+    """Stream every completed statement to JSON lines.
+
+    Reads events_statements_history_long incrementally, the interval
+    starts at --seconds and shortens under load so the buffer does not
+    wrap between polls. Requires the events_statements_history_long
+    consumer to be enabled.
+    """
+    db = connect(opts)
+    csr = db.cursor()
+    schema = None if all_schemas else opts["dbname"]
+    cap = StatementCapture(csr, schema=schema, skip_existing=not include_existing)
+    interval = AdaptiveInterval(minimum=min_interval, maximum=opts["seconds"])
+    t_end = time.monotonic() + duration if duration > 0 else None
+    try:
+        while t_end is None or time.monotonic() < t_end:
+            rows = cap.poll()
+            for rec in rows:
+                output.write(json.dumps(rec) + "\n")
+            output.flush()
+            time.sleep(interval.update(cap.unseen, cap.capacity))
+    except KeyboardInterrupt:
+        pass
+    print(
+        json.dumps({"captured": cap.captured, "overflows": cap.overflows}),
+        file=sys.stderr,
+    )
+
+
+@main.command()
+@click.option("-t", "--threshold", default=1.0, help="Explain statements slower than this")
+@click.option("--cache", "cache_path", default=DEFAULT_PLAN_CACHE, help="Plan cache file")
+@click.option(
+    "-r",
+    "--report",
+    type=click.File("a"),
+    default="qw_plan_changes.jsonl",
+    help="Plan change report, JSON lines",
+)
+@click.option("--duration", default=0.0, help="Seconds to watch, 0 until stopped")
+@click.pass_obj
+def explain(opts, threshold, cache_path, report, duration):
+    """EXPLAIN slow SELECT statements, flagging costly plans.
+
+    Statements are read as for capture. Each digest slower than the
+    threshold is explained once, on a second connection, and its plan is
+    kept in the cache file. Plans that differ from the previous run are
+    appended to the report.
+    """
+    csr = connect(opts).cursor()
+    cap = StatementCapture(csr, schema=opts["dbname"])
+    cache = PlanCache(cache_path)
+    explainer = Explainer(connect(opts), cache, threshold=threshold)
+    interval = AdaptiveInterval(maximum=opts["seconds"])
+    t_end = time.monotonic() + duration if duration > 0 else None
+    try:
+        while t_end is None or time.monotonic() < t_end:
+            rows = cap.poll()
+            for rec in rows:
+                res = explainer.explain(rec)
+                if res is None:
+                    continue
+                change = res.pop("change")
+                print(json.dumps(res), flush=True)
+                if change is not None:
+                    report.write(json.dumps(change) + "\n")
+                    report.flush()
+                cache.save()
+            time.sleep(interval.update(cap.unseen, cap.capacity))
+    except KeyboardInterrupt:
+        pass
+    cache.save()
+    print(
+        json.dumps({"explained": explainer.explained, "errors": explainer.errors}),
+        file=sys.stderr,
+    )
+
+
+@main.command()
+@click.option("--listen", default=9469, help="Port to serve /metrics on, 0 for none")
+@click.option("--bind", default="127.0.0.1", help="Address to serve on")
+@click.option("--textfile", default=None, help="File rewritten with the metrics each poll")
+@click.option("--max-digests", default=200, help="Digests given their own series")
+@click.option("--min-interval", default=0.1, help="Shortest poll interval, seconds")
+@click.option("--all-schemas", is_flag=True, help="Watch every schema")
+@click.pass_obj
+def export(opts, listen, bind, textfile, max_digests, min_interval, all_schemas):
+    """Publish statement metrics in the OpenMetrics format.
+
+    Statements are read as for capture, giving per digest latency
+    histograms and rows examined, along with the statements in flight and
+    the poll lag. Metrics are served over HTTP and/or written to a
+    textfile for a node exporter style collector.
+    """
+    if not listen and textfile is None:
+        raise click.UsageError("Nothing to export to, give --listen or --textfile")
+    csr = connect(opts).cursor()
+    schema = None if all_schemas else opts["dbname"]
+    cap = StatementCapture(csr, schema=schema)
+    metrics = WatcherMetrics(max_digests=max_digests)
+    interval = AdaptiveInterval(minimum=min_interval, maximum=opts["seconds"])
+    if listen:
+        metricsServer(metrics, listen, host=bind)
+    try:
+        while True:
+            t0 = time.monotonic()
+            rows = cap.poll()
+            n = inFlight(csr, cap.thread_id, schema)
+            metrics.observe(rows, n, time.monotonic() - t0, cap.overflows)
+            if textfile is not None:
+                metrics.writeTextfile(textfile)
+            time.sleep(interval.update(cap.unseen, cap.capacity))
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
     main()
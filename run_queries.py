@@ -1,14 +1,24 @@
+import concurrent.futures
+import itertools
 import logging
 import json
+import time
 import ezid_query.ezidq
+import ezid_query.load
+import ezid_query.searchcache
 import click
 import datetime
 import dateparser
+import requests
 
 JSON_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
 """datetime format string for generating JSON content
 """
 
+MATRIX_DIMENSIONS = ["object_type", "id_type", "id_status", "owner_selected", "manager"]
+"""Query facets swept by the matrix runner, manager selects the manage form
+"""
+
 
 def datetimeToJsonStr(dt):
     if dt is None:
@@ -73,13 +83,18 @@ def resSummary(res):
         "total": res["results"]["total"],
         "count": len(res["results"]["records"])
     }
+    if res.get("timing") is not None:
+        r["timing"] = res["timing"]
     return r
 
 
 def runQuery(cli, params, manager=False):
-    qform = cli.blankQueryForm(manager=False)
+    qform = cli.blankQueryForm(manager=manager)
     qform.update(params)
-    res = cli.search(qform)
+    target = None
+    if manager:
+        target = ezid_query.ezidq.EzidSearch.TARGET_MANAGE
+    res = cli.search(qform, target=target)
     return res
 
 
@@ -90,14 +105,171 @@ def queries(cli, params):
         yield q
 
 
+def queryMatrix(managers=(False, True)):
+    """Facet combinations of the query matrix.
+
+    id_status and owner_selected exist only on the manage form, so for the
+    search form they are swept only as None.
+
+    Yields:
+        dict of MATRIX_DIMENSIONS values
+    """
+    S = ezid_query.ezidq.EzidSearch
+    for manager in managers:
+        statuses = S.ID_STATUS if manager else [None]
+        owners = S.ADMIN_ONWER_SELECTED_SUBSET if manager else [None]
+        for ot, it, st, ow in itertools.product(
+            S.OBJECT_TYPES, S.IDENTIFIER_TYPES, statuses, owners
+        ):
+            yield {
+                "object_type": ot,
+                "id_type": it,
+                "id_status": st,
+                "owner_selected": ow,
+                "manager": manager,
+            }
+
+
+def runMatrixQuery(cli, params, dims):
+    q = params.copy()
+    for k in MATRIX_DIMENSIONS:
+        if k != "manager" and dims[k] is not None:
+            q[k] = dims[k]
+    row = dict(dims)
+    t0 = time.perf_counter()
+    try:
+        res = runQuery(cli, q, manager=dims["manager"])
+        row.update(resSummary(res))
+        row["error"] = None if res["status"] == 200 else res["status"]
+    except requests.RequestException as e:
+        row.update({"status": None, "url": None, "total": None, "count": None})
+        row["elapsed"] = time.perf_counter() - t0
+        row["error"] = str(e)
+    return row
+
+
+def summarizeMatrix(rows, slowest=10):
+    """Latency summary per value of each matrix dimension, slowest first.
+
+    Returns:
+        dict with dimensions, {dimension: {value: summary}}, and slowest,
+        the rows with the highest latency
+    """
+    dims = {k: {} for k in MATRIX_DIMENSIONS}
+    for row in rows:
+        for k in MATRIX_DIMENSIONS:
+            stats = dims[k].setdefault(str(row[k]), ezid_query.load.OperationStats())
+            stats.latency.record(row["elapsed"])
+            if row["error"] is not None:
+                stats.errors += 1
+    res = {"dimensions": {}}
+    for k, values in dims.items():
+        res["dimensions"][k] = {}
+        # Slowest facet values first
+        for v, stats in sorted(
+            values.items(),
+            key=lambda item: item[1].latency.total / item[1].latency.count,
+            reverse=True,
+        ):
+            summary = stats.latency.summary()
+            summary["errors"] = stats.errors
+            res["dimensions"][k][v] = summary
+    res["slowest"] = sorted(rows, key=lambda r: r["elapsed"], reverse=True)[:slowest]
+    return res
+
+
+def runMatrix(cli, params, workers=8, managers=(False, True), report=None):
+    """Run the query matrix on a pool of workers.
+
+    Args:
+        cli: EzidSearch, shared by the workers
+        params: query parameters common to every query
+        workers: number of queries in flight
+        managers: form modes to sweep
+        report: called with each result row as it completes
+
+    Returns:
+        summarizeMatrix() of the rows
+    """
+    rows = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(runMatrixQuery, cli, params, dims)
+            for dims in queryMatrix(managers=managers)
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            if report is not None:
+                report(row)
+    return summarizeMatrix(rows)
+
+
 @click.command()
-@click.option("--manager", is_flag=True, help="Use manage query form")
+@click.option(
+    "--manager", is_flag=True, help="Use manage query form, with --matrix sweep both"
+)
 @click.option("--filtered", default="t", help="Hidden filtered value, 't'")
-def main(manager, filtered):
+@click.option(
+    "--url", default=ezid_query.ezidq.EzidSearch.BASE_URL, help="EZID service URL"
+)
+@click.option("--matrix", is_flag=True, help="Sweep the full query facet matrix")
+@click.option("--workers", default=8, help="Matrix queries in flight")
+@click.option(
+    "-o", "--output", type=click.File("w"), default="-", help="JSONL matrix rows"
+)
+@click.option("-u", "--user", default=None, help="Login before querying")
+@click.option("-p", "--password", default=None)
+@click.option("--cache", default=None, help="SQLite search response cache file")
+@click.option(
+    "--cache-mode",
+    type=click.Choice(ezid_query.searchcache.MODES),
+    default=ezid_query.searchcache.MODE_USE,
+    help="Use, refresh or bypass the cache",
+)
+@click.option(
+    "--cache-ttl", default=ezid_query.searchcache.DEFAULT_TTL, help="Cache TTL seconds"
+)
+@click.option("--timing", "timed", is_flag=True, help="Record per phase timing")
+def main(
+    manager,
+    filtered,
+    url,
+    matrix,
+    workers,
+    output,
+    user,
+    password,
+    cache,
+    cache_mode,
+    cache_ttl,
+    timed,
+):
     params = {"identifier": "ark:/87925/drs1.iberian.100191"}
     #params = {"keywords": "peregrin"}
     #params = {"filtered": filtered}
-    cli = ezid_query.ezidq.EzidSearch()
+    if cache is not None:
+        cache = ezid_query.searchcache.SearchCache(
+            cache, ttl=cache_ttl, mode=cache_mode
+        )
+    cli = ezid_query.ezidq.EzidSearch(
+        base_url=url, pool_size=workers, cache=cache, timed=timed
+    )
+    if user is not None:
+        cli.login(user, password)
+    if matrix:
+        params = {"filtered": filtered}
+        managers = (False, True) if manager else (False,)
+        summary = runMatrix(
+            cli,
+            params,
+            workers=workers,
+            managers=managers,
+            report=lambda row: output.write(json.dumps(row) + "\n"),
+        )
+        output.flush()
+        click.echo(pj(summary), err=output.name == "<stdout>")
+        return
     res = runQuery(cli, params, manager=manager)
     print(pj(resSummary(res)))
     return
@@ -1,10 +1,32 @@
+import os
 import pytest
 import typing
 
+from ezid_query import fakeezid
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--ezid-base",
+        default=os.environ.get("EZID_BASE", "http://localhost:18880"),
+        help='EZID service to test against, "fake" runs a local stand-in',
+    )
+
+
+@pytest.fixture(scope="session")
+def fake_ezid():
+    server = fakeezid.FakeEZIDServer()
+    server.start()
+    yield server
+    server.stop()
+
+
 @pytest.fixture(scope="session")
-def ezid_base():
-    return "http://localhost:18880"
-    #return "https://ezid-stg.cdlib.org"
+def ezid_base(request):
+    base = request.config.getoption("--ezid-base")
+    if base == "fake":
+        return request.getfixturevalue("fake_ezid").url
+    return base
 
 @pytest.fixture(scope="session")
 def executable_path(executable_path):
@@ -0,0 +1,138 @@
+import random
+
+import click.testing
+import pytest
+
+from ezid_query import abcompare
+from ezid_query import apicli
+from ezid_query import fakeezid
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+class FakeClient(object):
+    """Advances the clock by a latency drawn around base."""
+
+    def __init__(self, clock, base, seed):
+        self.clock = clock
+        self.base = base
+        self._random = random.Random(seed)
+
+    def call(self, factor=1.0):
+        self.clock.t += self.base * factor * self._random.uniform(0.9, 1.1)
+        return True
+
+
+def compare(base_a, base_b, threshold=0.1):
+    clock = FakeClock()
+    probes = [
+        ("fast", lambda cli: cli.call()),
+        ("slow", lambda cli: cli.call(10.0)),
+    ]
+    comparison = abcompare.ABComparison(
+        FakeClient(clock, base_a, 1),
+        FakeClient(clock, base_b, 2),
+        probes,
+        rounds=30,
+        threshold=threshold,
+        bootstrap=500,
+        seed=3,
+        clock=clock,
+    )
+    return comparison.run()
+
+
+def test_bootstrapCI():
+    rng = random.Random(0)
+    a = [1.0 + rng.random() * 0.1 for _ in range(50)]
+    b = [x * 1.5 for x in a]
+    delta, lo, hi, rel, rel_lo, rel_hi = abcompare.bootstrapCI(a, b, n=500, rng=rng)
+    assert lo <= delta <= hi
+    assert rel == pytest.approx(0.5)
+    assert rel_lo <= rel <= rel_hi
+    assert rel_lo > 0.4
+
+
+def test_equalDeploymentsPass():
+    summary = compare(0.01, 0.01)
+    assert summary["passed"]
+    assert summary["probes"]["slow"]["n"] == 30
+    lo, hi = summary["probes"]["slow"]["relative_ci"]
+    assert lo < 0 < hi
+
+
+def test_slowerDeploymentFails():
+    summary = compare(0.01, 0.013)
+    assert not summary["passed"]
+    assert set(summary["failed"]) == {"fast", "slow"}
+    assert summary["overall"]["relative"] > 0.2
+    # Within a generous threshold it passes
+    assert compare(0.01, 0.013, threshold=0.5)["passed"]
+
+
+def test_apiWorkload():
+    servers = [
+        fakeezid.FakeEZIDServer(),
+        fakeezid.FakeEZIDServer(latency={"status": 0.02}),
+    ]
+    for server in servers:
+        server.start()
+    try:
+        clients = [apicli.EZIDClient(s.url) for s in servers]
+        summary = abcompare.ABComparison(
+            clients[0], clients[1], abcompare.apiProbes(), rounds=8, bootstrap=200
+        ).run()
+    finally:
+        for server in servers:
+            server.stop()
+    status = summary["probes"]["status"]
+    assert status["errors"] == {"a": 0, "b": 0}
+    assert status["delta"] > 0.015
+    assert summary["failed"] == ["status"]
+
+
+class BrokenClient(object):
+    def __init__(self, clock):
+        self.clock = clock
+
+    def call(self, factor=1.0):
+        self.clock.t += 0.001
+        raise ConnectionRefusedError()
+
+
+def test_brokenDeploymentFails():
+    clock = FakeClock()
+    probes = [("status", lambda cli: cli.call())]
+    summary = abcompare.ABComparison(
+        FakeClient(clock, 0.01, 1), BrokenClient(clock), probes, rounds=5, clock=clock
+    ).run()
+    assert summary["probes"]["status"]["errors"] == {"a": 0, "b": 5}
+    assert summary["failed"] == ["status"]
+    assert summary["verdict"] == abcompare.VERDICT_FAILED
+    assert not summary["passed"]
+    # Both sides failing tells nothing about B
+    summary = abcompare.ABComparison(
+        BrokenClient(clock), BrokenClient(clock), probes, rounds=5, clock=clock
+    ).run()
+    assert summary["inconclusive"] == ["status"]
+    assert summary["verdict"] == abcompare.VERDICT_INCONCLUSIVE
+    assert not summary["passed"]
+
+
+def test_mainExitCodes():
+    server = fakeezid.FakeEZIDServer()
+    server.start()
+    try:
+        res = click.testing.CliRunner().invoke(
+            abcompare.main,
+            [server.url, "http://127.0.0.1:1", "--workload", "api", "--rounds", "3"],
+        )
+    finally:
+        server.stop()
+    assert res.exit_code == 1
@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+from ezid_query import aimd
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def test_additiveIncrease():
+    c = aimd.AIMDController(initial_limit=2, max_limit=4, clock=FakeClock())
+    for i in range(100):
+        c.acquire()
+        c.release(0.1)
+    assert c.limit == 4
+    reasons = [h[2] for h in c.history()]
+    assert reasons == [aimd.REASON_INITIAL] + [aimd.REASON_INCREASE] * 2
+
+
+def test_multiplicativeDecreaseWithCooldown():
+    clock = FakeClock()
+    c = aimd.AIMDController(initial_limit=16, cooldown=1.0, clock=clock)
+    for i in range(4):
+        c.acquire()
+    for i in range(4):
+        c.release(0.1, error=True)
+    # A burst of failures within the cooldown cuts once
+    assert c.limit == 8
+    clock.t = 2.0
+    c.acquire()
+    c.release(0.1, error=True)
+    assert c.limit == 4
+    assert c.stats()["errors"] == 5
+
+
+def test_latencySpike():
+    clock = FakeClock()
+    c = aimd.AIMDController(
+        initial_limit=10, warmup=5, spike_factor=3.0, clock=clock
+    )
+    for i in range(5):
+        c.acquire()
+        c.release(0.1)
+    c.acquire()
+    c.release(1.0)
+    assert c.limit == 5
+    assert c.history()[-1][2] == aimd.REASON_LATENCY
+
+
+def test_slotBoundsInflight():
+    c = aimd.AIMDController(initial_limit=3, max_limit=3)
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        for i in range(20):
+            with c.slot():
+                with lock:
+                    peak.append(c.stats()["inflight"])
+
+    threads = [threading.Thread(target=work) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(peak) <= 3
+    assert c.stats()["inflight"] == 0
+
+
+def test_slotReportsException():
+    c = aimd.AIMDController(initial_limit=4, clock=FakeClock())
+    with pytest.raises(TimeoutError):
+        with c.slot():
+            raise TimeoutError()
+    assert c.stats()["errors"] == 1
+    assert c.limit == 2
+
+
+def test_latencyShiftRecovers():
+    clock = FakeClock()
+    c = aimd.AIMDController(
+        initial_limit=8, max_limit=8, warmup=5, spike_factor=1.5, clock=clock
+    )
+    for i in range(5):
+        c.acquire()
+        c.release(0.1)
+    # Latency doubles for good: cut at first, then the baseline adapts
+    for i in range(300):
+        clock.t += 0.1
+        c.acquire()
+        c.release(0.2)
+    assert c.stats()["latency_spikes"] > 0
+    assert c.stats()["smoothed_latency"] == pytest.approx(0.2, rel=0.01)
+    assert c.limit == 8
+    assert c.history()[-1][2] == aimd.REASON_INCREASE
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from ezid_query import anvl
+
+CROSSREF = """<?xml version="1.0"?>
+<book xmlns="http://www.crossref.org/schema/4.3.4" book_type="monograph">
+  <book_metadata>
+    <titles>
+      <title>Remembrance of Things Past: 100% complete</title>
+    </titles>
+  </book_metadata>
+</book>
+"""
+
+
+def test_formatRequestEscaping():
+    doc = anvl.formatRequest(["a:b", "50%\r\nline", b"@@", b"@@value"])
+    assert doc == "a%3Ab: 50%25%0D%0Aline\n@: @value"
+
+
+def test_formatRequestFromFile(tmp_path):
+    fn = tmp_path / "value.xml"
+    fn.write_bytes(b"line1\r\nline2")
+    doc = anvl.formatRequest(["crossref", f"@{fn}"])
+    assert doc == "crossref: line1%0D%0Aline2"
+
+
+def test_roundTrip():
+    metadata = {
+        "target": "http://example.net/",
+        "erc.who": "ezid-testing",
+        "crossref": CROSSREF,
+    }
+    response = "success: doi:10.15697/FK2TEST\n" + anvl.formatDict(metadata)
+    data = anvl.toDict(response.encode("utf-8"), decode=True)
+    assert data["status"] == "success"
+    assert data["status_message"] == "doi:10.15697/FK2TEST"
+    for k, v in metadata.items():
+        assert data[k] == v
+
+
+def test_toDictTimestampsAndBody():
+    t = 1634000000
+    expected = time.strftime(anvl.TIMESTAMP_FORMAT, time.localtime(t))
+    data = anvl.toDict(f"success: ark:/99999/fk4x\n_created: {t}\nno colon here")
+    assert data["_created"] == expected
+    assert data["body"] == "no colon here"
+    data = anvl.toDict(
+        f"success: ark:/99999/fk4x\n_created: {t}", format_timestamps=False
+    )
+    assert data["_created"] == str(t)
+
+
+@pytest.mark.parametrize("response", [None, "", b""])
+def test_toDictEmpty(response):
+    assert anvl.toDict(response)["status"] == "unknown"
+
+
+def test_unescapeMalformed():
+    assert anvl.unescape("100%") == "100%"
+    assert anvl.unescape("%zz%3a%3A") == "%zz::"
+
+
+def test_toText():
+    text = anvl.toText("success: x\nb: 2\na: 1%0A", sort_lines=True, decode=True)
+    assert text == b"success: x\na: 1\n\nb: 2"
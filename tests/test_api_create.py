@@ -1,13 +1,13 @@
 import os
 import requests
 import pytest
-import codecs
 import re
 import time
 import datetime
 import json
 from benedict import benedict
 import logging
+from ezid_query import anvl
 
 CROSSREF_TEST = """<?xml version="1.0"?>
 <book xmlns="http://www.crossref.org/schema/4.3.4"
@@ -43,79 +43,6 @@ def dictsEqual(a, b):
     return _a == _b
 
 
-def formatAnvlRequest(args, encoding="utf-8"):
-    """
-    Generate ANVL erquest document from provided arguments
-
-    Args:
-        args: list of [k,v, k,v, k,v, ...]
-        encoding: encoding for generated document
-
-    Returns:
-        test, ANVL formatted document
-    """
-    request = []
-    for i in range(0, len(args), 2):
-        # k = args[i].decode(encoding)
-        k = args[i]
-        if k == "@":
-            f = codecs.open(args[i + 1], encoding=encoding)
-            request += [l.strip("\r\n") for l in f.readlines()]
-            f.close()
-        else:
-            if k == "@@":
-                k = "@"
-            else:
-                k = re.sub("[%:\r\n]", lambda c: f"%{ord(c.group(0)):02X}", k)
-            # v = args[i + 1].decode(encoding)
-            v = args[i + 1]
-            if v.startswith("@@"):
-                v = v[1:]
-            elif v.startswith("@") and len(v) > 1:
-                f = codecs.open(v[1:], encoding=encoding)
-                v = f.read()
-                f.close()
-            v = re.sub("[%\r\n]", lambda c: f"%{ord(c.group(0)):02X}", v)
-            request.append(f"{k}: {v}")
-    return "\n".join(request)
-
-
-def anvlRequestFromDict(d):
-    args = []
-    for k, v in d.items():
-        args.append(k)
-        args.append(v)
-    return formatAnvlRequest(args)
-
-
-def anvlresponseToDict(
-    response, format_timestamps=True, decode=False, _encoding="utf-8"
-):
-    res = {"status": "unknown", "status_message": "no content", "body": ""}
-    if response is None:
-        return res
-    response = response.splitlines()
-    # Treat the first response line as the status
-    K, V = response[0].split(":", 1)
-    res["status"] = K
-    res["status_message"] = V.strip(" ")
-    for line in response[1:]:
-        try:
-            K, V = line.split(":", 1)
-            V = V.strip()
-            if format_timestamps and (K == "_created:" or K == "_updated:"):
-                ls = line.split(":")
-                V = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(int(ls[1])))
-            if decode:
-                V = re.sub(
-                    "%([0-9a-fA-F][0-9a-fA-F])", lambda m: chr(int(m.group(1), 16)), V,
-                )
-            res[K] = V
-        except ValueError:
-            res["body"] += line
-    return res
-
-
 def getRetry(url, headers=None, cookies=None, params=None, maxtime=30, status_codes=[200, 201]):
     t0 = time.time()
     while True:
@@ -184,8 +111,8 @@ def test_apiMintARK(ezid_base, auth_token):
     headers = {"Content-Type": "text/plain; charset=UTF-8"}
     cookies = dict(sessionid=auth_token)
 
-    anvl = anvlRequestFromDict(metadata)
-    res = requests.post(url, cookies=cookies, data=anvl, headers=headers)
+    anvl_doc = anvl.formatDict(metadata)
+    res = requests.post(url, cookies=cookies, data=anvl_doc, headers=headers)
     assert res.status_code in [200, 201]
     match = re.match(r"^success:\s*(.*)$", res.text)
     _id = match.group(1)
@@ -196,7 +123,7 @@ def test_apiMintARK(ezid_base, auth_token):
     assert res.status_code in [
         200,
     ]
-    data = anvlresponseToDict(res.text)
+    data = anvl.toDict(res.text)
     for k,v in metadata.items():
         assert data[k] == v
 
@@ -219,8 +146,8 @@ def test_apiMintDataCiteDOI(ezid_base, auth_token):
     headers = {"Content-Type": "text/plain; charset=UTF-8"}
     cookies = dict(sessionid=auth_token)
 
-    anvl = anvlRequestFromDict(metadata)
-    res = requests.post(url, cookies=cookies, data=anvl, headers=headers)
+    anvl_doc = anvl.formatDict(metadata)
+    res = requests.post(url, cookies=cookies, data=anvl_doc, headers=headers)
     print("\n========")
     print(res.text)
     print("========")
@@ -237,7 +164,7 @@ def test_apiMintDataCiteDOI(ezid_base, auth_token):
     assert res.status_code in [
         200,
     ]
-    data = anvlresponseToDict(res.text)
+    data = anvl.toDict(res.text)
     for k,v in metadata.items():
         assert data[k] == v
     #
@@ -273,8 +200,8 @@ def test_apiMintCrossRefDOI(ezid_base, auth_token):
     headers = {"Content-Type": "text/plain; charset=UTF-8"}
     cookies = dict(sessionid=auth_token)
 
-    anvl = anvlRequestFromDict(metadata)
-    res = requests.post(url, cookies=cookies, data=anvl, headers=headers)
+    anvl_doc = anvl.formatDict(metadata)
+    res = requests.post(url, cookies=cookies, data=anvl_doc, headers=headers)
     #print("\n========")
     #print(res.text)
     #print("========")
@@ -292,7 +219,7 @@ def test_apiMintCrossRefDOI(ezid_base, auth_token):
         200,
     ]
     #print(res.text)
-    data = anvlresponseToDict(res.text, decode=True)
+    data = anvl.toDict(res.text, decode=True)
 
     logging.debug(json.dumps(data, indent=2))
 
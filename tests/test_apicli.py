@@ -0,0 +1,340 @@
+"""Offline tests for ezid_query.apicli, run against a throwaway local server."""
+
+import asyncio
+import gzip
+import http.server
+import io
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import ezid_query.aimd
+import ezid_query.aioapicli
+import ezid_query.apicli
+import ezid_query.batch
+import ezid_query.cache
+
+DOWNLOAD_BODY = b"".join(
+    f"::ark:/99999/fk4{i:06d}\n_owner: apitest\n\n".encode("utf-8")
+    for i in range(20000)
+)
+
+
+BATCH_ANVL = b"".join(
+    f":: ark:/99999/fk4{i:06d}\n_owner: apitest\nerc.what: record%0A{i}\n\n".encode(
+        "utf-8"
+    )
+    for i in range(1000)
+)
+
+
+class AnvlHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    # Number of polls answered with 404 before a batch download is ready
+    download_polls = 2
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._send(200, "success: EZID is up")
+        elif self.path == "/download.txt":
+            self._send(200, DOWNLOAD_BODY)
+        elif self.path == "/download.gz":
+            self._send(200, gzip.compress(DOWNLOAD_BODY))
+        elif self.path == "/download/batch.txt.gz":
+            if AnvlHandler.download_polls > 0:
+                AnvlHandler.download_polls -= 1
+                self._send(404, "not found")
+            else:
+                self._send(200, gzip.compress(BATCH_ANVL))
+        elif self.path == "/overloaded":
+            self._send(503, "error: service unavailable")
+        elif self.path.startswith("/id/"):
+            self._send(200, f"success: {self.path[4:]}\n_owner: apitest")
+        else:
+            self._send(404, "error: not found")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        if self.path == "/download_request":
+            host = self.headers["Host"]
+            self._send(200, f"success: http://{host}/download/batch.txt.gz")
+        elif "erc.what: fail" in body:
+            self._send(400, "error: bad request - fail")
+        else:
+            self._send(201, "success: ark:/99999/fk4test")
+
+
+@pytest.fixture()
+def local_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), AnvlHandler)
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_connectionReuse(local_server):
+    cli = ezid_query.apicli.EZIDClient(local_server, session_id="sessionid=x")
+    for i in range(5):
+        assert cli.status()["status"] == "success"
+    res = cli.mint("ark:/99999/fk4", [b"erc.who", b"test"])
+    assert res["status"] == "success"
+    stats = cli.poolStats()
+    assert stats["opened"] == 1
+    assert stats["reused"] == 5
+    cli.close()
+    assert cli.poolStats()["idle"] == 0
+
+
+def test_errorResponseReleasesConnection(local_server):
+    cli = ezid_query.apicli.EZIDClient(local_server, session_id="sessionid=x")
+    response, headers = cli.issueRequest("missing", "GET")
+    assert response.startswith("error")
+    assert cli.status()["status"] == "success"
+    assert cli.poolStats()["reused"] == 1
+
+
+def test_sharedPoolAcrossThreads(local_server):
+    pool = ezid_query.apicli.transport.ConnectionPool(maxsize=4)
+    results = []
+
+    def work():
+        cli = ezid_query.apicli.EZIDClient(
+            local_server, session_id="sessionid=x", pool=pool
+        )
+        for i in range(10):
+            results.append(cli.view("ark:/99999/fk4test")["status"])
+
+    threads = [threading.Thread(target=work) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ["success"] * 40
+    stats = pool.stats()
+    assert stats["opened"] + stats["reused"] == 40
+    assert stats["opened"] <= 4
+
+
+@pytest.mark.parametrize(
+    "path,gunzip", [("download.txt", False), ("download.gz", True)]
+)
+def test_streamDownload(local_server, path, gunzip):
+    cli = ezid_query.apicli.EZIDClient(local_server, session_id="sessionid=x")
+    dest = io.BytesIO()
+    stats, headers = cli.issueRequest(
+        path, "GET", dest_f=dest, chunk_size=4096, gunzip=gunzip
+    )
+    assert dest.getvalue() == DOWNLOAD_BODY
+    assert stats["bytes_written"] == len(DOWNLOAD_BODY)
+    assert stats["bytes_read"] == int(headers["Content-Length"])
+    assert 0 <= stats["ttfb"] <= stats["elapsed"]
+    # Body fully consumed, so the connection is available for reuse
+    assert cli.status()["status"] == "success"
+    assert cli.poolStats()["reused"] == 1
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_mintMany(local_server, ordered):
+    cli = ezid_query.apicli.EZIDClient(local_server, session_id="sessionid=x")
+    consumed = []
+
+    def records():
+        for i in range(100):
+            consumed.append(i)
+            yield {"erc.who": "test", "erc.what": "fail" if i % 10 == 0 else "ok"}
+
+    results = cli.mintMany("ark:/99999/fk4", records(), workers=4, ordered=ordered)
+    first = next(results)
+    # Records are pulled lazily, bounded by the in-flight window
+    assert len(consumed) <= 9
+    results = [first] + list(results)
+    indexes = [r["index"] for r in results]
+    if ordered:
+        assert indexes == list(range(100))
+    assert sorted(indexes) == list(range(100))
+    for r in results:
+        if r["index"] % 10 == 0:
+            assert r["status"] == "error"
+            assert r["identifier"] is None
+        else:
+            assert r["status"] == "success"
+            assert r["identifier"] == "ark:/99999/fk4test"
+        assert r["elapsed"] > 0
+
+
+def test_batchDownload(local_server):
+    cli = ezid_query.apicli.EZIDClient(local_server, session_id="sessionid=x")
+    url = cli.requestDownload(format="anvl", column=["_id", "_owner"])
+    assert url.endswith("/download/batch.txt.gz")
+    records = cli.iterDownload(url, format="anvl", poll_interval=0.01, timeout=5)
+    n = 0
+    for i, record in enumerate(records):
+        assert record[ezid_query.batch.ID_KEY] == f"ark:/99999/fk4{i:06d}"
+        assert record["erc.what"] == f"record\n{i}"
+        n += 1
+    assert n == 1000
+
+
+def test_viewCache(local_server):
+    view_cache = ezid_query.cache.LRUCache(maxsize=10, ttl=60)
+    cli = ezid_query.apicli.EZIDClient(
+        local_server, session_id="sessionid=x", view_cache=view_cache
+    )
+    for i in range(3):
+        assert cli.view("ark:/99999/fk4test")["_owner"] == "apitest"
+    cli.view("ark:/99999/fk4", bang=True)
+    cli.view("ark:/99999/fk4other")
+    assert cli.cacheStats()["hits"] == 2
+    assert cli.cacheStats()["size"] == 3
+    # Minting fk4test drops it and the covering prefix view, not fk4other
+    cli.mint("ark:/99999/fk4", [b"erc.who", b"test"])
+    assert cli.cacheStats()["size"] == 1
+    cli.view("ark:/99999/fk4test")
+    assert cli.cacheStats()["misses"] == 4
+    cli.modify("ark:/99999/fk4other", [b"erc.who", b"test"])
+    assert cli.cacheStats()["invalidations"] == 3
+
+
+def test_viewCacheConcurrentModify(local_server):
+    view_cache = ezid_query.cache.LRUCache(maxsize=10, ttl=60)
+    cli = ezid_query.apicli.EZIDClient(
+        local_server, session_id="sessionid=x", view_cache=view_cache
+    )
+    issue = cli.issueRequest
+
+    def issueThenModify(path, method, **kwargs):
+        res = issue(path, method, **kwargs)
+        # Another thread modifies the identifier after the view was served
+        cli.issueRequest = issue
+        cli.modify("ark:/99999/fk4test", [b"erc.who", b"test"])
+        return res
+
+    cli.issueRequest = issueThenModify
+    cli.view("ark:/99999/fk4test")
+    # The view response predates the modify, so it was not cached
+    assert cli.cacheStats()["size"] == 0
+
+
+def test_concurrencyController(local_server):
+    # Only errors drive the limit down here, local latency is too noisy
+    controller = ezid_query.aimd.AIMDController(
+        initial_limit=2, max_limit=8, spike_factor=float("inf")
+    )
+    cli = ezid_query.apicli.EZIDClient(
+        local_server, session_id="sessionid=x", concurrency=controller
+    )
+    results = list(cli.mintMany("ark:/99999/fk4", [{}] * 100, workers=8))
+    assert len(results) == 100
+    assert controller.limit == 8
+    cli.issueRequest("overloaded", "GET")
+    assert controller.limit == 4
+    # Client errors are not a sign of overload
+    cli.issueRequest("missing", "GET")
+    assert controller.limit == 4
+    assert controller.stats()["errors"] == 1
+
+
+def test_asyncClientConcurrency(local_server):
+    async def run():
+        async with ezid_query.aioapicli.AsyncEZIDClient(
+            local_server, session_id="x", max_concurrency=8
+        ) as cli:
+            params = [b"erc.who", b"test"]
+            minted = await asyncio.gather(
+                *[cli.mint("ark:/99999/fk4", params) for i in range(50)]
+            )
+            viewed = await cli.view("ark:/99999/fk4test")
+            status = await cli.status()
+            return minted, viewed, status, cli.poolStats()
+
+    minted, viewed, status, stats = asyncio.run(run())
+    assert [r["status"] for r in minted] == ["success"] * 50
+    assert viewed["_owner"] == "apitest"
+    assert status["status"] == "success"
+    assert stats["opened"] <= 8
+    assert stats["opened"] + stats["reused"] == 52
+
+
+@pytest.mark.parametrize(
+    "session_id,expected",
+    [("abc123", "sessionid=abc123"), ("sessionid=abc123", "sessionid=abc123")],
+)
+def test_cookieHeaderShared(session_id, expected):
+    assert ezid_query.apicli.cookieHeader(session_id) == expected
+    cli = ezid_query.aioapicli.AsyncEZIDClient(
+        "http://localhost:1", session_id=session_id
+    )
+    assert cli._requestHeaders(b"")["Cookie"] == expected
+
+
+class DroppingHandler(http.server.BaseHTTPRequestHandler):
+    """Serves /ok, and drops the connection after reading any other request."""
+
+    protocol_version = "HTTP/1.1"
+    received = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        DroppingHandler.received.append((self.command, self.path))
+        if self.path == "/ok" or (
+            self.path == "/once" and self.received.count((self.command, self.path)) > 1
+        ):
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+            return
+        self.close_connection = True
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+@pytest.mark.parametrize(
+    "method,path,retried",
+    [("POST", "/shoulder/ark:/99999/fk4", False), ("GET", "/once", True)],
+)
+def test_droppedRequestRetriedOnlyIfIdempotent(method, path, retried):
+    DroppingHandler.received = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), DroppingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    opener = urllib.request.build_opener(ezid_query.apicli.transport.KeepAliveHandler())
+    try:
+        assert opener.open(url + "/ok").read() == b"ok"
+        request = urllib.request.Request(
+            url + path, data=b"erc.who: test" if method == "POST" else None
+        )
+        if retried:
+            assert opener.open(request).read() == b"ok"
+        else:
+            with pytest.raises(urllib.error.URLError):
+                opener.open(request)
+    finally:
+        server.shutdown()
+        server.server_close()
+    # A mint the server may have acted on is never sent twice
+    sent = [r for r in DroppingHandler.received if r[1] == path]
+    assert len(sent) == (2 if retried else 1)
@@ -0,0 +1,44 @@
+import gzip
+import io
+import os
+
+import pytest
+
+from ezid_query import batch
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+EXPECTED_IDS = [
+    "ark:/99999/fk4000001",
+    "doi:10.5072/FK2000002",
+    "ark:/99999/fk4000003",
+]
+
+
+def fixtureBytes(format):
+    with open(os.path.join(DATA_DIR, f"batch_download.{format}"), "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("format", batch.FORMATS)
+@pytest.mark.parametrize("compress", [False, True])
+def test_iterRecords(format, compress):
+    data = fixtureBytes(format)
+    if compress:
+        data = gzip.compress(data)
+    records = list(batch.iterRecords(io.BytesIO(data), format=format))
+    assert [r[batch.ID_KEY] for r in records] == EXPECTED_IDS
+    assert records[0]["_owner"] == "apitest"
+    assert records[0]["erc.what"] == "test case\nwith a line break"
+    assert records[2]["_status"] == "unavailable | withdrawn"
+
+
+def test_anvlDecoding():
+    records = list(batch.iterRecords(io.BytesIO(fixtureBytes("anvl")), "anvl"))
+    assert records[1]["datacite.title"] == "Ratio 50% complete"
+    assert records[1]["_shadowedby"] == "ark:/b5072/fk2000002"
+
+
+def test_unsupportedFormat():
+    with pytest.raises(ValueError):
+        list(batch.iterRecords(io.BytesIO(b""), "json"))
@@ -0,0 +1,57 @@
+from ezid_query import cache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def test_lruEviction():
+    c = cache.LRUCache(maxsize=2, ttl=None)
+    c.put("a", 1)
+    c.put("b", 2)
+    assert c.get("a") == 1
+    c.put("c", 3)
+    # "b" was least recently used
+    assert c.get("b") is None
+    assert c.get("a") == 1
+    assert c.get("c") == 3
+    stats = c.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+
+
+def test_ttlExpiry():
+    clock = FakeClock()
+    c = cache.LRUCache(maxsize=10, ttl=5, clock=clock)
+    c.put("a", 1)
+    clock.t = 4.9
+    assert c.get("a") == 1
+    clock.t = 5.0
+    assert c.get("a") is None
+    assert c.stats()["expirations"] == 1
+    assert len(c) == 0
+
+
+def test_invalidate():
+    c = cache.LRUCache()
+    for k in ("ark:/99999/fk4a", "ark:/99999/fk4b", "doi:10.5072/FK2"):
+        c.put(k, k)
+    assert c.invalidate(lambda k: k.startswith("ark:")) == 2
+    assert c.get("doi:10.5072/FK2") == "doi:10.5072/FK2"
+    assert c.stats()["invalidations"] == 2
+
+
+def test_putStaleGeneration():
+    c = cache.LRUCache()
+    generation = c.generation
+    # A write invalidates while the value is being fetched
+    c.invalidate(lambda k: k == "a")
+    assert not c.put("a", 1, generation=generation)
+    assert c.get("a") is None
+    assert c.put("a", 2, generation=c.generation)
+    assert c.get("a") == 2
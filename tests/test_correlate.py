@@ -0,0 +1,54 @@
+import correlate
+
+
+def statement(start, latency=0.01, sql="SELECT 1", digest="d"):
+    return {
+        "start": start,
+        "latency": latency,
+        "sql_text": sql,
+        "digest": digest,
+        "rows_examined": 10,
+        "no_index_used": 0,
+    }
+
+
+def test_markQuery():
+    params = {"keywords": "x {marker}", "filtered": "t", "title": None}
+    assert correlate.markQuery(params, "tok") == {
+        "keywords": "x tok",
+        "filtered": "t",
+        "title": None,
+    }
+
+
+def test_correlateWindows():
+    windows = [
+        {"object_type": "Text", "start": 10.0, "end": 10.5},
+        {"object_type": "Image", "start": 10.8, "end": 11.0, "marker": "qwmark1"},
+    ]
+    statements = [
+        statement(10.1),
+        statement(10.52, latency=0.3, digest="slow"),
+        # Outside both windows, but carries the marker of the second
+        statement(12.0, sql="SELECT * WHERE k LIKE '%qwmark1%'"),
+        statement(10.95),
+        statement(20.0),
+    ]
+    attributed, unattributed = correlate.correlate(windows, statements, slack=0.05)
+    assert [len(a) for a in attributed] == [2, 2]
+    assert unattributed == [statements[4]]
+    report = correlate.searchReport(windows[0], attributed[0])
+    assert report["object_type"] == "Text"
+    assert "start" not in report
+    assert report["sql_count"] == 2
+    assert report["db_time"] == 0.31
+    assert report["rows_examined"] == 20
+    assert report["worst"]["digest"] == "slow"
+
+
+def test_correlateOverlapNearestCentre():
+    windows = [{"start": 0.0, "end": 1.0}, {"start": 0.9, "end": 2.0}]
+    attributed, _ = correlate.correlate(windows, [statement(0.95), statement(0.92)])
+    # 0.95 is 0.45 from the first centre and 0.5 from the second
+    assert len(attributed[0]) == 2
+    assert correlate.searchReport(windows[1], attributed[1])["worst"] is None
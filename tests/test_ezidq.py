@@ -0,0 +1,76 @@
+import pytest
+
+from ezid_query import ezidq
+from ezid_query import fakeezid
+
+EDGE_PAGE = """<!DOCTYPE html>
+<html><head><title>EZID</title></head><body>
+<div class="header"><table class="nav"><tr><td>not a result</td></tr></table></div>
+<div class="customize-table"><form>
+<h2 class="heading">Results: 1 to 3 of 12,345 Search Results</h2>
+<table class="table3 tablesort">
+<thead><tr><th>ID</th><th>Title</th></tr></thead>
+<tr><td> <a href="/id/ark:/99999/fk41">ark:/99999/fk41</a> </td><td>Caf&eacute; &amp; bar</td></tr>
+<tr><td>ark:/99999/fk42</td><td><span>nested</span> <b>markup</b>&nbsp;</td></tr>
+<tr><td>ark:/99999/fk43</td><td></td></tr>
+</table></form></div>
+</body></html>
+"""
+
+
+def parse(body, parser):
+    return ezidq.EzidSearch(
+        base_url="http://localhost", parser=parser
+    ).parseSearchResults(body)
+
+
+@pytest.mark.parametrize("hits", [0, 1, 20])
+def test_parsersAgreeOnSearchPages(hits):
+    page = fakeezid.FakeEZID(search_total=500).searchPage({"ps": hits})
+    res = parse(page, ezidq.EzidSearch.PARSER_LXML)
+    assert res == parse(page, ezidq.EzidSearch.PARSER_BS4)
+    assert res["total"] == 500
+
+
+def test_parsersAgreeOnEdgeCases():
+    res = parse(EDGE_PAGE, ezidq.EzidSearch.PARSER_LXML)
+    assert res == parse(EDGE_PAGE, ezidq.EzidSearch.PARSER_BS4)
+    assert res["total"] == 12345
+    assert res["records"] == [
+        [],
+        ["ark:/99999/fk41", "Café & bar"],
+        ["ark:/99999/fk42", "nested markup"],
+        ["ark:/99999/fk43", ""],
+    ]
+
+
+@pytest.mark.parametrize("parser", ezidq.EzidSearch.PARSERS)
+@pytest.mark.parametrize("body", ["", "<html><body><h2>Nothing</h2></body></html>"])
+def test_noResultsTable(parser, body):
+    assert parse(body, parser) == {"total": -1, "records": []}
+
+
+@pytest.fixture(scope="module")
+def search_client(fake_ezid):
+    return ezidq.EzidSearch(base_url=fake_ezid.url)
+
+
+def test_iterSearchAllPages(search_client, fake_ezid):
+    records = list(search_client.iterSearch({}, page_size=100, prefetch=3))
+    total = fake_ezid.ezid.search_total
+    assert len(records) == total
+    assert [r[0] for r in records] == [f"ark:/99999/fk4{i:07d}" for i in range(total)]
+
+
+@pytest.mark.parametrize(
+    "limits,expected",
+    [
+        ({"max_records": 250}, 250),
+        ({"max_pages": 2}, 200),
+        ({"max_pages": 2, "max_records": 150}, 150),
+    ],
+)
+def test_iterSearchLimits(search_client, limits, expected):
+    records = list(search_client.iterSearch({}, page_size=100, prefetch=2, **limits))
+    assert len(records) == expected
+    assert records[-1][0] == f"ark:/99999/fk4{expected - 1:07d}"
@@ -0,0 +1,112 @@
+"""Client libraries exercised against the local stand-in EZID service."""
+
+import asyncio
+import http.client
+
+import pytest
+
+from ezid_query import aioapicli
+from ezid_query import apicli
+from ezid_query import ezidq
+from ezid_query import fakeezid
+from ezid_query import load
+
+
+def test_apiRoundTrip(fake_ezid):
+    cli = apicli.EZIDClient(fake_ezid.url, username="apitest", password="apitest")
+    assert cli.status()["status"] == "success"
+    res = cli.login()
+    assert res["status"] == "success"
+    assert cli._cookie in fake_ezid.ezid.sessions
+    res = cli.mint(
+        "ark:/99999/fk4", [b"erc.who", b"ezid-testing", b"erc.what", b"50% done"]
+    )
+    assert res["status"] == "success"
+    pid = res["status_message"]
+    res = cli.modify(pid, [b"erc.when", b"2021"])
+    assert res["status"] == "success"
+    res = cli.view(pid, bang=False)
+    assert res["_owner"] == "apitest"
+    assert res["erc.what"] == "50%25 done"
+    assert res["erc.when"] == "2021"
+    assert cli.view("ark:/99999/fk4nope")["status"] == "error"
+    assert cli.logout()["status"] == "success"
+
+
+def test_mintDoi(fake_ezid):
+    cli = apicli.EZIDClient(fake_ezid.url, username="apitest", password="apitest")
+    res = cli.mint("doi:10.5072/FK2", [b"datacite.title", b"test"])
+    doi, shadow = [v.strip() for v in res["status_message"].split("|")]
+    assert doi.startswith("doi:10.5072/FK2")
+    assert shadow.startswith("ark:/b5072/fk2")
+
+
+def test_anonymousMintRejected(fake_ezid):
+    cli = apicli.EZIDClient(fake_ezid.url, session_id="sessionid=bogus")
+    assert cli.mint("ark:/99999/fk4")["status"] == "error"
+
+
+def test_asyncClient(fake_ezid):
+    async def run():
+        async with aioapicli.AsyncEZIDClient(
+            fake_ezid.url, username="apitest", password="apitest"
+        ) as cli:
+            await cli.login()
+            return await asyncio.gather(
+                *[cli.mint("ark:/99999/fk4", [b"erc.who", b"x"]) for i in range(20)]
+            )
+
+    results = asyncio.run(run())
+    assert len({r["status_message"] for r in results}) == 20
+
+
+def test_search(fake_ezid):
+    cli = ezidq.EzidSearch(base_url=fake_ezid.url)
+    res = cli.search(cli.blankQueryForm())
+    assert res["status"] == 200
+    assert res["results"]["total"] == fakeezid.DEFAULT_SEARCH_TOTAL
+    # Header row plus one page of hits
+    assert len(res["results"]["records"]) == fakeezid.DEFAULT_PAGE_SIZE + 1
+    assert res["results"]["records"][1][0] == "ark:/99999/fk40000000"
+
+
+def test_batchDownload(fake_ezid):
+    cli = apicli.EZIDClient(fake_ezid.url, username="apitest", password="apitest")
+    pid = cli.mint("ark:/99999/fk4", [b"erc.who", b"batch"])["status_message"]
+    url = cli.requestDownload()
+    records = {r["_id"]: r for r in cli.iterDownload(url, poll_interval=0.01)}
+    assert records[pid]["erc.who"] == "batch"
+
+
+def test_latency():
+    server = fakeezid.FakeEZIDServer(latency={"status": 0.05})
+    url = server.start()
+    try:
+        generator = load.LoadGenerator(
+            url, mix={"status": 1}, rate=50, duration=0.5, interval=10
+        )
+        summary = generator.run()
+    finally:
+        server.stop()
+    assert summary["status"]["errors"] == 0
+    assert summary["status"]["min"] >= 0.05
+    assert summary["all"]["connections"]["reused"] > 0
+
+
+def test_parseLatency():
+    assert fakeezid.parseLatency("mint=0.5, view=0.01") == {"mint": 0.5, "view": 0.01}
+    with pytest.raises(ValueError):
+        fakeezid.parseLatency("delete=1")
+
+
+def test_stopWithOpenConnection(caplog):
+    server = fakeezid.FakeEZIDServer()
+    server.start()
+    conn = http.client.HTTPConnection(server.host, server.port)
+    try:
+        conn.request("GET", "/status")
+        conn.getresponse().read()
+        server.stop()
+    finally:
+        conn.close()
+    assert not [r for r in caplog.records if r.exc_info]
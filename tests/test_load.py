@@ -0,0 +1,43 @@
+import random
+
+import pytest
+
+from ezid_query import load
+
+
+def test_parseMix():
+    assert load.parseMix("status=5, view=3,mint") == {
+        "status": 5.0,
+        "view": 3.0,
+        "mint": 1.0,
+    }
+    with pytest.raises(ValueError):
+        load.parseMix("status=1,delete=1")
+    with pytest.raises(ValueError):
+        load.parseMix("status=0")
+
+
+def test_histogramPercentiles():
+    rnd = random.Random(1)
+    samples = [rnd.lognormvariate(-3, 1) for i in range(20000)]
+    h = load.LatencyHistogram(precision=0.01)
+    for v in samples:
+        h.record(v)
+    samples.sort()
+    for p in load.PERCENTILES:
+        exact = samples[int(len(samples) * p / 100.0) - 1]
+        assert h.percentile(p) == pytest.approx(exact, rel=0.02)
+    assert h.percentile(100) == samples[-1]
+    assert h.summary()["p999"] == h.percentile(99.9)
+
+
+def test_histogramMerge():
+    a = load.LatencyHistogram()
+    b = load.LatencyHistogram()
+    for i in range(1, 101):
+        (a if i % 2 else b).record(i / 1000.0)
+    a.merge(b)
+    assert a.count == 100
+    assert a.min == 0.001
+    assert a.max == 0.1
+    assert a.percentile(50) == pytest.approx(0.05, rel=0.01)
@@ -0,0 +1,275 @@
+import asyncio
+
+import pytest
+
+import mbot
+
+
+class FakeRequest(object):
+    def __init__(self, url, resource_type, frame=None, navigation=False):
+        self.url = url
+        self.resourceType = resource_type
+        self.frame = frame
+        self.redirectChain = []
+        self._navigation = navigation
+        self.outcome = None
+
+    def isNavigationRequest(self):
+        return self._navigation
+
+    async def continue_(self, overrides=None):
+        self.outcome = "continue"
+
+    async def abort(self, errorCode="failed"):
+        self.outcome = errorCode
+
+    def failure(self):
+        return {"errorText": "net::ERR_BLOCKED_BY_CLIENT"}
+
+
+class FakePage(object):
+    mainFrame = "main"
+
+
+def test_requestFilter():
+    f = mbot.RequestFilter(
+        "https://ezid-stg.cdlib.org",
+        block_types=["image"],
+        block_third_party=True,
+        allowed_hosts=["cdn.example.org"],
+    )
+    assert f.enabled
+    assert f.reason("image", "https://ezid-stg.cdlib.org/a.png") == "type"
+    assert f.reason("script", "https://ezid-stg.cdlib.org/a.js") is None
+    assert f.reason("script", "https://www.google-analytics.com/ga.js") == "third_party"
+    assert f.reason("stylesheet", "https://cdn.example.org/a.css") is None
+    assert f.reason("font", "data:font/woff2;base64,AAAA") is None
+    assert not mbot.RequestFilter("https://ezid-stg.cdlib.org").enabled
+
+
+def test_pageMonitor():
+    t = [0.0]
+    monitor = mbot.PageMonitor(
+        mbot.RequestFilter(
+            "https://ezid.example.org", block_types=["image"], block_third_party=True
+        ),
+        clock=lambda: t[0],
+    )
+    monitor._page = FakePage()
+    requests = [
+        FakeRequest("https://ezid.example.org/", "document", "main", True),
+        FakeRequest("https://ezid.example.org/a.css", "stylesheet", "main"),
+        FakeRequest("https://ezid.example.org/logo.png", "image", "main"),
+        FakeRequest("https://fonts.example.com/f.woff", "font", "main"),
+    ]
+
+    async def run():
+        for r in requests:
+            monitor._onRequest(r)
+        monitor._onRequestFailed(requests[2])
+        monitor._onLoadingFinished({"encodedDataLength": 1000})
+        monitor._onLoadingFinished({"encodedDataLength": 200})
+        t[0] = 0.5
+        monitor._onLoad()
+        # A third party document is blocked, the next page is not
+        monitor._onRequest(FakeRequest("https://ads.example.com/", "document", "ad"))
+        monitor._onRequest(
+            FakeRequest("https://ezid.example.org/search", "document", "main", True)
+        )
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert [r.outcome for r in requests] == [
+        "continue",
+        "continue",
+        "blockedbyclient",
+        "blockedbyclient",
+    ]
+    first, second = monitor.report()
+    assert first == {
+        "url": "https://ezid.example.org/",
+        "load": 0.5,
+        "requests": 5,
+        "blocked": 3,
+        "failed": 0,
+        "bytes": 1200,
+        "by_type": {"document": 2, "stylesheet": 1, "image": 1, "font": 1},
+    }
+    assert second["url"] == "https://ezid.example.org/search"
+    assert second["requests"] == 1
+    assert second["load"] is None
+
+
+class FakeSession(object):
+    async def send(self, method, params=None):
+        pass
+
+    def on(self, event, handler):
+        pass
+
+
+class FakeTarget(object):
+    async def createCDPSession(self):
+        return FakeSession()
+
+
+class FakePoolPage(FakePage):
+    def __init__(self, owner):
+        self.owner = owner
+        self.heap = 1000
+        self.visited = []
+        self.closed = False
+        self.target = FakeTarget()
+
+    def on(self, event, handler):
+        pass
+
+    async def setRequestInterception(self, value):
+        pass
+
+    async def setViewport(self, viewport):
+        pass
+
+    async def goto(self, url):
+        self.visited.append(url)
+
+    async def metrics(self):
+        return {"JSHeapUsedSize": self.heap}
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeContext(object):
+    def __init__(self):
+        self.pages = []
+
+    async def newPage(self):
+        page = FakePoolPage(self)
+        self.pages.append(page)
+        return page
+
+    async def close(self):
+        for page in self.pages:
+            page.closed = True
+
+
+class FakeBrowser(object):
+    def __init__(self):
+        self.contexts = []
+        self.failures = 0
+
+    async def createIncognitoBrowserContext(self):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("context failed")
+        context = FakeContext()
+        self.contexts.append(context)
+        return context
+
+
+def test_pagePool():
+    browser = FakeBrowser()
+    pool = mbot.PagePool(
+        browser, size=2, max_size=3, base_url="https://ezid.example.org", max_heap=5000
+    )
+
+    async def run():
+        await pool.start()
+        assert pool.pages == 2
+        assert all(
+            c.pages[0].visited == ["https://ezid.example.org/"]
+            for c in browser.contexts
+        )
+        a = await pool.checkout()
+        b = await pool.checkout()
+        # Grows to max_size, then waits
+        c = await pool.checkout()
+        assert pool.pages == 3
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.checkout(timeout=0.01)
+        # Over the heap limit, a is replaced by a fresh page in a new context
+        a._page.heap = 10000
+        await pool.checkin(a)
+        assert a._page.closed
+        d = await pool.checkout(timeout=0.01)
+        assert d is not a and not d._page.closed
+        await pool.checkin(b)
+        assert await pool.checkout(timeout=0.01) is b
+        await pool.checkin(c)
+        with pytest.raises(RuntimeError):
+            async with pool.page(timeout=1) as e:
+                raise RuntimeError("flow failed")
+        # The page of a failed flow is not reused
+        assert e._page.closed
+
+        async def flow(ezpage, item):
+            if item == 2:
+                raise ValueError(item)
+            return item * 10
+
+        await pool.checkin(b)
+        await pool.checkin(d)
+        res = await pool.map(flow, [1, 2, 3, 4], timeout=1)
+        assert res[0] == 10 and res[2] == 30 and res[3] == 40
+        assert isinstance(res[1], ValueError)
+        assert pool.pages == 3
+        await pool.close()
+        assert pool.pages == 0
+
+    asyncio.run(run())
+    assert pool.stats["recycled"] == 3
+    assert len(browser.contexts) == 6
+
+
+def test_pagePoolReplacementFails():
+    browser = FakeBrowser()
+    pool = mbot.PagePool(browser, size=1, base_url="https://ezid.example.org")
+
+    async def run():
+        await pool.start()
+        a = await pool.checkout()
+        waiter = asyncio.ensure_future(pool.checkout())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        # The replacement of a recycled page fails, the waiter is not stranded
+        browser.failures = 1
+        await pool.checkin(a, discard=True)
+        b = await asyncio.wait_for(waiter, 1)
+        assert b is not a and not b._page.closed
+        assert pool.pages == 1
+        await pool.checkin(b)
+        assert await pool.checkout(timeout=0.01) is b
+
+    asyncio.run(run())
+    assert pool.stats["waits"] == 1
+
+
+def test_pagePoolCheckoutTimeout():
+    browser = FakeBrowser()
+    pool = mbot.PagePool(browser, size=1, base_url="https://ezid.example.org")
+
+    async def run():
+        await pool.start()
+        a = await pool.checkout()
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.checkout(timeout=0.01)
+        waiter = asyncio.ensure_future(pool.checkout())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        # Neither the timed out nor the cancelled checkout took the page
+        await pool.checkin(a)
+        assert await pool.checkout(timeout=0.01) is a
+        assert pool.pages == 1
+        # Pages still checked out are closed with the pool
+        await pool.close()
+        assert a._page.closed
+        assert pool.pages == 0
+        await pool.checkin(a)
+        assert pool.pages == 0
+
+    asyncio.run(run())
+    assert pool.stats["checkouts"] == 2
+    assert pool.stats["waits"] == 2
@@ -0,0 +1,294 @@
+import json
+
+import pytest
+import requests
+
+import qw
+
+
+class FakeCursor(object):
+    """Returns canned rows for each execute()."""
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.executed = []
+
+    def execute(self, q, params=None):
+        self.executed.append((q, params))
+        self._rows = self.results.pop(0)
+
+    def fetchall(self):
+        return self._rows
+
+
+def digestRow(digest, count, wait, lock=0, rows=0):
+    return ("ezid", digest, f"SELECT {digest}", count, wait, lock, rows, count, 0, 0)
+
+
+def test_digestDeltas():
+    csr = FakeCursor(
+        [
+            [digestRow("a", 10, 10**12), digestRow("b", 5, 5 * 10**12, rows=100)],
+            [
+                digestRow("a", 10, 10**12),
+                digestRow("b", 7, 9 * 10**12, lock=10**9, rows=160),
+                digestRow("c", 1, 2 * 10**11),
+            ],
+        ]
+    )
+    previous = qw.digestSnapshot(csr, "ezid")
+    current = qw.digestSnapshot(csr, "ezid")
+    assert csr.executed[0][1] == ("ezid",)
+    deltas = qw.digestDeltas(previous, current)
+    # "a" did not run during the interval
+    assert sorted(d["digest"] for d in deltas) == ["b", "c"]
+    top = qw.topDigests(deltas, "latency", 1)
+    assert len(top) == 1
+    b = top[0]
+    assert b["digest"] == "b"
+    assert b["count"] == 2
+    assert b["latency"] == 4.0
+    assert b["mean_latency"] == 2.0
+    assert b["lock"] == 0.001
+    assert b["rows_examined"] == 60
+    assert [d["digest"] for d in qw.topDigests(deltas, "count")] == ["b", "c"]
+
+
+def test_digestTableTruncated():
+    previous = {("ezid", "a"): dict(zip(qw.DIGEST_COUNTERS, [100] * 7))}
+    current = {
+        ("ezid", "a"): dict(
+            zip(qw.DIGEST_COUNTERS, [3] * 7), schema="ezid", digest="a", digest_text=""
+        )
+    }
+    (d,) = qw.digestDeltas(previous, current)
+    assert d["COUNT_STAR"] == 3
+
+
+class HistoryCursor(object):
+    """Serves a mutable history table and the capture's setup queries."""
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.history = []
+        self.timer_now = 10 * 10**12
+
+    def execute(self, q, params=None):
+        if q == qw.HISTORY_SIZE_Q:
+            self._rows = [(self.capacity,)]
+        elif q == qw.OWN_THREAD_Q:
+            self._rows = [(1,)]
+        elif q == qw.TIMER_NOW_Q:
+            self._rows = [(self.timer_now,)]
+        else:
+            assert q == qw.HISTORY_Q
+            self._rows = list(self.history[-self.capacity :])
+
+    def fetchall(self):
+        return self._rows
+
+    def add(self, thread_id, event_id, start_s=1, schema="ezid"):
+        start = int(start_s * 10**12)
+        self.history.append(
+            (thread_id, event_id, schema, "d1", "SELECT 1", start, start + 5 * 10**9)
+            + (5 * 10**9, 10**6, 10, 1, 0, 0, 0, 0, 0, 0)
+        )
+
+
+def test_statementCaptureHighWaterMarks():
+    csr = HistoryCursor()
+    csr.add(20, 5)
+    cap = qw.StatementCapture(csr, schema="ezid")
+    assert cap.poll() == []
+    csr.add(20, 9, start_s=3)
+    csr.add(21, 2, start_s=2)
+    csr.add(1, 100)
+    rows = cap.poll()
+    assert [(r["thread_id"], r["event_id"]) for r in rows] == [(21, 2), (20, 9)]
+    assert rows[0]["latency"] == 0.005
+    assert rows[0]["end"] - rows[0]["start"] == pytest.approx(0.005, abs=1e-5)
+    assert cap.poll() == []
+    # Oldest rows age out of the ring buffer, no duplicates or losses
+    csr.history = csr.history[2:]
+    csr.add(20, 12)
+    assert [(r["thread_id"], r["event_id"]) for r in cap.poll()] == [(20, 12)]
+    assert cap.captured == 3
+    assert cap.overflows == 0
+
+
+def test_statementCaptureOverflowWithSchema():
+    csr = HistoryCursor(capacity=4)
+    csr.add(20, 1)
+    cap = qw.StatementCapture(csr, schema="ezid")
+    # Other schemas fill the buffer, a seen row remains so nothing is lost
+    for i in range(2, 5):
+        csr.add(30, i, schema="other")
+    assert cap.poll() == []
+    assert cap.overflows == 0
+    # The buffer wraps past the ezid statement 31 between polls
+    csr.add(20, 31)
+    for i in range(5, 9):
+        csr.add(30, i, schema="other")
+    assert cap.poll() == []
+    assert cap.overflows == 1
+    # The poll interval sees the fill of the whole buffer
+    assert cap.unseen == 4
+    csr.add(20, 32)
+    assert [r["event_id"] for r in cap.poll()] == [32]
+    assert cap.overflows == 1
+
+
+def test_statementCaptureIncludeExisting():
+    csr = HistoryCursor()
+    csr.add(20, 5)
+    cap = qw.StatementCapture(csr, skip_existing=False)
+    assert len(cap.poll()) == 1
+
+
+def test_adaptiveInterval():
+    interval = qw.AdaptiveInterval(minimum=0.1, maximum=5.0, target=0.25)
+    assert interval.update(0, 100) == 5.0
+    assert interval.update(50, 100) == 2.5
+    assert interval.update(100, 100) == 0.625
+    for _ in range(10):
+        interval.update(100, 100)
+    assert interval.interval == 0.1
+    assert interval.update(5, 100) == 0.2
+
+
+PLAN = {
+    "query_block": {
+        "select_id": 1,
+        "cost_info": {"query_cost": "120.5"},
+        "ordering_operation": {
+            "using_filesort": True,
+            "nested_loop": [
+                {
+                    "table": {
+                        "table_name": "ezidapp_searchidentifier",
+                        "access_type": "ALL",
+                        "rows_examined_per_scan": 1000,
+                    }
+                },
+                {
+                    "table": {
+                        "table_name": "ezidapp_user",
+                        "access_type": "eq_ref",
+                        "key": "PRIMARY",
+                    }
+                },
+            ],
+        },
+    }
+}
+
+
+def test_planFlags():
+    flags = qw.planFlags(PLAN)
+    assert flags["full_scan"] == ["ezidapp_searchidentifier"]
+    assert flags["filesort"]
+    assert not flags["temporary"]
+    # Estimates do not affect the signature, access paths do
+    changed = json.loads(json.dumps(PLAN))
+    table = changed["query_block"]["ordering_operation"]["nested_loop"][0]["table"]
+    table["rows_examined_per_scan"] = 5
+    assert qw.planFlags(changed)["signature"] == flags["signature"]
+    table["access_type"] = "ref"
+    table["key"] = "owner_id"
+    assert qw.planFlags(changed)["signature"] != flags["signature"]
+
+
+class ExplainConnection(object):
+    def __init__(self, plans):
+        self.database = "ezid"
+        self.plans = plans
+        self.explained = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, q):
+        self.explained.append(q)
+        self._plan = self.plans.pop(0)
+
+    def fetchall(self):
+        return [(json.dumps(self._plan),)]
+
+
+def capturedRecord(digest="d1", latency=2.0, sql="SELECT * FROM t"):
+    return {
+        "digest": digest,
+        "latency": latency,
+        "schema": "ezid",
+        "sql_text": sql,
+        "rows_examined": 1000,
+    }
+
+
+def test_explainerPlanChange(tmp_path):
+    path = str(tmp_path / "plans.json")
+    changed = json.loads(json.dumps(PLAN))
+    changed["query_block"]["ordering_operation"]["using_filesort"] = False
+    db = ExplainConnection([PLAN])
+    explainer = qw.Explainer(db, qw.PlanCache(path), threshold=1.0)
+    assert explainer.explain(capturedRecord(latency=0.5)) is None
+    assert explainer.explain(capturedRecord(sql="UPDATE t SET a=1")) is None
+    res = explainer.explain(capturedRecord())
+    assert db.explained == ["EXPLAIN FORMAT=JSON SELECT * FROM t"]
+    assert res["flags"]["filesort"]
+    assert not res["plan_changed"]
+    # Each digest once per run
+    assert explainer.explain(capturedRecord()) is None
+    explainer.cache.save()
+    # A later run sees a different plan for the same digest
+    db = ExplainConnection([changed])
+    explainer = qw.Explainer(db, qw.PlanCache(path), threshold=1.0)
+    res = explainer.explain(capturedRecord())
+    assert res["plan_changed"]
+    assert res["change"]["previous_flags"]["filesort"]
+    assert not res["change"]["flags"]["filesort"]
+
+
+def test_watcherMetrics(tmp_path):
+    metrics = qw.WatcherMetrics(
+        buckets=[0.01, 0.1, 1.0], max_digests=2, clock=lambda: 110.0
+    )
+    records = [
+        dict(capturedRecord("d1", 0.005), end=100.0),
+        dict(capturedRecord("d1", 0.5), end=101.0),
+        dict(capturedRecord("d2", 3.0, 'SELECT "a"'), end=102.0),
+        dict(capturedRecord("d3", 0.05), end=103.0),
+    ]
+    metrics.observe(records, in_flight=3, poll_duration=0.02)
+    text = metrics.render()
+    assert text.endswith("# EOF\n")
+    lines = text.splitlines()
+    assert "qw_statements_in_flight 3" in lines
+    assert "qw_poll_lag_seconds 10.0" in lines
+    d1 = 'schema="ezid",digest="d1"'
+    assert f'qw_statement_latency_seconds_bucket{{{d1},le="0.01"}} 1' in lines
+    assert f'qw_statement_latency_seconds_bucket{{{d1},le="0.1"}} 1' in lines
+    assert f'qw_statement_latency_seconds_bucket{{{d1},le="1.0"}} 2' in lines
+    assert f'qw_statement_latency_seconds_bucket{{{d1},le="+Inf"}} 2' in lines
+    assert f"qw_statement_latency_seconds_count{{{d1}}} 2" in lines
+    assert f"qw_rows_examined_total{{{d1}}} 2000" in lines
+    # Digests beyond the limit share one series
+    assert 'qw_rows_examined_total{schema="ezid",digest="other"} 1000' in lines
+    assert 'qw_digest_info{digest="d2",text="SELECT \\"a\\""} 1' in lines
+    path = str(tmp_path / "qw.prom")
+    metrics.writeTextfile(path)
+    assert open(path).read() == text
+
+
+def test_metricsServer():
+    metrics = qw.WatcherMetrics()
+    server = qw.metricsServer(metrics, 0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        res = requests.get(url, proxies={"http": None})
+        assert res.status_code == 200
+        assert res.headers["Content-Type"].startswith("application/openmetrics-text")
+        assert "qw_statements_in_flight 0" in res.text
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,27 @@
+import run_queries
+from ezid_query import ezidq
+
+
+def test_queryMatrix():
+    S = ezidq.EzidSearch
+    search = list(run_queries.queryMatrix(managers=(False,)))
+    assert len(search) == len(S.OBJECT_TYPES) * len(S.IDENTIFIER_TYPES)
+    assert all(q["id_status"] is None and q["owner_selected"] is None for q in search)
+    both = list(run_queries.queryMatrix())
+    assert len(both) == len(search) * (
+        1 + len(S.ID_STATUS) * len(S.ADMIN_ONWER_SELECTED_SUBSET)
+    )
+
+
+def test_runMatrix(fake_ezid):
+    cli = ezidq.EzidSearch(base_url=fake_ezid.url, pool_size=4)
+    rows = []
+    summary = run_queries.runMatrix(
+        cli, {"filtered": "t"}, workers=4, managers=(False,), report=rows.append
+    )
+    assert len(rows) == len(ezidq.EzidSearch.OBJECT_TYPES) * 3
+    assert all(r["error"] is None and r["total"] == 1234 for r in rows)
+    by_type = summary["dimensions"]["id_type"]
+    assert set(by_type) == {"None", "ark", "doi"}
+    assert sum(s["count"] for s in by_type.values()) == len(rows)
+    assert len(summary["slowest"]) == 10
@@ -0,0 +1,79 @@
+import pytest
+
+from ezid_query import ezidq
+from ezid_query import searchcache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.t = 1000.0
+
+    def __call__(self):
+        return self.t
+
+
+def test_queryKeyNormalized():
+    a = searchcache.queryKey("http://x/", "search", {"b": 2, "a": "1", "c": None})
+    b = searchcache.queryKey("http://x", "search", {"a": 1, "b": "2"})
+    assert a == b
+    assert a != searchcache.queryKey("http://x", "manage", {"a": 1, "b": 2})
+    assert a != searchcache.queryKey("http://x", "search", {"a": 1, "b": 2}, "apitest")
+
+
+def test_ttlExpiry():
+    clock = FakeClock()
+    c = searchcache.SearchCache(":memory:", ttl=10, clock=clock)
+    c.put("k", "http://x/search", 200, 0.5, "<html>é</html>")
+    assert c.get("k") == {
+        "url": "http://x/search",
+        "status": 200,
+        "elapsed": 0.5,
+        "text": "<html>é</html>",
+    }
+    clock.t += 10
+    assert c.get("k") is None
+    stats = c.stats()
+    assert stats["hits"] == 1
+    assert stats["expirations"] == 1
+    assert stats["size"] == 0
+
+
+def test_sizeBoundedEviction():
+    clock = FakeClock()
+    c = searchcache.SearchCache(":memory:", ttl=None, max_bytes=100, clock=clock)
+    for key in "abc":
+        clock.t += 1
+        # Incompressible enough to take ~40 bytes each
+        c.put(key, "u", 200, 0.1, key * 10 + "".join(map(chr, range(65, 95))))
+        if key == "b":
+            clock.t += 1
+            c.get("a")
+    # "b" was least recently used
+    assert c.get("b") is None
+    assert c.get("a") is not None
+    assert c.get("c") is not None
+    assert c.stats()["evictions"] == 1
+
+
+def test_searchCached(fake_ezid, tmp_path):
+    cache = searchcache.SearchCache(str(tmp_path / "cache.sqlite"))
+    cli = ezidq.EzidSearch(base_url=fake_ezid.url, cache=cache)
+    query = {"keywords": "test", "object_type": None}
+    first = cli.search(query)
+    second = cli.search(query)
+    assert not first["cached"]
+    assert second["cached"]
+    assert second["results"] == first["results"]
+    assert second["elapsed"] == first["elapsed"]
+    assert not cli.search(query, cache_mode=searchcache.MODE_REFRESH)["cached"]
+    assert not cli.search(query, cache_mode=searchcache.MODE_BYPASS)["cached"]
+    stats = cli.cacheStats()
+    assert stats["hits"] == 1
+    assert stats["size"] == 1
+    # Persists across instances
+    cache.close()
+    cli = ezidq.EzidSearch(
+        base_url=fake_ezid.url,
+        cache=searchcache.SearchCache(str(tmp_path / "cache.sqlite")),
+    )
+    assert cli.search(query)["cached"]
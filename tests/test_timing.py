@@ -0,0 +1,80 @@
+import pytest
+
+from ezid_query import apicli
+from ezid_query import ezidq
+from ezid_query import timing
+
+
+def checkPhases(t, new_connection):
+    assert set(timing.PHASES) <= set(t)
+    assert all(t[p] >= 0 for p in timing.PHASES)
+    assert sum(t[p] for p in timing.PHASES) == pytest.approx(t["total"], abs=1e-3)
+    assert t["request_bytes"] > 0
+    assert t["response_header_bytes"] > 0
+    assert t["response_bytes"] > 0
+    assert t["tls"] == 0
+    if new_connection:
+        assert t["new_connections"] == 1
+        assert t["connect"] > 0
+    else:
+        assert t["new_connections"] == 0
+        assert t["dns"] == t["connect"] == 0
+
+
+def test_apiClientTiming(fake_ezid):
+    events = []
+    cli = apicli.EZIDClient(
+        fake_ezid.url,
+        username="apitest",
+        password="apitest",
+        timing_listener=events.append,
+    )
+    first = cli.status()
+    second = cli.status()
+    cli.close()
+    checkPhases(first["timing"], True)
+    checkPhases(second["timing"], False)
+    assert [e["status"] for e in events] == [200, 200]
+    assert events[1]["url"] == f"{fake_ezid.url}/status"
+    assert cli.lastTiming() == second["timing"]
+
+
+def test_apiClientUntimed(fake_ezid):
+    cli = apicli.EZIDClient(fake_ezid.url)
+    assert "timing" not in cli.status()
+    assert cli.lastTiming() is None
+    cli.close()
+
+
+def test_searchTiming(fake_ezid):
+    events = []
+    cli = ezidq.EzidSearch(base_url=fake_ezid.url, timing_listener=events.append)
+    first = cli.search({"keywords": "test"})
+    second = cli.search({"keywords": "test"})
+    checkPhases(first["timing"], True)
+    checkPhases(second["timing"], False)
+    assert len(events) == 2
+    assert events[0]["client"] == "search"
+    assert first["results"]["total"] == fake_ezid.ezid.search_total
+
+
+def test_mintManyTiming(fake_ezid):
+    cli = apicli.EZIDClient(
+        fake_ezid.url, username="apitest", password="apitest", timed=True
+    )
+    records = [{"erc.who": f"test {i}"} for i in range(4)]
+    results = list(cli.mintMany("ark:/99999/fk4", records, workers=2))
+    cli.close()
+    assert [r["status"] for r in results] == ["success"] * 4
+    for r in results:
+        assert r["timing"]["total"] > 0
+        assert r["timing"]["request_bytes"] > 0
+
+
+def test_searchLoginTiming(fake_ezid):
+    cli = ezidq.EzidSearch(base_url=fake_ezid.url, timed=True)
+    res = cli.login("apitest", "apitest")
+    assert res["status"] == 200
+    checkPhases(res["timing"], True)
+    res = cli.logout()
+    checkPhases(res["timing"], False)
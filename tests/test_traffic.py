@@ -0,0 +1,114 @@
+import json
+
+import pytest
+
+from ezid_query import apicli
+from ezid_query import ezidq
+from ezid_query import traffic
+
+
+@pytest.mark.parametrize(
+    "speed,expected",
+    [("original", 1.0), ("max", None), ("4", 4.0), ("2.5x", 2.5)],
+)
+def test_parseSpeed(speed, expected):
+    assert traffic.parseSpeed(speed) == expected
+
+
+def test_parseSpeedInvalid():
+    with pytest.raises(ValueError):
+        traffic.parseSpeed("0")
+
+
+def record(fake_ezid, path, store_bodies=True):
+    with traffic.TrafficRecorder(str(path), store_bodies=store_bodies) as recorder:
+        cli = apicli.EZIDClient(
+            fake_ezid.url, username="apitest", password="apitest", recorder=recorder
+        )
+        cli.status()
+        res = cli.mint("ark:/99999/fk4", cli.anvlArgs({"erc.who": "replay"}))
+        cli.view(res["status_message"].split()[0])
+        cli.close()
+        search = ezidq.EzidSearch(base_url=fake_ezid.url, recorder=recorder)
+        search.search({"keywords": "test", "p": 2})
+
+
+def test_record(fake_ezid, tmp_path):
+    path = tmp_path / "traffic.jsonl"
+    record(fake_ezid, path, store_bodies=False)
+    entries = [json.loads(line) for line in path.read_text().splitlines()]
+    paths = [e["path"] for e in entries if e["status"] != 401]
+    assert paths[0] == "/status"
+    assert paths[1] == "/shoulder/ark:/99999/fk4"
+    assert paths[2].startswith("/id/ark:/99999/fk4")
+    assert paths[3] == "/search"
+    mint = [e for e in entries if e["method"] == "POST"][-1]
+    assert mint["body_len"] > 0
+    assert len(mint["body_sha256"]) == 64
+    assert "body" not in mint
+    assert entries[-1]["params"] == {"keywords": "test", "p": "2"}
+    assert entries[-1]["client"] == "search"
+    assert all(e["t"] >= 0 and e["elapsed"] >= 0 for e in entries)
+    assert "apitest" not in path.read_text()
+
+
+def test_replay(fake_ezid, tmp_path):
+    path = tmp_path / "traffic.jsonl"
+    record(fake_ezid, path)
+    entries = traffic.loadEntries(str(path))
+    rows = []
+    replayer = traffic.Replayer(
+        fake_ezid.url,
+        speed=None,
+        workers=4,
+        username="apitest",
+        password="apitest",
+        report=rows.append,
+    )
+    summary = replayer.run(entries)
+    assert summary["requests"] == len(entries) == len(rows)
+    assert summary["errors"] == 0
+    assert {r["status"] for r in rows if r["path"] != "/status"} <= {200, 201}
+    # No schedule at max speed, so no lag
+    assert "max_lag" not in summary
+    assert not any("lag" in r for r in rows)
+
+
+def test_replayLag(fake_ezid, tmp_path):
+    path = tmp_path / "traffic.jsonl"
+    record(fake_ezid, path)
+    entries = traffic.loadEntries(str(path))
+    rows = []
+    replayer = traffic.Replayer(
+        fake_ezid.url,
+        speed=100.0,
+        username="apitest",
+        password="apitest",
+        report=rows.append,
+    )
+    summary = replayer.run(entries)
+    assert summary["max_lag"] == max(r["lag"] for r in rows)
+    assert all(r["lag"] >= 0 for r in rows)
+
+
+def test_replayBodyNotRecorded(fake_ezid, tmp_path):
+    path = tmp_path / "traffic.jsonl"
+    record(fake_ezid, path, store_bodies=False)
+    entries = traffic.loadEntries(str(path))
+    before = len(fake_ezid.ezid.identifiers)
+    rows = []
+    replayer = traffic.Replayer(
+        fake_ezid.url,
+        speed=None,
+        username="apitest",
+        password="apitest",
+        report=rows.append,
+    )
+    summary = replayer.run(entries)
+    skipped = [r for r in rows if r["error"] == "body not recorded"]
+    assert [r["method"] for r in skipped] == ["POST"]
+    assert skipped[0]["status"] is None
+    assert summary["requests"] == len(entries)
+    assert summary["errors"] == 1
+    # The mint was not sent without its body
+    assert len(fake_ezid.ezid.identifiers) == before